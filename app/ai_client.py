@@ -0,0 +1,361 @@
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+import weakref
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Rate limits, lock timeouts and upstream failures are worth another attempt
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+BACKENDS = ('groq', 'fake')
+
+
+class AIDeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error):
+    groq = sys.modules.get('groq')  # Only errors of a client that was built can show up here
+    if isinstance(error, ConnectionError) or (groq and isinstance(error, groq.APIConnectionError)):  # Or timeout
+        return True
+    return getattr(error, 'status_code', None) in RETRYABLE_STATUS
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['retry-after'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class _Slot:
+    """One held concurrency slot, which its holder can hand back while it waits (e.g. during a backoff)."""
+
+    def __init__(self, slots, deadline, timeout):
+        self._slots = slots
+        self._deadline = deadline
+        self._timeout = timeout
+        self.held = False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=max(0.0, self._deadline - time.monotonic())):
+            raise AIDeadlineExceeded(f"No AI call slot freed up within {self._timeout}s")
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self._slots.release()
+
+
+class _AsyncSlot(_Slot):
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(0.0, self._deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise AIDeadlineExceeded(f"No AI call slot freed up within {self._timeout}s") from None
+        self.held = True
+
+
+async def _close_async_stream(completion):
+    close = getattr(completion, 'aclose', None) or getattr(completion, 'close', None)
+    if close:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+class AIClientManager:
+    """Builds and shares the API clients and applies the call policy around them.
+
+    Every call gets a deadline that covers waiting for a concurrency slot and
+    all of its attempts. Retryable errors are retried with full-jitter
+    exponential backoff (or the server's Retry-After, if longer), so a burst
+    of rate limits spreads out instead of failing every request at once; the
+    slot is handed back while a call backs off. Streams are read until the
+    same deadline (see iter_stream). The
+    clients are built on first use and keep a pool of connections; the SDK
+    is only imported then, which keeps it out of the server's start-up time.
+    """
+
+    def __init__(self, backend='groq', api_key=None, timeout=60.0, connect_timeout=5.0, max_retries=3,
+                 backoff_seconds=0.5, max_backoff_seconds=8.0, max_concurrency=8, pool_size=16, fake_options=None):
+        self._lock = threading.Lock()
+        self.configure(backend, api_key, timeout, connect_timeout, max_retries, backoff_seconds,
+                       max_backoff_seconds, max_concurrency, pool_size, fake_options)
+
+    def configure(self, backend='groq', api_key=None, timeout=60.0, connect_timeout=5.0, max_retries=3,
+                  backoff_seconds=0.5, max_backoff_seconds=8.0, max_concurrency=8, pool_size=16, fake_options=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown AI backend {backend!r}")
+        with self._lock:
+            self.backend = backend
+            self.api_key = api_key
+            self.timeout = timeout
+            self.connect_timeout = connect_timeout
+            self.max_retries = max_retries
+            self.backoff_seconds = backoff_seconds
+            self.max_backoff_seconds = max_backoff_seconds
+            self.max_concurrency = max_concurrency
+            self.pool_size = pool_size
+            self.fake_options = fake_options or {}
+            self._client = None
+            self._async_clients = weakref.WeakKeyDictionary()  # Event loop -> client
+            self._slots = threading.BoundedSemaphore(max_concurrency)
+            self._async_slots = weakref.WeakKeyDictionary()  # Event loop -> asyncio.Semaphore
+
+    def _http_options(self):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        return httpx, limits, httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if self.backend == 'fake':
+                    self._client = FakeClient(**self.fake_options)
+                else:
+                    from groq import Groq
+
+                    httpx, limits, timeout = self._http_options()
+                    # Retries are ours, so the SDK's own are turned off
+                    self._client = Groq(
+                        api_key=self.api_key, max_retries=0, timeout=timeout,
+                        http_client=httpx.Client(limits=limits, timeout=timeout),
+                    )
+            return self._client
+
+    def async_client(self):
+        # httpx async connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                if self.backend == 'fake':
+                    client = AsyncFakeClient(**self.fake_options)
+                else:
+                    from groq import AsyncGroq
+
+                    httpx, limits, timeout = self._http_options()
+                    client = AsyncGroq(
+                        api_key=self.api_key, max_retries=0, timeout=timeout,
+                        http_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+                    )
+                self._async_clients[loop] = client
+            return client
+
+    def deadline(self):
+        return time.monotonic() + self.timeout
+
+    def _backoff(self, attempt, error, deadline):
+        """Return how long to wait before the next attempt, or None to give up."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+        delay = max(delay, _retry_after(error) or 0)
+        if time.monotonic() + delay >= deadline:
+            return None
+        logger.warning(f"AI call failed ({error}), retrying in {delay:.2f}s")
+        return delay
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold one of the max_concurrency call slots, waiting at most until the deadline; yields the slot."""
+        # configure() may swap the semaphore while the slot is held
+        slot = _Slot(self._slots, deadline or self.deadline(), self.timeout)
+        slot.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def call(self, request, deadline=None, slot=None):
+        """Return request(client, timeout), retrying retryable errors until the deadline.
+
+        timeout is the time left for the attempt. The caller holds slot, which
+        is handed back while waiting for the next attempt.
+        """
+        deadline = deadline or self.deadline()
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AIDeadlineExceeded(f"AI call did not finish within {self.timeout}s")
+            try:
+                return request(self.client(), remaining)
+            except Exception as e:
+                delay = self._backoff(attempt, e, deadline)
+                if delay is None:
+                    raise
+            if slot:
+                slot.release()
+            time.sleep(delay)
+            if slot:
+                slot.acquire()
+            attempt += 1
+
+    def iter_stream(self, completion, deadline):
+        """Yield the chunks of a streamed completion; once the deadline passes, close it and raise."""
+        try:
+            for chunk in completion:
+                if time.monotonic() >= deadline:
+                    raise AIDeadlineExceeded(f"AI stream did not finish within {self.timeout}s")
+                yield chunk
+        finally:
+            close = getattr(completion, 'close', None)
+            if close:
+                close()
+
+    def _async_slots_for_loop(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._async_slots.get(loop)
+            if slots is None:
+                slots = self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+            return slots
+
+    @asynccontextmanager
+    async def async_slot(self, deadline=None):
+        """Like slot, for coroutines; each event loop has its own max_concurrency slots."""
+        slot = _AsyncSlot(self._async_slots_for_loop(), deadline or self.deadline(), self.timeout)
+        await slot.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    async def async_call(self, request, deadline=None, slot=None):
+        """Like call, for a coroutine function request(client, timeout)."""
+        deadline = deadline or self.deadline()
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AIDeadlineExceeded(f"AI call did not finish within {self.timeout}s")
+            try:
+                return await request(self.async_client(), remaining)
+            except Exception as e:
+                delay = self._backoff(attempt, e, deadline)
+                if delay is None:
+                    raise
+            if slot:
+                slot.release()
+            await asyncio.sleep(delay)
+            if slot:
+                await slot.acquire()
+            attempt += 1
+
+    async def aiter_stream(self, completion, deadline):
+        """Like iter_stream, for async streams; a chunk that does not arrive by the deadline also ends it."""
+        chunks = completion.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise AIDeadlineExceeded(f"AI stream did not finish within {self.timeout}s") from None
+                yield chunk
+        finally:
+            await _close_async_stream(completion)
+
+
+FAKE_COMPLETION = (
+    "##BEGIN_HTML##\n<!DOCTYPE html>\n<html>\n<head><title>Applet</title></head>\n"
+    "<body>\n<h1>Applet</h1>\n<ul id=\"items\"></ul>\n<script>\n"
+    "const items = JSON.parse(localStorage.getItem('items') || '[]');\n"
+    "for (const item of items) {\n  const li = document.createElement('li');\n"
+    "  li.textContent = item;\n  document.getElementById('items').appendChild(li);\n}\n"
+    "</script>\n</body>\n</html>\n##END_HTML##\n"
+    "##BEGIN_LOCAL_STORAGE##\n{\"items\": \"[]\"}\n##END_LOCAL_STORAGE##"
+)
+FAKE_TRANSCRIPTION = "Make a todo list where I can add and remove items."
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Fake API error {status_code}")
+        self.status_code = status_code
+
+
+class FakeClient:
+    """Stands in for the Groq client with canned answers and simulated latency, for offline benchmarks.
+
+    Completions stream FAKE_COMPLETION in chunk_chars pieces after
+    first_token_seconds, then token_seconds per chunk. A failure_rate share of
+    calls fails with a retryable 503 before answering.
+    """
+
+    def __init__(self, first_token_seconds=0.2, token_seconds=0.002, chunk_chars=16, transcription_seconds=0.3,
+                 failure_rate=0.0, completion=FAKE_COMPLETION, transcription=FAKE_TRANSCRIPTION):
+        self.first_token_seconds = first_token_seconds
+        self.token_seconds = token_seconds
+        self.chunk_chars = chunk_chars
+        self.transcription_seconds = transcription_seconds
+        self.failure_rate = failure_rate
+        self.completion = completion
+        self.transcription = transcription
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._create_transcription))
+
+    def _fail_sometimes(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeAPIError(503)
+
+    def _chunk(self, content):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+    def _pieces(self):
+        return [self.completion[i:i + self.chunk_chars] for i in range(0, len(self.completion), self.chunk_chars)]
+
+    def _create_completion(self, stream=False, timeout=None, **kwargs):
+        self._fail_sometimes()
+        time.sleep(self.first_token_seconds)
+        if not stream:
+            time.sleep(self.token_seconds * len(self._pieces()))
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.completion))])
+        return self._stream()
+
+    def _stream(self):
+        for i, piece in enumerate(self._pieces()):
+            if i:
+                time.sleep(self.token_seconds)
+            yield self._chunk(piece)
+
+    def _create_transcription(self, file=None, timeout=None, **kwargs):
+        self._fail_sometimes()
+        time.sleep(self.transcription_seconds)
+        return SimpleNamespace(text=self.transcription)
+
+
+class AsyncFakeClient(FakeClient):
+    async def _create_completion(self, stream=False, timeout=None, **kwargs):
+        self._fail_sometimes()
+        await asyncio.sleep(self.first_token_seconds)
+        if not stream:
+            await asyncio.sleep(self.token_seconds * len(self._pieces()))
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.completion))])
+        return self._stream()
+
+    async def _stream(self):
+        for i, piece in enumerate(self._pieces()):
+            if i:
+                await asyncio.sleep(self.token_seconds)
+            yield self._chunk(piece)
+
+    async def _create_transcription(self, file=None, timeout=None, **kwargs):
+        self._fail_sometimes()
+        await asyncio.sleep(self.transcription_seconds)
+        return SimpleNamespace(text=self.transcription)
+
+
+ai_clients = AIClientManager()
@@ -1,45 +1,206 @@
 import os
 import re
+import time
 import logging
-from groq import Groq
+
+from app.ai_client import ai_clients
+from app.instrumentation import log_payload, observe_span, span
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Configure the Groq API client
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=GROQ_API_KEY)
-
+GENERATION_MODEL = "llama-3.1-70b-versatile"
+GENERATION_TEMPERATURE = 0.5
+GENERATION_MAX_TOKENS = 2170
+# Small model for changes that only edit the applet's data (see app.routing)
+FAST_GENERATION_MODEL = "llama-3.1-8b-instant"
+TRANSCRIPTION_MODEL = "whisper-large-v3"
 
-def generate_html_from_prompt(prompt):
-    logger.info(f"Sending prompt to Groq API: {prompt}")
 
-    try:
-        completion = client.chat.completions.create(
-            model="llama-3.1-70b-versatile",
+def _completion_request(prompt, model=GENERATION_MODEL, max_tokens=GENERATION_MAX_TOKENS):
+    def request(client, timeout):
+        return client.chat.completions.create(
+            model=model,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.5,
-            max_tokens=2170,
+            temperature=GENERATION_TEMPERATURE,
+            max_tokens=max_tokens,
             top_p=1,
             stream=True,
             stop=None,
+            timeout=timeout,
         )
+    return request
+
+
+def _content(chunk):
+    return chunk.choices[0].delta.content or ""
+
+
+class _CompletionTimer:
+    """Records the time to the first token and the total time of one completion."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = False
+
+    def chunk(self, content):
+        if content and not self.first_token:
+            self.first_token = True
+            observe_span('llm_first_token', time.perf_counter() - self.start)
+
+    def done(self):
+        observe_span('llm_total', time.perf_counter() - self.start)
+
+
+def stream_completion(prompt, on_chunk=None, model=GENERATION_MODEL, max_tokens=GENERATION_MAX_TOKENS):
+    """Run a streamed chat completion and return the full text; on_chunk sees each piece.
+
+    Opening the stream is retried on retryable errors; once chunks have been
+    handed to on_chunk, a failure is raised rather than replayed. The whole
+    stream must finish within the call's deadline.
+    """
+    log_payload(logger, "Sending prompt to Groq API: %s", prompt)
+
+    chunks = []
+    deadline = ai_clients.deadline()
+    with ai_clients.slot(deadline) as slot:
+        timer = _CompletionTimer()
+        completion = ai_clients.call(_completion_request(prompt, model, max_tokens), deadline, slot)
+        for chunk in ai_clients.iter_stream(completion, deadline):
+            content = _content(chunk)
+            timer.chunk(content)
+            chunks.append(content)
+            if on_chunk:
+                on_chunk(content)
+        timer.done()
+
+    full_content = "".join(chunks)
+    log_payload(logger, "Received response from Groq API: %s", full_content)
+    return full_content
+
 
-        full_content = ""
-        for chunk in completion:
-            full_content += chunk.choices[0].delta.content or ""
+async def astream_completion(prompt, on_chunk=None, model=GENERATION_MODEL, max_tokens=GENERATION_MAX_TOKENS):
+    """Like stream_completion, for asyncio callers."""
+    log_payload(logger, "Sending prompt to Groq API: %s", prompt)
 
-        logger.info(f"Received response from Groq API: {full_content}") 
+    chunks = []
+    deadline = ai_clients.deadline()
+    async with ai_clients.async_slot(deadline) as slot:
+        # The async client's create returns a coroutine, which async_call awaits
+        timer = _CompletionTimer()
+        completion = await ai_clients.async_call(_completion_request(prompt, model, max_tokens), deadline, slot)
+        async for chunk in ai_clients.aiter_stream(completion, deadline):
+            content = _content(chunk)
+            timer.chunk(content)
+            chunks.append(content)
+            if on_chunk:
+                on_chunk(content)
+        timer.done()
 
-        html_content = extract_content(full_content, "HTML") or ""  # Ensure empty if no HTML
-        local_storage_content = extract_content(full_content, "LOCAL_STORAGE") or ""  # Ensure empty if no LOCAL_STORAGE
-        
-        return html_content, local_storage_content
+    full_content = "".join(chunks)
+    log_payload(logger, "Received response from Groq API: %s", full_content)
+    return full_content
+
+
+def _html_delta_handler(on_html_delta):
+    if not on_html_delta:
+        return None
+    parser = SectionStreamParser()
+
+    def on_chunk(content):
+        for marker, delta in parser.feed(content):
+            if marker == "HTML":
+                on_html_delta(delta)
+    return on_chunk
+
+
+def _split_applet(full_content):
+    html_content = extract_content(full_content, "HTML") or ""  # Ensure empty if no HTML
+    local_storage_content = extract_content(full_content, "LOCAL_STORAGE") or ""  # Ensure empty if no LOCAL_STORAGE
+    return html_content, local_storage_content
+
+
+def generate_html_from_prompt(prompt, on_html_delta=None):
+    """Generate an applet from prompt; on_html_delta receives the HTML section as it streams in."""
+    try:
+        return _split_applet(stream_completion(prompt, _html_delta_handler(on_html_delta)))
     except Exception as e:
         logger.error(f"Error generating HTML from prompt: {e}")
         raise
 
 
+async def agenerate_html_from_prompt(prompt, on_html_delta=None):
+    """Like generate_html_from_prompt, for asyncio callers."""
+    try:
+        return _split_applet(await astream_completion(prompt, _html_delta_handler(on_html_delta)))
+    except Exception as e:
+        logger.error(f"Error generating HTML from prompt: {e}")
+        raise
+
+
+def generate_storage_from_prompt(prompt, max_tokens):
+    """Generate only the local storage of a changed applet, with the fast model."""
+    try:
+        full_content = stream_completion(prompt, model=FAST_GENERATION_MODEL, max_tokens=max_tokens)
+        return extract_content(full_content, "LOCAL_STORAGE")
+    except Exception as e:
+        logger.error(f"Error generating storage from prompt: {e}")
+        raise
+
+
+def generate_patch_from_prompt(prompt):
+    """Generate a change as (html_patch, storage_patch) sections instead of a full applet."""
+    try:
+        full_content = stream_completion(prompt)
+        return extract_content(full_content, "HTML_PATCH"), extract_content(full_content, "STORAGE_PATCH")
+    except Exception as e:
+        logger.error(f"Error generating patch from prompt: {e}")
+        raise
+
+
+class SectionStreamParser:
+    """Incrementally splits streamed output into ##BEGIN_<MARKER>## ... ##END_<MARKER>## sections.
+
+    Only the undecided tail of the stream is buffered (text that could still be
+    the start of a marker), so feeding n characters costs O(n) overall.
+    """
+
+    BEGIN_PATTERN = re.compile(r"##BEGIN_(\w+)##")
+    MAX_BEGIN_LENGTH = 64
+
+    def __init__(self):
+        self.current = None
+        self._buffer = ""
+
+    def feed(self, text):
+        """Consume text and return the list of (marker, delta) pieces of section content it completed."""
+        deltas = []
+        self._buffer += text
+        while self._buffer:
+            if self.current is None:
+                match = self.BEGIN_PATTERN.search(self._buffer)
+                if not match:
+                    self._buffer = self._buffer[-self.MAX_BEGIN_LENGTH:]
+                    break
+                self.current = match.group(1)
+                self._buffer = self._buffer[match.end():]
+            else:
+                end_marker = f"##END_{self.current}##"
+                index = self._buffer.find(end_marker)
+                if index == -1:
+                    # Hold back what could be the beginning of the end marker
+                    safe = max(0, len(self._buffer) - len(end_marker) + 1)
+                    if safe:
+                        deltas.append((self.current, self._buffer[:safe]))
+                        self._buffer = self._buffer[safe:]
+                    break
+                if index:
+                    deltas.append((self.current, self._buffer[:index]))
+                self._buffer = self._buffer[index + len(end_marker):]
+                self.current = None
+        return deltas
+
+
 def extract_content(full_content, marker):
     match = re.search(fr"##BEGIN_{marker}##(.*?)##END_{marker}##", full_content, re.DOTALL)
     if match:
@@ -49,15 +210,49 @@ def extract_content(full_content, marker):
         return ""
 
 
-def transcribe_audio(file_path):
-    try:
+def _transcription_request(file_path):
+    def request(client, timeout):
+        # Hand over an open file; the client reads it once while building the request.
+        # Each attempt reopens it, since a failed attempt may have consumed it.
         with open(file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(file_path, file.read()),
-                model="whisper-large-v3",
+            return client.audio.transcriptions.create(
+                file=(os.path.basename(file_path), file),
+                model=TRANSCRIPTION_MODEL,
                 response_format="verbose_json",
+                timeout=timeout,
             )
-            return transcription.text
+    return request
+
+
+def _async_transcription_request(file_path):
+    async def request(client, timeout):
+        with open(file_path, "rb") as file:
+            return await client.audio.transcriptions.create(
+                file=(os.path.basename(file_path), file),
+                model=TRANSCRIPTION_MODEL,
+                response_format="verbose_json",
+                timeout=timeout,
+            )
+    return request
+
+
+def transcribe_audio(file_path):
+    try:
+        deadline = ai_clients.deadline()
+        with ai_clients.slot(deadline) as slot, span('transcription'):
+            return ai_clients.call(_transcription_request(file_path), deadline, slot).text
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {e}")
+        raise
+
+
+async def atranscribe_audio(file_path):
+    """Like transcribe_audio, for asyncio callers."""
+    try:
+        deadline = ai_clients.deadline()
+        async with ai_clients.async_slot(deadline) as slot:
+            with span('transcription'):
+                return (await ai_clients.async_call(_async_transcription_request(file_path), deadline, slot)).text
     except Exception as e:
         logger.error(f"Error transcribing audio: {e}")
         raise
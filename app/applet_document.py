@@ -0,0 +1,41 @@
+import re
+import json
+
+# Loaded ahead of the applet's own scripts: the storage change merger shared
+# with the page, the applet's storage, then the localStorage proxy using both
+SHIM_SCRIPTS = (
+    '/static/js/storage_changes.js',
+    '/applet/{uuid}/storage.js',
+    '/static/js/applet_shim.js',
+)
+HEAD_TAG = re.compile(r'<head\b[^>]*>', re.IGNORECASE)
+HTML_TAG = re.compile(r'<html\b[^>]*>', re.IGNORECASE)
+
+# Versioned document URLs never change content, so any cache may keep them
+DOCUMENT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def shim_tags(applet_uuid):
+    return ''.join(f'<script src="{src.format(uuid=applet_uuid)}"></script>' for src in SHIM_SCRIPTS)
+
+
+def build_document(html_content, applet_uuid):
+    """Return the applet's HTML with the storage shim scripts at the start of <head>.
+
+    The storage itself is not part of the document, so the document only
+    changes with the HTML and can be cached by its content hash.
+    """
+    tags = shim_tags(applet_uuid)
+    for tag in (HEAD_TAG, HTML_TAG):
+        match = tag.search(html_content)
+        if match:
+            return html_content[:match.end()] + tags + html_content[match.end():]
+    return tags + html_content
+
+
+def storage_script(storage_data, etag):
+    """Return storage.js: the raw storage JSON and its ETag (quoted, as in the ETag header) for applet_shim.js."""
+    return b''.join((
+        b'window.appletStorage = {"etag": ', json.dumps(f'"{etag}"').encode('utf-8'),
+        b', "data": ', storage_data, b'};\n',
+    ))
@@ -0,0 +1,242 @@
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Page views refresh last_access at most this often, so most views are read-only
+ACCESS_RESOLUTION_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS applets (
+    uuid TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_access REAL,
+    current_version INTEGER,
+    html_size INTEGER,
+    storage_size INTEGER,
+    prompt_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS applets_updated_at ON applets (updated_at);
+CREATE INDEX IF NOT EXISTS applets_last_access ON applets (last_access);
+CREATE TABLE IF NOT EXISTS prompts (
+    uuid TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (uuid, file_name)
+);
+"""
+
+ORDER_COLUMNS = ('updated_at', 'created_at', 'last_access', 'storage_size', 'html_size', 'prompt_count')
+
+# Upsert the applet row and set one or more columns; updated_at follows every write
+_UPSERT = (
+    "INSERT INTO applets (uuid, created_at, updated_at, {columns}) VALUES (?, ?, ?, {placeholders}) "
+    "ON CONFLICT (uuid) DO UPDATE SET updated_at = excluded.updated_at, {assignments}"
+)
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp is not None else None
+
+
+class AppletIndex:
+    """SQLite index of per-applet metadata, kept current by the write paths.
+
+    The applet directories stay the source of truth: the index can be rebuilt
+    from them at any time, and a failed index update is logged rather than
+    failing the write that triggered it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+
+    def configure(self, path):
+        self.path = path
+        self._local = threading.local()  # Drops the connections to a previous path
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connect() as connection:
+                connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared between threads; keep one per thread and path
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(self.path)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            connections[self.path] = connection
+        return connection
+
+    def _write(self, sql, parameters):
+        if not self.path:
+            return
+        try:
+            with self._connect() as connection:
+                connection.execute(sql, parameters)
+        except sqlite3.Error as e:
+            logger.error(f"Applet index update failed: {e}")
+
+    def _set(self, applet_uuid, **columns):
+        now = time.time()
+        self._write(
+            _UPSERT.format(
+                columns=", ".join(columns),
+                placeholders=", ".join("?" for _ in columns),
+                assignments=", ".join(f"{column} = excluded.{column}" for column in columns),
+            ),
+            (applet_uuid, now, now, *columns.values()),
+        )
+
+    def record_html(self, applet_uuid, size):
+        self._set(applet_uuid, html_size=size)
+
+    def record_storage(self, applet_uuid, size):
+        self._set(applet_uuid, storage_size=size)
+
+    def record_version(self, applet_uuid, version):
+        self._set(applet_uuid, current_version=version)
+
+    def record_prompt(self, applet_uuid, file_name, text):
+        if not self.path:
+            return
+        now = time.time()
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO prompts (uuid, file_name, text) VALUES (?, ?, ?)",
+                    (applet_uuid, file_name, text),
+                )
+                connection.execute(
+                    "INSERT INTO applets (uuid, created_at, updated_at, prompt_count) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT (uuid) DO UPDATE SET updated_at = excluded.updated_at, "
+                    "prompt_count = (SELECT COUNT(*) FROM prompts WHERE uuid = excluded.uuid)",
+                    (applet_uuid, now, now),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Applet index update failed: {e}")
+
+    def get(self, applet_uuid, with_prompts=False):
+        """Return the metadata of an applet as a dict, or None if it is not indexed."""
+        if not self.path:
+            return None
+        connection = self._connect()
+        row = connection.execute("SELECT * FROM applets WHERE uuid = ?", (applet_uuid,)).fetchone()
+        if row is None:
+            return None
+        applet = dict(row)
+        if with_prompts:
+            applet['prompts'] = [
+                prompt['text'] for prompt in connection.execute(
+                    "SELECT text FROM prompts WHERE uuid = ? ORDER BY file_name", (applet_uuid,)
+                )
+            ]
+        return applet
+
+    def view(self, applet_uuid):
+        """Return an applet with its prompts for a page view and record the access."""
+        applet = self.get(applet_uuid, with_prompts=True)
+        if applet is not None:
+            now = time.time()
+            if applet['last_access'] is None or now - applet['last_access'] >= ACCESS_RESOLUTION_SECONDS:
+                self._write("UPDATE applets SET last_access = ? WHERE uuid = ?", (now, applet_uuid))
+                applet['last_access'] = now
+        return applet
+
+    def query(self, order_by='updated_at', descending=True, limit=50, offset=0, search=None):
+        """Return (applets, total) for one page of the index, optionally matching prompt text."""
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"Cannot order applets by {order_by!r}")
+        where, parameters = "", []
+        if search:
+            where = "WHERE uuid IN (SELECT uuid FROM prompts WHERE text LIKE ? ESCAPE '\\')"
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            parameters.append(f"%{escaped}%")
+
+        connection = self._connect()
+        total = connection.execute(f"SELECT COUNT(*) FROM applets {where}", parameters).fetchone()[0]
+        rows = connection.execute(
+            f"SELECT * FROM applets {where} ORDER BY {order_by} {'DESC' if descending else 'ASC'}, uuid "
+            "LIMIT ? OFFSET ?",
+            parameters + [limit, offset],
+        ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def rebuild(self, backend):
+        """Re-index every applet of a storage backend and drop rows of missing ones.
+
+        Applets in a cold tier keep their rows as they are. Returns the number
+        of applets indexed. Last access times are kept.
+        """
+        # Imported here: app.versions imports file_manager, which imports this module
+        from app.versions import list_versions
+
+        indexed = set()
+        connection = self._connect()
+        for name in backend.applets():
+            try:
+                uuid.UUID(name)
+            except ValueError:
+                continue
+
+            prompts, times = [], []
+            for file in backend.list(name):
+                if file.endswith('.prompt'):
+                    text, stat = backend.read(name, file)
+                    prompts.append((file, text.decode('utf-8')))
+                    times.append(stat.st_mtime)
+            sizes = {}
+            for file in ('index.html', 'storage.json'):
+                stat = backend.stat(name, file)
+                sizes[file] = stat.st_size if stat else None
+                if stat:
+                    times.append(stat.st_mtime)
+            times = times or [time.time()]
+            versions = list_versions(name)
+
+            with connection:
+                connection.execute("DELETE FROM prompts WHERE uuid = ?", (name,))
+                connection.executemany(
+                    "INSERT INTO prompts (uuid, file_name, text) VALUES (?, ?, ?)",
+                    [(name, file, text) for file, text in prompts],
+                )
+                connection.execute(
+                    "INSERT INTO applets (uuid, created_at, updated_at, current_version, html_size, storage_size, "
+                    "prompt_count) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (uuid) DO UPDATE SET "
+                    "updated_at = excluded.updated_at, current_version = excluded.current_version, "
+                    "html_size = excluded.html_size, storage_size = excluded.storage_size, "
+                    "prompt_count = excluded.prompt_count",
+                    (name, min(times), max(times), versions[-1]['version'] if versions else None,
+                     sizes['index.html'], sizes['storage.json'], len(prompts)),
+                )
+            indexed.add(name)
+
+        cold = set(backend.cold_applets()) if hasattr(backend, 'cold_applets') else set()
+        with connection:
+            stale = [row[0] for row in connection.execute("SELECT uuid FROM applets")
+                     if row[0] not in indexed and row[0] not in cold]
+            for applet_uuid in stale:
+                connection.execute("DELETE FROM prompts WHERE uuid = ?", (applet_uuid,))
+                connection.execute("DELETE FROM applets WHERE uuid = ?", (applet_uuid,))
+        return len(indexed)
+
+
+def to_json(applet):
+    """Return an index row with its timestamps as ISO 8601 strings."""
+    applet = dict(applet)
+    for column in ('created_at', 'updated_at', 'last_access'):
+        applet[column] = _isoformat(applet[column])
+    return applet
+
+
+applet_index = AppletIndex()
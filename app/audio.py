@@ -0,0 +1,87 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Uploads larger than this are spooled to a temporary file while the form is parsed
+SPOOL_MAX_BYTES = 256 * 1024
+
+# Whisper resamples to 16 kHz mono anyway; Opus at this bitrate keeps speech intelligible
+TRANSCODE_ARGS = ['-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '24k', '-application', 'voip']
+TRANSCODE_SUFFIX = '.ogg'
+TRANSCODE_TIMEOUT_SECONDS = 60
+
+
+class HashingReader:
+    """Wrap a binary stream and hash the bytes read through it, so an upload is hashed while it is saved."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+def hash_file(path, chunk_bytes=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def spooled_upload_stream(max_bytes=SPOOL_MAX_BYTES):
+    """Return a file for one uploaded form file that keeps at most max_bytes in memory."""
+    return tempfile.SpooledTemporaryFile(max_size=max_bytes)
+
+
+def find_ffmpeg(path=None):
+    """Return the ffmpeg executable to use, or None if it is not installed."""
+    return shutil.which(path or 'ffmpeg')
+
+
+@contextmanager
+def transcoded_audio(path, ffmpeg):
+    """Yield the path of a temporary 16 kHz mono Opus copy of an audio file, or None if ffmpeg fails."""
+    fd, out_path = tempfile.mkstemp(suffix=TRANSCODE_SUFFIX)
+    os.close(fd)
+    try:
+        try:
+            subprocess.run(
+                [ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', path, *TRANSCODE_ARGS, out_path],
+                check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT_SECONDS,
+            )
+            transcoded = os.path.getsize(out_path) > 0
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not transcode {path}: {e}")
+            transcoded = False
+        yield out_path if transcoded else None
+    finally:
+        os.unlink(out_path)
+
+
+@contextmanager
+def compact_audio(path, ffmpeg=None):
+    """Yield the path of a compact mono version of an audio file to send for transcription.
+
+    The original path is yielded when ffmpeg is missing, fails, or does not
+    produce a smaller file, so transcoding never makes a transcription fail.
+    """
+    if not ffmpeg:
+        yield path
+        return
+
+    with transcoded_audio(path, ffmpeg) as out_path:
+        smaller = out_path is not None and os.path.getsize(out_path) < os.path.getsize(path)
+        yield out_path if smaller else path
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+# A cached file artifact: the bytes (or parsed value) plus the validators computed
+# when it was written, the (mtime_ns, size) of the file it came from and the
+# compressed forms of the bytes by content coding.
+Artifact = namedtuple(
+    'Artifact', ['data', 'etag', 'last_modified', 'signature', 'size', 'value', 'encoded'], defaults=[None]
+)
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total byte size of its entries."""
+
+    def __init__(self, max_bytes, max_entry_fraction=0.25):
+        self.max_bytes = max_bytes
+        self.max_entry_fraction = max_entry_fraction
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes * self.max_entry_fraction:
+                return  # Too large to be worth evicting everything else for
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+artifact_cache = LRUCache(max_bytes=64 * 1024 * 1024)
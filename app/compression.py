@@ -0,0 +1,47 @@
+import gzip
+import logging
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is offered
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Smaller bodies gain less from compression than the headers it adds
+COMPRESS_MIN_BYTES = 512
+
+# (encoding, sidecar file suffix, compress function(data, fast)), most preferred first. Maximum levels
+# suit files written rarely (the HTML); files rewritten on every edit (the storage) are compressed
+# fast, since that happens under the applet lock: gzip-9 takes ~8x as long as gzip-4, brotli-11 seconds
+ENCODINGS = [('gzip', '.gz', lambda data, fast: gzip.compress(data, compresslevel=4 if fast else 9, mtime=0))]
+if brotli is not None:
+    ENCODINGS.insert(0, ('br', '.br', lambda data, fast: brotli.compress(data, quality=4 if fast else 11)))
+
+
+def compress(data, fast=False):
+    """Return {encoding: compressed bytes} for the encodings that make data smaller."""
+    encoded = {}
+    if data is None or len(data) < COMPRESS_MIN_BYTES:
+        return encoded
+    for encoding, _, compress_function in ENCODINGS:
+        compressed = compress_function(data, fast)
+        if len(compressed) < len(data):
+            encoded[encoding] = compressed
+    return encoded
+
+
+def negotiate_encoding(accept_encodings, available):
+    """Pick the encoding to send from a request's Accept-Encoding, or None for identity.
+
+    Among the acceptable encodings the client's highest quality wins and our
+    preference order breaks ties.
+    """
+    best, best_quality = None, 0
+    for encoding, _, _ in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
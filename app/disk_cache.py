@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Content-addressed JSON cache on local disk with a TTL, a size cap and LRU eviction.
+
+    Entries live in <root>/<key[:2]>/<key>.json. The file mtime records the last
+    use (for LRU) and the payload records when the entry was stored (for the TTL).
+    The in-memory index is built from a directory scan on first use.
+    """
+
+    def __init__(self, root, max_bytes, ttl_seconds):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = None  # key -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._miss()
+            return None
+
+        if time.time() - entry.get('stored_at', 0) > self.ttl_seconds:
+            self._discard(key)
+            self._miss()
+            return None
+
+        try:
+            os.utime(path)  # Record the use for LRU eviction across restarts
+        except OSError:
+            pass
+        with self._lock:
+            self._load_index()
+            if key in self._index:
+                self._index.move_to_end(key)
+            self.hits += 1
+        return entry['value']
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = json.dumps({"stored_at": time.time(), "value": value}).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._load_index()
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._index:
+                evicted, size = self._index.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                try:
+                    os.unlink(self._path(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index) if self._index is not None else None,
+                "bytes": self._bytes if self._index is not None else None,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _discard(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._index is not None:
+                self._bytes -= self._index.pop(key, 0)
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    try:
+                        stat = os.stat(os.path.join(dirpath, filename))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, filename[:-len('.json')], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._bytes = sum(self._index.values())
@@ -0,0 +1,144 @@
+import time
+import queue
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class EventHub:
+    """In-process publish/subscribe hub keyed by channel (one channel per applet)."""
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A slow consumer only misses intermediate notifications; the next
+                # delivered event still triggers a full reload on the client.
+                logger.warning(f"Dropping event for slow subscriber on channel {channel}")
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+
+hub = EventHub()
+
+
+def publish_change(applet_uuid, kind, source=None):
+    event = {"type": kind}
+    if source:
+        event["source"] = source
+    hub.publish(str(applet_uuid), event)
+
+
+class PartialContent:
+    """Accumulates content streamed during a generation and publishes it in batches.
+
+    Each 'partial' event carries the text appended since the previous one and
+    the offset it starts at, so subscribers can detect gaps and resynchronise.
+    """
+
+    def __init__(self, applet_uuid, min_interval=0.25):
+        self.channel = str(applet_uuid)
+        self.min_interval = min_interval
+        self._parts = []
+        self._published_parts = 0
+        self._published_length = 0
+        self._last_publish = 0.0
+        self._lock = threading.Lock()
+
+    def append(self, delta):
+        with self._lock:
+            self._parts.append(delta)
+            if time.monotonic() - self._last_publish >= self.min_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def snapshot(self):
+        with self._lock:
+            return "".join(self._parts)
+
+    @property
+    def published(self):
+        with self._lock:
+            return self._published_length > 0
+
+    def _flush(self):
+        pending = "".join(self._parts[self._published_parts:])
+        self._published_parts = len(self._parts)
+        self._last_publish = time.monotonic()
+        if not pending:
+            return
+        hub.publish(self.channel, {"type": "partial", "offset": self._published_length, "html": pending})
+        self._published_length += len(pending)
+
+
+_partials = {}
+_partials_lock = threading.Lock()
+
+
+def begin_partial(applet_uuid):
+    partial = PartialContent(applet_uuid)
+    with _partials_lock:
+        _partials[str(applet_uuid)] = partial
+    return partial
+
+
+def end_partial(applet_uuid, partial, failed=False):
+    """Publish the rest of a generation's content; if it failed, tell subscribers to drop what they got.
+
+    A successful generation is followed by an 'html' event once it is saved;
+    a failed one would leave viewers on truncated HTML, so they get an
+    'aborted' event and reload the current version instead.
+    """
+    partial.flush()
+    with _partials_lock:
+        if _partials.get(str(applet_uuid)) is partial:
+            del _partials[str(applet_uuid)]
+    if failed and partial.published:
+        hub.publish(str(applet_uuid), {"type": "aborted"})
+
+
+def partial_snapshot(applet_uuid):
+    """Return the content generated so far for an applet being generated, or None."""
+    with _partials_lock:
+        partial = _partials.get(str(applet_uuid))
+    return partial.snapshot() if partial else None
+
+
+def format_sse(data, event=None):
+    message = ""
+    if event:
+        message += f"event: {event}\n"
+    for line in data.splitlines() or [""]:
+        message += f"data: {line}\n"
+    return message + "\n"
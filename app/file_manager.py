@@ -1,50 +1,404 @@
 import os
-from datetime import datetime
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import json
 
-INITIAL_PROMPT_TEMPLATE_PATH = "prompts/initial_app.prompt"
-CHANGE_PROMPT_TEMPLATE_PATH = "prompts/change_app.prompt"
+from app.applet_document import build_document
+from app.applet_index import applet_index
+from app.cache import Artifact, artifact_cache
+from app.compression import COMPRESS_MIN_BYTES, ENCODINGS, compress
+from app.events import publish_change
+from app.instrumentation import span
+from app.prompt_templates import template_registry
+from app.storage_backends import FilesystemBackend
 
+logger = logging.getLogger(__name__)
 
-def save_local_storage(local_storage_content, applet_dir):
-    storage_file_path = os.path.join(applet_dir, 'storage.json')
-    with open(storage_file_path, 'w') as f:
-        f.write(local_storage_content)  # Save the local storage content as a string
+INITIAL_PROMPT_TEMPLATE = "initial_app"
+CHANGE_PROMPT_TEMPLATE = "change_app"
+CHANGE_PATCH_PROMPT_TEMPLATE = "change_app_patch"
+CHANGE_STORAGE_PROMPT_TEMPLATE = "change_storage"
 
+HTML_FILE = 'index.html'
+DOCUMENT_FILE = 'document.html'  # HTML_FILE with the storage shim injected
+STORAGE_FILE = 'storage.json'
+# Rewritten on every storage edit, so compressed at a low level (see app.compression)
+FAST_COMPRESSED_FILES = frozenset({STORAGE_FILE})
+EMPTY_STORAGE_CONTENT = '{}'
+STORAGE_HISTORY_LENGTH = 64
+STORAGE_HISTORY_APPLETS = 4096
 
-def save_html_files(html_content, applet_dir):
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
-    index_file_path = os.path.join(applet_dir, 'index.html')
-    index_timestamp_file_path = os.path.join(applet_dir, f'index-{timestamp}.html')
+class StorageConflict(Exception):
+    """A storage patch touched keys that changed since the version it was based on."""
 
-    with open(index_file_path, 'w') as file:
-        file.write(html_content)
+    def __init__(self, etag):
+        super().__init__(f"Storage changed since the base version (now {etag})")
+        self.etag = etag
 
-    with open(index_timestamp_file_path, 'w') as file:
-        file.write(html_content)
 
-    return index_file_path, index_timestamp_file_path
+class StorageTooLarge(Exception):
+    pass
 
 
-def save_transcription(transcription_text, file_path):
-    transcription_file_path = file_path.replace(".webm", ".prompt")
-    with open(transcription_file_path, "w") as text_file:
-        text_file.write(transcription_text)
-    return transcription_file_path
+# Each cache hit costs one stat to compare the file's (mtime_ns, size)
+# signature, so writes by other processes sharing the storage are seen. With
+# revalidation off, cached artifacts are trusted until one of our own write
+# paths replaces them, which is only safe with a single worker process.
+_revalidate_cache = True
+
+# Where applet files live; see app.storage_backends
+_backend = FilesystemBackend('applets')
+
+_applet_locks = weakref.WeakValueDictionary()  # Dropped once no thread uses them
+_applet_locks_guard = threading.Lock()
+_held_locks = threading.local()
+
+
+def configure_artifact_cache(max_bytes, revalidate=True):
+    global _revalidate_cache
+    artifact_cache.resize(max_bytes)
+    _revalidate_cache = revalidate
+
+
+def configure_storage(backend):
+    global _backend
+    _backend = backend
+    artifact_cache.clear()  # Entries of the previous backend may share its keys
+
+
+def storage_backend():
+    return _backend
+
+
+@contextmanager
+def applet_lock(applet_uuid):
+    """Serialise writers of one applet across threads and, where the backend supports it, processes.
+
+    The lock is re-entrant within a thread, so read-modify-write sequences can
+    hold it around calls to the save_* functions, which take it themselves.
+    """
+    held = getattr(_held_locks, 'applets', None)
+    if held is None:
+        held = _held_locks.applets = set()
+    if applet_uuid in held:
+        yield
+        return
+
+    with _applet_locks_guard:
+        thread_lock = _applet_locks.get(applet_uuid)
+        if thread_lock is None:
+            thread_lock = _applet_locks[applet_uuid] = threading.Lock()
+
+    with thread_lock:
+        held.add(applet_uuid)
+        try:
+            with _backend.lock(applet_uuid):
+                yield
+        finally:
+            held.discard(applet_uuid)
+
+
+def applet_exists(applet_uuid):
+    return _backend.exists(applet_uuid)
+
+
+def create_applet(applet_uuid):
+    _backend.create(applet_uuid)
+
+
+def delete_applet(applet_uuid):
+    _backend.remove(applet_uuid)
+
+
+def compute_etag(content):
+    return hashlib.sha256(content).hexdigest()[:32]
+
+
+def _signature(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _parse_storage(raw):
+    try:
+        return raw, json.loads(raw)
+    except ValueError as e:
+        logger.error(f"JSON decoding error: {e}")
+        return EMPTY_STORAGE_CONTENT.encode('utf-8'), {}
+
+
+def _build_artifact(raw, stat, parse=None):
+    data, value = parse(raw) if parse else (raw, None)
+    size = len(data) * (2 if value is not None else 1)  # Rough cost of the parsed copy
+    last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    return Artifact(data, compute_etag(raw), last_modified, _signature(stat), size, value, {})
+
+
+def _with_encoded(artifact, encoded):
+    return artifact._replace(encoded=encoded, size=artifact.size + sum(len(body) for body in encoded.values()))
+
+
+def _read_encoded(applet_uuid, name, artifact, stat):
+    """Return the compressed forms of an artifact read from name.
+
+    Sidecar files (<name>.gz, <name>.br) are written right after the file, so
+    one older than the file belongs to a previous version and is ignored. If
+    none can be used (files saved before sidecars existed, or restored from
+    the cold tier), they are written here once, so later cache fills and
+    other processes read them instead of compressing again.
+    """
+    encoded = {}
+    for encoding, suffix, _ in ENCODINGS:
+        found = _backend.read(applet_uuid, name + suffix)
+        if found is not None and found[1].st_mtime_ns >= stat.st_mtime_ns:
+            encoded[encoding] = found[0]
+    if encoded or len(artifact.data) < COMPRESS_MIN_BYTES:
+        return encoded
+    with applet_lock(applet_uuid):
+        current = _backend.stat(applet_uuid, name)
+        if current is not None and _signature(current) == _signature(stat):
+            return _write_encoded(applet_uuid, name, artifact)
+    # A writer replaced the file meanwhile and wrote its own sidecars; this version is already stale
+    return compress(artifact.data, fast=True)
+
+
+def _write_encoded(applet_uuid, name, artifact):
+    encoded = compress(artifact.data, fast=name in FAST_COMPRESSED_FILES)
+    for encoding, suffix, _ in ENCODINGS:
+        if encoding in encoded:
+            _backend.write(applet_uuid, name + suffix, encoded[encoding])
+        else:
+            _backend.delete(applet_uuid, name + suffix)  # A stale sidecar must not outlive its version
+    return encoded
+
+
+def _cached(key, applet_uuid, name, revalidate=False):
+    artifact = artifact_cache.get(key)
+    if artifact is None or not (revalidate or _revalidate_cache):
+        return artifact
+    stat = _backend.stat(applet_uuid, name)
+    if stat is None or _signature(stat) != artifact.signature:
+        artifact_cache.invalidate(key)
+        return None
+    return artifact
+
+
+def read_artifact(applet_uuid, name, parse=None, revalidate=False, compressed=False):
+    """Return the Artifact for an applet file, from the cache or the backend, or None if it does not exist.
+
+    With compressed, the Artifact also carries the compressed forms of its data.
+    """
+    key = (applet_uuid, name)
+    artifact = _cached(key, applet_uuid, name, revalidate)
+    if artifact is not None:
+        return artifact
+
+    found = _backend.read(applet_uuid, name)
+    if found is None:
+        return None
+    raw, stat = found
+
+    artifact = _build_artifact(raw, stat, parse)
+    if compressed:
+        artifact = _with_encoded(artifact, _read_encoded(applet_uuid, name, artifact, stat))
+    artifact_cache.put(key, artifact, artifact.size)
+    return artifact
+
+
+def write_artifact(applet_uuid, name, content, parse=None, compressed=False):
+    """Atomically write content to an applet file and update the cache with it (write-through).
+
+    With compressed, the compressed forms are written next to the file so they
+    are never computed per request. Callers hold the applet lock, so the cache
+    and the backend are updated in the same order by concurrent writers.
+    """
+    raw = content.encode('utf-8') if isinstance(content, str) else content
+    with span('file_write'):
+        stat = _backend.write(applet_uuid, name, raw)
+        artifact = _build_artifact(raw, stat, parse)
+        if compressed:
+            artifact = _with_encoded(artifact, _write_encoded(applet_uuid, name, artifact))
+    artifact_cache.put((applet_uuid, name), artifact, artifact.size)
+    return artifact
+
+
+def read_applet_html(applet_uuid):
+    return read_artifact(applet_uuid, HTML_FILE, compressed=True)
+
+
+def read_applet_document(applet_uuid):
+    """Return the applet's HTML with the storage shim injected (see app.applet_document), or None.
+
+    The document is written with the HTML; for applets saved before it
+    existed it is built from the HTML on first read.
+    """
+    document = read_artifact(applet_uuid, DOCUMENT_FILE, compressed=True)
+    if document is not None or read_applet_html(applet_uuid) is None:
+        return document
+    with applet_lock(applet_uuid):
+        html = read_applet_html(applet_uuid)  # Again, now that no writer can replace it
+        return write_artifact(
+            applet_uuid, DOCUMENT_FILE, build_document(html.data.decode('utf-8'), applet_uuid), compressed=True
+        )
+
+
+def read_applet_storage(applet_uuid, revalidate=False):
+    return read_artifact(applet_uuid, STORAGE_FILE, parse=_parse_storage, revalidate=revalidate, compressed=True)
+
+
+def read_prompts(applet_uuid):
+    """Return the transcribed prompts of an applet, oldest first."""
+    key = ('prompts', applet_uuid)
+    artifact = artifact_cache.get(key)
+    names = None
+    if artifact is not None and _revalidate_cache:
+        names = [name for name in _backend.list(applet_uuid) if name.endswith('.prompt')]
+        if tuple(names) != artifact.signature:
+            artifact = None
+    if artifact is not None:
+        return artifact.value
+
+    if names is None:
+        names = [name for name in _backend.list(applet_uuid) if name.endswith('.prompt')]
+    prompts = []
+    for name in names:
+        found = _backend.read(applet_uuid, name)
+        if found is not None:
+            prompts.append(found[0].decode('utf-8'))
+
+    size = sum(len(prompt) for prompt in prompts) + 1
+    artifact_cache.put(key, Artifact(None, None, None, tuple(names), size, prompts), size)
+    return prompts
+
+
+# Recent storage versions per applet as (etag, changed keys or None for a full
+# rewrite), used to decide whether a patch based on an older version conflicts.
+_storage_history = OrderedDict()
+_storage_history_lock = threading.Lock()
+
+
+def _record_storage_change(applet_uuid, etag, changed_keys):
+    with _storage_history_lock:
+        history = _storage_history.get(applet_uuid)
+        if history is None:
+            history = _storage_history[applet_uuid] = deque(maxlen=STORAGE_HISTORY_LENGTH)
+            if len(_storage_history) > STORAGE_HISTORY_APPLETS:
+                _storage_history.popitem(last=False)
+        _storage_history.move_to_end(applet_uuid)
+        history.append((etag, changed_keys))
+
+
+def keys_changed_since(applet_uuid, base_etag):
+    """Return the keys changed since base_etag, or None if unknown or fully rewritten."""
+    with _storage_history_lock:
+        history = list(_storage_history.get(applet_uuid, ()))
+
+    changed = set()
+    for etag, keys in reversed(history):
+        if etag == base_etag:
+            return changed
+        if keys is None:
+            return None
+        changed.update(keys)
+    return None
+
+
+def save_local_storage(local_storage_content, applet_uuid, source=None, changed_keys=None):
+    with applet_lock(applet_uuid):
+        # Save the local storage content as a string
+        artifact = write_artifact(applet_uuid, STORAGE_FILE, local_storage_content,
+                                  parse=_parse_storage, compressed=True)
+        _record_storage_change(applet_uuid, artifact.etag, changed_keys)
+    applet_index.record_storage(applet_uuid, artifact.signature[1])
+    publish_change(applet_uuid, 'storage', source=source)
+    return artifact
+
+
+def patch_local_storage(applet_uuid, set_items=None, delete_keys=(), clear=False, base_etag=None,
+                        source=None, max_bytes=None):
+    """Apply key-level changes to an applet's storage; return (the new Artifact, merged).
+
+    If base_etag is given and the storage changed since, the patch is merged
+    as long as none of its keys (or a clear) overlap with those changes;
+    otherwise StorageConflict is raised. merged is true when the result holds
+    changes the writer has not seen: the storage had moved on from base_etag,
+    or no base_etag was given (unless the patch clears the storage).
+    """
+    set_items = set_items or {}
+    touched = set(set_items) | set(delete_keys)
+
+    with applet_lock(applet_uuid):
+        current = read_applet_storage(applet_uuid, revalidate=True)  # Other processes may have written
+        current_etag = current.etag if current else compute_etag(EMPTY_STORAGE_CONTENT.encode('utf-8'))
+
+        if base_etag and base_etag != current_etag:
+            changed = keys_changed_since(applet_uuid, base_etag)
+            if changed is None or clear or changed & touched:
+                raise StorageConflict(current_etag)
+
+        storage = {}
+        if current and isinstance(current.value, dict) and not clear:
+            storage = dict(current.value)
+        storage.update(set_items)
+        for key in delete_keys:
+            storage.pop(key, None)
+
+        content = json.dumps(storage)
+        if max_bytes is not None and len(content) > max_bytes:
+            raise StorageTooLarge(f"Storage of {len(content)} bytes exceeds {max_bytes}")
+        artifact = save_local_storage(content, applet_uuid, source=source, changed_keys=None if clear else touched)
+        return artifact, not clear and base_etag != current_etag
+
+
+def save_html_files(html_content, applet_uuid):
+    # Earlier versions are kept by the version store (app.versions)
+    with applet_lock(applet_uuid):
+        artifact = write_artifact(applet_uuid, HTML_FILE, html_content, compressed=True)
+        write_artifact(applet_uuid, DOCUMENT_FILE, build_document(html_content, applet_uuid), compressed=True)
+
+    applet_index.record_html(applet_uuid, artifact.signature[1])
+    publish_change(applet_uuid, 'html')
+    return artifact
+
+
+def save_audio(applet_uuid, file_name, stream):
+    with span('upload_save'):
+        _backend.write_stream(applet_uuid, file_name, stream)
+
+
+def delete_audio(applet_uuid, file_name):
+    _backend.delete(applet_uuid, file_name)
+
+
+def audio_file_path(applet_uuid, file_name):
+    """Context manager yielding a local path of an uploaded audio file."""
+    return _backend.local_path(applet_uuid, file_name)
+
+
+def save_transcription(transcription_text, applet_uuid, audio_file_name):
+    transcription_file_name = os.path.splitext(audio_file_name)[0] + ".prompt"
+    _backend.write(applet_uuid, transcription_file_name, transcription_text.encode('utf-8'))
+    artifact_cache.invalidate(('prompts', applet_uuid))
+    applet_index.record_prompt(applet_uuid, transcription_file_name, transcription_text)
+    return transcription_file_name
 
 
 def load_and_format_initial_prompt(transcription_text):
-    with open(INITIAL_PROMPT_TEMPLATE_PATH, "r") as template_file:
-        prompt_template = template_file.read()
-    formatted_prompt = prompt_template.replace("{description}", transcription_text)
-    return formatted_prompt
-
-
-def load_and_format_change_prompt(transcription_text, current_html, current_local_storage):
-    with open(CHANGE_PROMPT_TEMPLATE_PATH, "r") as template_file:
-        prompt_template = template_file.read()
-    formatted_prompt = prompt_template.replace("{description}", transcription_text)
-    formatted_prompt = formatted_prompt.replace("{current_html}", current_html)
-    formatted_prompt = formatted_prompt.replace("{current_local_storage}", json.dumps(current_local_storage))  # Ensure it's a string
-    return formatted_prompt
+    with span('prompt_format'):
+        return template_registry.render(INITIAL_PROMPT_TEMPLATE, description=transcription_text)
+
+
+def load_and_format_change_prompt(transcription_text, current_html, current_local_storage,
+                                  template=CHANGE_PROMPT_TEMPLATE):
+    with span('prompt_format'):
+        return template_registry.render(
+            template,
+            description=transcription_text,
+            current_html=current_html,
+            current_local_storage=json.dumps(current_local_storage),  # Ensure it's a string
+        )
@@ -0,0 +1,137 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+# Seconds; from sub-millisecond file writes to model calls of a minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            labels = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {values[-1]}")
+        return lines
+
+
+def render_family(name, kind, help_text, samples):
+    """Render a counter or gauge from (labels dict, value) samples collected at scrape time."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+    return lines
+
+
+SPAN_SECONDS = Histogram(
+    'applet_span_seconds', 'Time spent in instrumented steps of request handling and jobs.', ('span',)
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'applet_http_request_seconds', 'Time to build HTTP responses, by endpoint.', ('endpoint', 'method', 'status')
+)
+JOB_STAGE_SECONDS = Histogram(
+    'applet_job_stage_seconds', 'Time spent in each stage of create and change jobs.', ('kind', 'stage')
+)
+
+
+def observe_span(name, seconds):
+    SPAN_SECONDS.observe(seconds, span=name)
+
+
+@contextmanager
+def span(name):
+    """Time the block into applet_span_seconds{span=name}, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(name, time.perf_counter() - start)
+
+
+class StageTimer:
+    """Times the stages of one job into applet_job_stage_seconds and keeps them for the job's result.
+
+    Stages may run on other threads (the prefetch runs beside transcription),
+    so the sum of the stages can exceed the job's wall time.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.seconds = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            JOB_STAGE_SECONDS.observe(elapsed, kind=self.kind, stage=name)
+
+    def to_dict(self):
+        timings = {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.seconds.items()}
+        timings["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        return timings
+
+
+# Share of requests whose payloads (prompts, model output, storage) are logged
+_payload_sample_rate = 0.0
+
+
+def configure_payload_logging(sample_rate):
+    global _payload_sample_rate
+    _payload_sample_rate = sample_rate
+
+
+def log_payload(logger, message, *args):
+    """Log a message carrying a payload for a sample of calls only.
+
+    Formatting is left to logging, so unsampled calls never build the string.
+    """
+    if _payload_sample_rate and random.random() < _payload_sample_rate:
+        logger.info(message, *args)
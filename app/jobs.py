@@ -0,0 +1,121 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobError(Exception):
+    """A job failure whose message is safe to show to the client."""
+
+
+class Job:
+    def __init__(self, kind, applet_uuid=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.applet_uuid = applet_uuid
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "uuid": self.applet_uuid,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Bounded in-memory job queue executed by a pool of worker threads.
+
+    Transcription and generation spend their time waiting on the network, so
+    threads are enough to keep request workers free.
+    """
+
+    def __init__(self, workers=4, max_queued=16, max_finished=1000):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='applet-job')
+        self._jobs = OrderedDict()
+        self._outstanding = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, applet_uuid=None, error_message="Job failed", **kwargs):
+        job = Job(kind, applet_uuid)
+        with self._lock:
+            if self._outstanding >= self.workers + self.max_queued:
+                raise JobQueueFull(f"{self._outstanding} jobs outstanding")
+            self._outstanding += 1
+            self._jobs[job.id] = job
+            self._prune()
+
+        self._executor.submit(self._run, job, func, args, kwargs, error_message)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def outstanding(self):
+        with self._lock:
+            return self._outstanding
+
+    def busy_applets(self):
+        """UUIDs of the applets with a queued or running job."""
+        with self._lock:
+            return {job.applet_uuid for job in self._jobs.values() if not job.finished and job.applet_uuid}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, func, args, kwargs, error_message):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = func(*args, **kwargs)
+            job.status = 'succeeded'
+        except JobError as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = error_message
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._outstanding -= 1
+            job._done.set()
+
+    def _prune(self):
+        # Keep the most recent finished jobs around for status lookups
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
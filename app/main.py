@@ -1,133 +1,668 @@
 import os
 import uuid
+import time
+import queue
 import logging
 import json
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from datetime import datetime
 from flask import (
+    Blueprint,
     Flask,
+    Request,
+    current_app,
+    g,
     request,
     jsonify,
+    redirect,
     render_template,
-    send_file,
-    json as flask_json,
+    url_for,
 )
 from flask_talisman import Talisman
+from werkzeug.http import is_resource_modified, unquote_etag
 from werkzeug.utils import secure_filename
 
 
-from app.ai_manager import generate_html_from_prompt, transcribe_audio
+from app.ai_manager import (
+    GENERATION_MODEL,
+    FAST_GENERATION_MODEL,
+    GENERATION_MAX_TOKENS,
+    GENERATION_TEMPERATURE,
+    TRANSCRIPTION_MODEL,
+    generate_html_from_prompt,
+    generate_patch_from_prompt,
+    generate_storage_from_prompt,
+    transcribe_audio,
+)
+from app.ai_client import ai_clients
+from app.applet_document import DOCUMENT_CACHE_CONTROL, storage_script
+from app.applet_index import applet_index, to_json
+from app.audio import (
+    SPOOL_MAX_BYTES,
+    HashingReader,
+    compact_audio,
+    find_ffmpeg,
+    hash_file,
+    spooled_upload_stream,
+)
+from app.cache import artifact_cache
+from app.compression import negotiate_encoding
+from app.disk_cache import DiskCache, cache_key
+from app.events import hub, begin_partial, end_partial, format_sse, partial_snapshot
+from app.instrumentation import (
+    HTTP_REQUEST_SECONDS,
+    JOB_STAGE_SECONDS,
+    SPAN_SECONDS,
+    StageTimer,
+    configure_payload_logging,
+    log_payload,
+    render_family,
+    span,
+)
+from app.jobs import JobError, JobQueue, JobQueueFull
+from app.maintenance import maintainer
+from app.patching import PatchError, apply_change_patch
+from app.prompt_templates import template_registry
+from app.routing import (
+    DATA_CHANGE,
+    StorageChangeError,
+    classify_change,
+    storage_token_budget,
+    validate_storage_change,
+)
+from app.storage_backends import ColdTier, create_backend
+from app.versions import (
+    VersionError,
+    configure_versions,
+    get_version,
+    list_versions,
+    read_version,
+    record_version,
+    rollback_version,
+)
 from app.file_manager import (
+    CHANGE_PATCH_PROMPT_TEMPLATE,
+    CHANGE_PROMPT_TEMPLATE,
+    CHANGE_STORAGE_PROMPT_TEMPLATE,
+    EMPTY_STORAGE_CONTENT,
+    INITIAL_PROMPT_TEMPLATE,
+    StorageConflict,
+    StorageTooLarge,
+    applet_exists,
+    audio_file_path,
+    compute_etag,
+    configure_artifact_cache,
+    configure_storage,
+    create_applet,
+    delete_applet,
+    delete_audio,
     load_and_format_initial_prompt,
     load_and_format_change_prompt,
+    read_applet_document,
+    read_applet_html,
+    read_applet_storage,
+    patch_local_storage,
+    read_prompts,
+    save_audio,
     save_html_files,
     save_local_storage,
     save_transcription,
+    storage_backend,
 )
 
 
-app = Flask(__name__)
+bp = Blueprint('applets', __name__, cli_group=None)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Werkzeug copies uploads here chunk by chunk; bound what stays in memory
+        return spooled_upload_stream(current_app.config['AUDIO_SPOOL_MAX_BYTES'])
+
+
+def load_config(config):
+    """Read the configuration from the environment into config."""
+    config['UPLOAD_DIR'] = os.getenv('UPLOAD_DIR', 'applets')
+    config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB limit
+    config['AUDIO_SPOOL_MAX_BYTES'] = int(os.getenv('AUDIO_SPOOL_MAX_BYTES', SPOOL_MAX_BYTES))
+    # Send recordings to Whisper as 16 kHz mono Opus when ffmpeg is available
+    config['AUDIO_TRANSCODE'] = os.getenv('AUDIO_TRANSCODE', '0') == '1'
+    config['FFMPEG_PATH'] = os.getenv('FFMPEG_PATH', 'ffmpeg')
+    config['EVENTS_KEEPALIVE_SECONDS'] = 15
+    config['EVENTS_MAX_STREAM_SECONDS'] = 300  # Clients reconnect transparently after this
+    config['ARTIFACT_CACHE_MAX_BYTES'] = int(os.getenv('ARTIFACT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # One stat() per cache hit; turn off only with a single worker process per UPLOAD_DIR
+    config['ARTIFACT_CACHE_REVALIDATE'] = os.getenv('ARTIFACT_CACHE_REVALIDATE', '1') == '1'
+    config['STORAGE_FSYNC'] = os.getenv('STORAGE_FSYNC', '0') == '1'  # Durable writes at the cost of latency
+    # 'filesystem' (one directory per applet in UPLOAD_DIR; also for workers on several hosts), 'sqlite'
+    # (one database at STORAGE_SQLITE_PATH, shared by the worker processes of one host) or 'memory'
+    # (nothing persists; for tests)
+    config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'filesystem')
+    config['STORAGE_SQLITE_PATH'] = os.getenv('STORAGE_SQLITE_PATH')  # Default: <UPLOAD_DIR>/applets.sqlite3
+    config['CACHE_DIR'] = os.path.abspath(os.getenv('CACHE_DIR', 'cache'))
+    config['PROMPT_CACHE_ENABLED'] = os.getenv('PROMPT_CACHE_ENABLED', '1') == '1'
+    config['PROMPT_CACHE_MAX_BYTES'] = int(os.getenv('PROMPT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    config['PROMPT_CACHE_TTL_SECONDS'] = int(os.getenv('PROMPT_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+    config['TRANSCRIPTION_CACHE_ENABLED'] = os.getenv('TRANSCRIPTION_CACHE_ENABLED', '1') == '1'
+    config['TRANSCRIPTION_CACHE_MAX_BYTES'] = int(os.getenv('TRANSCRIPTION_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    config['TRANSCRIPTION_CACHE_TTL_SECONDS'] = int(os.getenv('TRANSCRIPTION_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+    # 'patch' asks the model for SEARCH/REPLACE blocks and a JSON patch instead of the whole applet
+    config['CHANGE_MODE'] = os.getenv('CHANGE_MODE', 'full')
+    # Send changes that only edit the stored data to the small model with a storage-only prompt
+    config['FAST_CHANGE_ROUTING'] = os.getenv('FAST_CHANGE_ROUTING', '0') == '1'
+    config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 4))  # Concurrent transcription/generation jobs
+    config['JOB_QUEUE_MAX'] = int(os.getenv('JOB_QUEUE_MAX', 16))  # Jobs waiting for a worker before we answer 503
+    # Store each applet version as a zlib delta against the previous one
+    config['VERSION_DELTA_COMPRESSION'] = os.getenv('VERSION_DELTA_COMPRESSION', '1') == '1'
+    config['APPLET_INDEX_PATH'] = os.getenv('APPLET_INDEX_PATH')  # Default: <UPLOAD_DIR>/index.sqlite3
+    # Bearer token for the endpoints that list all applets; they are disabled without one
+    config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN', '')
+    config['AI_BACKEND'] = os.getenv('AI_BACKEND', 'groq')  # 'fake' answers offline with simulated latency
+    # Latencies and failure rate of the fake backend, e.g. {"first_token_seconds": 0.3}; see app.ai_client.FakeClient
+    config['AI_FAKE_OPTIONS'] = json.loads(os.getenv('AI_FAKE_OPTIONS', '{}'))
+    config['AI_TIMEOUT_SECONDS'] = float(os.getenv('AI_TIMEOUT_SECONDS', 60))  # Per call, retries included
+    config['AI_MAX_RETRIES'] = int(os.getenv('AI_MAX_RETRIES', 3))
+    config['AI_MAX_CONCURRENCY'] = int(os.getenv('AI_MAX_CONCURRENCY', 8))
+    config['AI_POOL_SIZE'] = int(os.getenv('AI_POOL_SIZE', 16))  # Kept-alive HTTP connections
+    # Background maintenance (see app.maintenance); `flask maintain` runs a full cycle on demand
+    config['MAINTENANCE_INTERVAL_SECONDS'] = float(os.getenv('MAINTENANCE_INTERVAL_SECONDS', 0))  # 0: no thread
+    config['MAINTENANCE_BATCH'] = int(os.getenv('MAINTENANCE_BATCH', 100))  # Applets per pass
+    config['MAINTENANCE_IO_BYTES_PER_SECOND'] = int(os.getenv('MAINTENANCE_IO_BYTES_PER_SECOND', 4 * 1024 * 1024))
+    config['AUDIO_RETENTION'] = os.getenv('AUDIO_RETENTION', 'compress')  # 'compress', 'drop' or 'keep'
+    config['AUDIO_RETENTION_DAYS'] = float(os.getenv('AUDIO_RETENTION_DAYS', 7))
+    config['VERSIONS_KEEP_UNPACKED'] = int(os.getenv('VERSIONS_KEEP_UNPACKED', 20))  # 0: never pack
+    config['APPLET_QUOTA_BYTES'] = int(os.getenv('APPLET_QUOTA_BYTES', 0))  # 0: no quota
+    config['HOT_STORAGE_QUOTA_BYTES'] = int(os.getenv('HOT_STORAGE_QUOTA_BYTES', 0))  # 0: no quota
+    config['COLD_AFTER_DAYS'] = float(os.getenv('COLD_AFTER_DAYS', 30))  # 0: only the hot quota sends applets cold
+    config['COLD_STORAGE_DIR'] = os.getenv('COLD_STORAGE_DIR')  # Default: <UPLOAD_DIR>/.cold
+    # Share of requests whose prompts, model output and storage payloads are logged (0 to 1)
+    config['LOG_PAYLOAD_SAMPLE_RATE'] = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0))
 
-# Configuration
-app.config['UPLOAD_DIR'] = os.path.abspath(os.getenv('UPLOAD_DIR', 'applets'))
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB limit
-os.makedirs(app.config['UPLOAD_DIR'], exist_ok=True)
 
+logger = logging.getLogger(__name__)
 
-# Security
-talisman = Talisman(app, force_https=False, content_security_policy={
-    'default-src': ["'self'"],
-    'script-src': ["'self'", "'unsafe-inline'"],  # Allow inline scripts
-    'style-src': ["'self'", 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/', "'unsafe-inline'"],  # Allow inline styles
-    'font-src': ["'self'", 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/']
-})
+EMPTY_STORAGE_ETAG = compute_etag(EMPTY_STORAGE_CONTENT.encode('utf-8'))
+MAX_STORAGE_BYTES = 10 * 1024 * 1024  # 10 MB limit
 
-# Set up logging
+_disk_caches = {}
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+
+def get_disk_cache(name, max_bytes, ttl_seconds):
+    root = os.path.join(current_app.config['CACHE_DIR'], name)
+    if root not in _disk_caches:
+        _disk_caches.setdefault(root, DiskCache(root, max_bytes, ttl_seconds))
+    return _disk_caches[root]
+
+
+def get_prompt_cache():
+    if not current_app.config['PROMPT_CACHE_ENABLED']:
+        return None
+    return get_disk_cache(
+        'prompts', current_app.config['PROMPT_CACHE_MAX_BYTES'], current_app.config['PROMPT_CACHE_TTL_SECONDS']
+    )
 
 
-def get_applet_dir(applet_uuid):
-    return os.path.join(app.config['UPLOAD_DIR'], str(applet_uuid))
+def get_transcription_cache():
+    if not current_app.config['TRANSCRIPTION_CACHE_ENABLED']:
+        return None
+    return get_disk_cache(
+        'transcriptions',
+        current_app.config['TRANSCRIPTION_CACHE_MAX_BYTES'],
+        current_app.config['TRANSCRIPTION_CACHE_TTL_SECONDS'],
+    )
 
 
-@app.route('/')
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or 'unmatched', method=request.method, status=response.status_code,
+        )
+    return response
+
+
+@bp.route('/')
 def home():
     return render_template('index.html')
 
 
-@app.route('/applet/<uuid:applet_uuid>', methods=['GET'])
+@bp.route('/applet/<uuid:applet_uuid>', methods=['GET'])
 def show_applet(applet_uuid):
-    applet_dir = get_applet_dir(applet_uuid)
-    if not os.path.exists(applet_dir):
+    applet_uuid = str(applet_uuid)
+    applet = applet_index.view(applet_uuid)
+    if applet is not None:
+        return render_template('applet.html', uuid=applet_uuid, prompts=applet['prompts'])
+
+    # Applets created before the index existed, until `flask rebuild-index` runs
+    if not applet_exists(applet_uuid):
         return jsonify({"error": "Applet not found"}), 404
 
-    prompts = []
     try:
-        for file in sorted(os.listdir(applet_dir)):
-            if file.endswith('.prompt'):
-                with open(os.path.join(applet_dir, file), 'r') as f:
-                    prompts.append(f.read())
+        prompts = read_prompts(applet_uuid)
     except Exception as e:
-        logger.error(f"Error reading prompts from {applet_dir}: {e}")
+        logger.error(f"Error reading prompts of applet {applet_uuid}: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
     return render_template('applet.html', uuid=applet_uuid, prompts=prompts)
 
 
-@app.route('/applet/<uuid:applet_uuid>/html', methods=['GET', 'HEAD'])
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators still match, otherwise None."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return current_app.response_class(status=304)
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def send_artifact(body, etag, last_modified, mimetype, encoded=None):
+    """Respond with body, or its precompressed form if the client accepts one.
+
+    Compressed representations get a weak ETag: it still validates
+    If-None-Match, and the content hash stays usable as a storage base.
+    """
+    encoding = negotiate_encoding(request.accept_encodings, encoded or {})
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = current_app.response_class(encoded[encoding] if encoding else body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if encoded:
+        response.vary.add('Accept-Encoding')
+
+    set_validators(response, etag, last_modified)
+    if encoding:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@bp.route('/applet/<uuid:applet_uuid>/html', methods=['GET', 'HEAD'])
 def show_applet_html(applet_uuid):
-    applet_dir = get_applet_dir(applet_uuid)
-    index_file_path = os.path.join(applet_dir, 'index.html')
+    applet_uuid = str(applet_uuid)
+
+    html = read_applet_html(applet_uuid)
+    if html is None:
+        return jsonify({"error": "HTML file not found"}), 404
 
+    return send_artifact(html.data, html.etag, html.last_modified, 'text/html', html.encoded)
 
-    if not os.path.exists(index_file_path):
+
+@bp.route('/applet/<uuid:applet_uuid>/document', methods=['GET', 'HEAD'])
+def show_applet_document(applet_uuid):
+    """The current applet document, revalidated on every use; its ETag names the versioned URL."""
+    document = read_applet_document(str(applet_uuid))
+    if document is None:
         return jsonify({"error": "HTML file not found"}), 404
-    
 
-    file_mtime = os.path.getmtime(index_file_path)
-    last_modified = datetime.fromtimestamp(file_mtime).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return send_artifact(document.data, document.etag, document.last_modified, 'text/html', document.encoded)
 
-    if request.method == 'HEAD':
-        response = app.response_class(status=200)
-    else:
-        response = send_file(os.path.abspath(index_file_path))
 
-    response.headers['Last-Modified'] = last_modified
+@bp.route('/applet/<uuid:applet_uuid>/document/<version>', methods=['GET', 'HEAD'])
+def show_applet_document_version(applet_uuid, version):
+    """The applet document under its content hash, cacheable for good.
 
+    An outdated version redirects to the current one, since only the
+    current document is kept.
+    """
+    document = read_applet_document(str(applet_uuid))
+    if document is None:
+        return jsonify({"error": "HTML file not found"}), 404
+    if version != document.etag:
+        response = redirect(url_for('.show_applet_document_version', applet_uuid=applet_uuid, version=document.etag))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    response = send_artifact(document.data, document.etag, document.last_modified, 'text/html', document.encoded)
+    response.headers['Cache-Control'] = DOCUMENT_CACHE_CONTROL
     return response
 
-@app.route('/applet/<uuid:applet_uuid>/storage', methods=['GET', 'HEAD'])
-def get_applet_storage(applet_uuid):
-    applet_dir = get_applet_dir(applet_uuid)
-    storage_file_path = os.path.join(applet_dir, 'storage.json')
 
-    if not os.path.exists(storage_file_path):
-        if request.method == 'HEAD':
-            return '', 200
-        return jsonify({}), 200
+@bp.route('/applet/<uuid:applet_uuid>/storage.js', methods=['GET', 'HEAD'])
+def get_applet_storage_script(applet_uuid):
+    """The applet's storage as a script for its document, revalidated on every load like the JSON form."""
+    applet_uuid = str(applet_uuid)
+
+    try:
+        storage = read_applet_storage(applet_uuid)
+    except Exception as e:
+        logger.error(f"Error reading storage: {e}")
+        return jsonify({"error": "Failed to read storage"}), 500
+
+    if storage is None:
+        if not applet_exists(applet_uuid):
+            return jsonify({"error": "Applet not found"}), 404
+        body = storage_script(EMPTY_STORAGE_CONTENT.encode('utf-8'), EMPTY_STORAGE_ETAG)
+        return send_artifact(body, EMPTY_STORAGE_ETAG, None, 'application/javascript')
+    body = storage_script(storage.data, storage.etag)
+    return send_artifact(body, storage.etag, storage.last_modified, 'application/javascript')
+
 
-    file_mtime = os.path.getmtime(storage_file_path)
-    last_modified = datetime.fromtimestamp(file_mtime).strftime('%a, %d %b %Y %H:%M:%S GMT')
+@bp.route('/applet/<uuid:applet_uuid>/storage', methods=['GET', 'HEAD'])
+def get_applet_storage(applet_uuid):
+    applet_uuid = str(applet_uuid)
 
     try:
-        with open(storage_file_path, 'r') as f:
-            storage_data = flask_json.load(f)
-    except json.JSONDecodeError as e:  
-        logger.error(f"JSON decoding error: {e}")
-        return jsonify({}), 200  
+        storage = read_applet_storage(applet_uuid)
     except Exception as e:
         logger.error(f"Error reading storage: {e}")
         return jsonify({"error": "Failed to read storage"}), 500
 
-    response = jsonify(storage_data)
-    response.headers['Last-Modified'] = last_modified
+    if storage is None:
+        return send_artifact(EMPTY_STORAGE_CONTENT, EMPTY_STORAGE_ETAG, None, 'application/json')
+    return send_artifact(storage.data, storage.etag, storage.last_modified, 'application/json', storage.encoded)
+
+
+@bp.route('/applet/<uuid:applet_uuid>/events', methods=['GET'])
+def applet_events(applet_uuid):
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
+        return jsonify({"error": "Applet not found"}), 404
+
+    channel = str(applet_uuid)
+    subscriber = hub.subscribe(channel)
+    keepalive = current_app.config['EVENTS_KEEPALIVE_SECONDS']
+    deadline = time.monotonic() + current_app.config['EVENTS_MAX_STREAM_SECONDS']
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            snapshot = partial_snapshot(channel)
+            if snapshot:
+                # Late subscribers catch up on a generation that is already streaming
+                yield format_sse(json.dumps({"type": "partial", "offset": 0, "html": snapshot}), event='partial')
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = subscriber.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(json.dumps(event), event=event['type'])
+        finally:
+            hub.unsubscribe(channel, subscriber)
+
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
     return response
 
 
 
-@app.route('/applet', methods=['POST'])
+def normalize_transcription(text):
+    """Drop what a re-recorded request varies in but does not change: case, spacing and trailing punctuation."""
+    return " ".join(text.casefold().split()).rstrip(" .!?,;:…")
+
+
+def prompt_key(template, transcription_text, *context):
+    """The prompt's part of a generation cache key.
+
+    Keyed on the template (and its text) and the normalized transcription
+    rather than the formatted prompt, so near-identical requests share an
+    entry. context is the rest of what the template is rendered with.
+    """
+    return (template, template_registry.get(template).digest, normalize_transcription(transcription_text), *context)
+
+
+def cached_generation(formatted_prompt, generate, key, *key_parts, check=None):
+    """Run generate(formatted_prompt) through the prompt cache.
+
+    Results are cached on disk by key (see prompt_key), model and
+    temperature, so repeated requests are answered without calling the model.
+    A fresh result is cached only if check(result), when given, does not raise.
+    """
+    prompt_cache = get_prompt_cache()
+    key = cache_key(*key, GENERATION_MODEL, GENERATION_TEMPERATURE, *key_parts)
+    if prompt_cache:
+        cached = prompt_cache.get(key)
+        if cached is not None:
+            logger.info(f"Prompt cache hit (hit rate {prompt_cache.stats()['hit_rate']:.2f})")
+            return tuple(cached)
+
+    result = generate(formatted_prompt)
+    if check:
+        check(result)
+    if prompt_cache and any(result):
+        prompt_cache.set(key, list(result))
+    return result
+
+
+def generate_streaming(applet_uuid, formatted_prompt, key):
+    """Generate an applet while forwarding the HTML to its change feed as it streams in."""
+    def generate(prompt):
+        partial = begin_partial(applet_uuid)
+        failed = True
+        try:
+            result = generate_html_from_prompt(prompt, on_html_delta=partial.append)
+            failed = False
+            return result
+        finally:
+            end_partial(applet_uuid, partial, failed=failed)
+
+    return cached_generation(formatted_prompt, generate, key)
+
+
+def generate_storage_change(applet_uuid, transcription_text, current_local_storage):
+    """Try a data-only change with the fast model; return the new storage, or None to use the large model."""
+    max_tokens = storage_token_budget(current_local_storage, GENERATION_MAX_TOKENS)
+    if max_tokens is None:
+        return None
+    formatted_prompt = load_and_format_change_prompt(
+        transcription_text, None, current_local_storage, template=CHANGE_STORAGE_PROMPT_TEMPLATE
+    )
+    try:
+        with span('fast_change'):
+            (content,) = cached_generation(
+                formatted_prompt, lambda prompt: (generate_storage_from_prompt(prompt, max_tokens),),
+                prompt_key(CHANGE_STORAGE_PROMPT_TEMPLATE, transcription_text, json.dumps(current_local_storage)),
+                'storage', FAST_GENERATION_MODEL,
+                check=lambda result: validate_storage_change(result[0], current_local_storage),
+            )
+        return validate_storage_change(content, current_local_storage)
+    except StorageChangeError as e:
+        logger.warning(f"Fast change of applet {applet_uuid} failed validation, using the large model: {e}")
+    except Exception as e:
+        logger.warning(f"Fast change of applet {applet_uuid} failed, using the large model: {e}")
+    return None
+
+
+def generate_change(applet_uuid, transcription_text, current_html_content, current_local_storage):
+    """Generate the new (html_content, local_storage_content) of a changed applet.
+
+    With fast routing, changes classified as data-only are answered by the
+    small model from the storage alone; the HTML is then left as it is ('').
+    In patch mode the model only returns the edits, so output tokens scale with
+    the size of the change; patches that do not apply fall back to a full
+    regeneration.
+    """
+    if (current_app.config['FAST_CHANGE_ROUTING']
+            and classify_change(transcription_text, current_local_storage) == DATA_CHANGE):
+        local_storage_content = generate_storage_change(applet_uuid, transcription_text, current_local_storage)
+        if local_storage_content is not None:
+            return '', local_storage_content
+
+    if current_app.config['CHANGE_MODE'] == 'patch':
+        formatted_prompt = load_and_format_change_prompt(
+            transcription_text, current_html_content, current_local_storage,
+            template=CHANGE_PATCH_PROMPT_TEMPLATE
+        )
+        key = prompt_key(CHANGE_PATCH_PROMPT_TEMPLATE, transcription_text, current_html_content,
+                         json.dumps(current_local_storage))
+        html_patch, storage_patch = cached_generation(formatted_prompt, generate_patch_from_prompt, key, 'patch')
+        try:
+            return apply_change_patch(current_html_content, current_local_storage, html_patch, storage_patch)
+        except PatchError as e:
+            logger.warning(f"Patch for applet {applet_uuid} did not apply, regenerating: {e}")
+
+    formatted_prompt = load_and_format_change_prompt(
+        transcription_text, current_html_content, current_local_storage
+    )
+    key = prompt_key(CHANGE_PROMPT_TEMPLATE, transcription_text, current_html_content, json.dumps(current_local_storage))
+    return generate_streaming(applet_uuid, formatted_prompt, key)
+
+
+def transcribe_upload(applet_uuid, file_name, audio_hash=None):
+    """Transcribe an uploaded recording and save the text as its .prompt.
+
+    Transcriptions are cached on disk by the SHA-256 of the recording (taken
+    while the upload was saved) and the model, so a re-submitted recording is
+    answered without calling the API.
+    """
+    transcription_cache = get_transcription_cache()
+    with audio_file_path(applet_uuid, file_name) as file_path:
+        key = None
+        if transcription_cache:
+            key = cache_key(audio_hash or hash_file(file_path), TRANSCRIPTION_MODEL)
+            transcription_text = transcription_cache.get(key)
+            if transcription_text is not None:
+                logger.info(f"Transcription cache hit (hit rate {transcription_cache.stats()['hit_rate']:.2f})")
+        if key is None or transcription_text is None:
+            ffmpeg = find_ffmpeg(current_app.config['FFMPEG_PATH']) if current_app.config['AUDIO_TRANSCODE'] else None
+            with compact_audio(file_path, ffmpeg) as upload_path:
+                transcription_text = transcribe_audio(upload_path)
+            if key and transcription_text:
+                transcription_cache.set(key, transcription_text)
+    save_transcription(transcription_text, applet_uuid, file_name)
+    return transcription_text
+
+
+def get_prefetch_executor():
+    return current_app.extensions['prefetch_executor']
+
+
+def change_templates():
+    """Names of the prompt templates generate_change may render under the current configuration."""
+    templates = [CHANGE_PROMPT_TEMPLATE]
+    if current_app.config['CHANGE_MODE'] == 'patch':
+        templates.append(CHANGE_PATCH_PROMPT_TEMPLATE)
+    if current_app.config['FAST_CHANGE_ROUTING']:
+        templates.append(CHANGE_STORAGE_PROMPT_TEMPLATE)
+    return templates
+
+
+def prefetch(timer, templates, applet_uuid=None):
+    """Load the prompt templates and, for a change, the applet's current HTML and storage.
+
+    Runs on the prefetch pool while the recording is transcribed, so the
+    disk reads are done by the time the transcription is. Returns
+    (html, storage), or (None, None) if the applet has no HTML.
+    """
+    with timer.stage('prefetch'):
+        for name in templates:
+            template_registry.get(name)
+        if applet_uuid is None:
+            return None, None
+        current_html = read_applet_html(applet_uuid)
+        if current_html is None:
+            return None, None
+        current_storage = read_applet_storage(applet_uuid)
+        return current_html.data.decode('utf-8'), current_storage.value if current_storage else {}
+
+
+def create_applet_from_audio(applet_uuid, file_name, audio_hash=None):
+    timer = StageTimer('create')
+    prefetched = get_prefetch_executor().submit(prefetch, timer, [INITIAL_PROMPT_TEMPLATE])
+    with timer.stage('transcription'):
+        transcription_text = transcribe_upload(applet_uuid, file_name, audio_hash)
+    with timer.stage('prefetch_wait'):
+        prefetched.result()
+    with timer.stage('generation'):
+        formatted_prompt = load_and_format_initial_prompt(transcription_text)
+        html_content, local_storage_content = generate_streaming(
+            applet_uuid, formatted_prompt, prompt_key(INITIAL_PROMPT_TEMPLATE, transcription_text)
+        )
+    with timer.stage('save'):
+        save_html_files(html_content, applet_uuid)
+        if local_storage_content:
+            save_local_storage(local_storage_content, applet_uuid)
+        version = record_version(applet_uuid, 'create', prompt=transcription_text)
+
+    return {
+        "message": "Audio file uploaded and processed successfully",
+        "uuid": applet_uuid,
+        "file_name": file_name,
+        "version": version['version'],
+        "timings": timer.to_dict()
+    }
+
+
+def change_applet_from_audio(applet_uuid, file_name, audio_hash=None):
+    timer = StageTimer('change')
+    prefetched = get_prefetch_executor().submit(prefetch, timer, change_templates(), applet_uuid)
+    with timer.stage('transcription'):
+        transcription_text = transcribe_upload(applet_uuid, file_name, audio_hash)
+    with timer.stage('prefetch_wait'):
+        current_html_content, current_local_storage = prefetched.result()
+    if current_html_content is None:
+        raise JobError("Current index.html not found")
+
+    with timer.stage('generation'):
+        html_content, local_storage_content = generate_change(
+            applet_uuid, transcription_text, current_html_content, current_local_storage
+        )
+
+    with timer.stage('save'):
+        if html_content:
+            save_html_files(html_content, applet_uuid)
+        if local_storage_content:
+            save_local_storage(local_storage_content, applet_uuid)
+        version = record_version(applet_uuid, 'change', prompt=transcription_text)
+
+    return {
+        "message": "Applet changed successfully",
+        "uuid": applet_uuid,
+        "file_name": file_name,
+        "version": version['version'],
+        "timings": timer.to_dict()
+    }
+
+
+def get_job_queue():
+    return current_app.extensions['job_queue']
+
+
+def enqueue_job(kind, func, applet_uuid, *args, error_message):
+    app = current_app._get_current_object()  # The worker thread has no context of its own
+
+    def run():
+        with app.app_context():
+            return func(applet_uuid, *args)
+
+    job = get_job_queue().submit(kind, run, applet_uuid=applet_uuid, error_message=error_message)
+    response = jsonify({
+        "message": "Audio file accepted for processing",
+        "job_id": job.id,
+        "uuid": applet_uuid,
+        "status_url": f"/jobs/{job.id}"
+    })
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+
+def queue_full_response():
+    response = jsonify({"error": "Server is busy, please try again shortly"})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+
+@bp.route('/applet', methods=['POST'])
 def upload_audio():
     if 'audio' not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
@@ -139,44 +674,32 @@ def upload_audio():
         return jsonify({"error": "Invalid audio file type"}), 400
 
     applet_uuid = str(uuid.uuid4())
-    applet_dir = get_applet_dir(applet_uuid)
-    os.makedirs(applet_dir, exist_ok=True)
+    create_applet(applet_uuid)
 
     # Save the audio file securely
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
     file_name = secure_filename(f"{timestamp}_initial_prompt.webm")
-    file_path = os.path.join(applet_dir, file_name)
-    audio_file.save(file_path)
+    audio_stream = HashingReader(audio_file.stream)
+    save_audio(applet_uuid, file_name, audio_stream)
 
     try:
-        transcription_text = transcribe_audio(file_path)
-        save_transcription(transcription_text, file_path)
-        formatted_prompt = load_and_format_initial_prompt(transcription_text)
-        html_content, local_storage_content = generate_html_from_prompt(formatted_prompt)
-        index_file_path, index_timestamp_file_path = save_html_files(html_content, applet_dir)
-        if local_storage_content:
-            save_local_storage(local_storage_content, applet_dir)
-        
-    except Exception as e:
-        logger.error(f"Error processing audio: {e}")
-        return jsonify({"error": "Failed to process audio"}), 500
-
-    return jsonify({
-        "message": "Audio file uploaded and processed successfully",
-        "uuid": applet_uuid,
-        "file_name": file_name,
-        "index_file": index_file_path,
-        "index_timestamp_file": index_timestamp_file_path
-    }), 200
+        return enqueue_job(
+            'create', create_applet_from_audio, applet_uuid, file_name, audio_stream.hexdigest(),
+            error_message="Failed to process audio"
+        )
+    except JobQueueFull as e:
+        logger.warning(f"Rejecting new applet, job queue is full: {e}")
+        delete_applet(applet_uuid)
+        return queue_full_response()
 
 
-@app.route('/applet/<uuid:applet_uuid>', methods=['POST'])
+@bp.route('/applet/<uuid:applet_uuid>', methods=['POST'])
 def change_applet(applet_uuid):
     if 'audio' not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
 
-    applet_dir = get_applet_dir(applet_uuid)
-    if not os.path.exists(applet_dir):
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
         return jsonify({"error": "Applet not found"}), 404
 
     audio_file = request.files['audio']
@@ -185,55 +708,38 @@ def change_applet(applet_uuid):
     if audio_file.mimetype not in ['audio/webm', 'audio/ogg', 'audio/wav', 'audio/mpeg', 'audio/mp3']:
         return jsonify({"error": "Invalid audio file type"}), 400
 
+    # Check before paying for the upload and its transcription; this also warms the cache for the job
+    if read_applet_html(applet_uuid) is None:
+        return jsonify({"error": "Current index.html not found"}), 404
+
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
     file_name = secure_filename(f"{timestamp}_change_prompt.webm")
-    file_path = os.path.join(applet_dir, file_name)
-    audio_file.save(file_path)
+    audio_stream = HashingReader(audio_file.stream)
+    save_audio(applet_uuid, file_name, audio_stream)
 
     try:
-        transcription_text = transcribe_audio(file_path)
-        save_transcription(transcription_text, file_path)
-
-        current_index_path = os.path.join(applet_dir, 'index.html')
-        if not os.path.exists(current_index_path):
-            return jsonify({"error": "Current index.html not found"}), 404
-
-        with open(current_index_path, 'r') as f:
-            current_html_content = f.read()
-
-        # Load current local storage from disk
-        storage_file_path = os.path.join(applet_dir, 'storage.json')
-        current_local_storage = {}
-        if os.path.exists(storage_file_path):
-            with open(storage_file_path, 'r') as f:
-                current_local_storage = flask_json.load(f)
-
-        formatted_prompt = load_and_format_change_prompt(
-            transcription_text, current_html_content, current_local_storage
+        return enqueue_job(
+            'change', change_applet_from_audio, applet_uuid, file_name, audio_stream.hexdigest(),
+            error_message="Failed to change applet"
         )
-        html_content, local_storage_content = generate_html_from_prompt(formatted_prompt)
+    except JobQueueFull as e:
+        logger.warning(f"Rejecting change of applet {applet_uuid}, job queue is full: {e}")
+        delete_audio(applet_uuid, file_name)
+        return queue_full_response()
 
-        if html_content:
-            index_file_path, _ = save_html_files(html_content, applet_dir)
 
-        if local_storage_content:
-            save_local_storage(local_storage_content, applet_dir)
-        
-    except Exception as e:
-        logger.error(f"Error changing applet: {e}")
-        return jsonify({"error": "Failed to change applet"}), 500
-
-    return jsonify({
-        "message": "Applet changed successfully",
-        "uuid": str(applet_uuid),
-        "file_name": file_name
-    }), 200
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
 
 
-@app.route('/applet/<uuid:applet_uuid>/storage', methods=['PUT'])
+@bp.route('/applet/<uuid:applet_uuid>/storage', methods=['PUT'])
 def update_applet_storage(applet_uuid):
-    applet_dir = get_applet_dir(applet_uuid)
-    if not os.path.exists(applet_dir):
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
         return jsonify({"error": "Applet not found"}), 404
 
     if not request.is_json:
@@ -245,39 +751,335 @@ def update_applet_storage(applet_uuid):
         logger.error(f"JSON decoding error: {e}")
         return jsonify({"error": "Invalid JSON"}), 400
 
-    # Optional: Validate storage_data size
-    if len(json.dumps(storage_data)) > 10 * 1024 * 1024:  # 10 MB limit
+    # Validate storage_data size, serializing only once
+    storage_content = json.dumps(storage_data)
+    if len(storage_content) > MAX_STORAGE_BYTES:
         return jsonify({"error": "Storage data too large"}), 400
 
-    storage_file_path = os.path.join(applet_dir, 'storage.json')
-    logger.info(f"Updating storage at: {storage_file_path} with data: {storage_data}")  # Log storage path and data
+    log_payload(logger, "Updating storage of applet %s with data: %s", applet_uuid, storage_data)
 
     try:
-        with open(storage_file_path, 'w') as f:
-            flask_json.dump(storage_data, f)
+        storage = save_local_storage(storage_content, applet_uuid, source=request.headers.get('X-Client-Id'))
     except Exception as e:
         logger.error(f"Error updating storage: {e}")
         return jsonify({"error": "Failed to update storage"}), 500
 
     logger.info("Storage updated successfully")  # Log successful update
-    return jsonify({"message": "Storage updated successfully"}), 200
+    response = jsonify({"message": "Storage updated successfully"})
+    response.set_etag(storage.etag)  # Lets the writer keep its copy current without refetching
+    return response, 200
 
 
 
-@app.route('/applet/<uuid:applet_uuid>/storage', methods=['DELETE'])
-def delete_applet_storage(applet_uuid):
-    applet_dir = get_applet_dir(applet_uuid)
-    storage_file_path = os.path.join(applet_dir, 'storage.json')
+@bp.route('/applet/<uuid:applet_uuid>/storage', methods=['PATCH'])
+def patch_applet_storage(applet_uuid):
+    """Apply key-level changes: {"base": etag, "clear": bool, "set": {key: value}, "delete": [key]}.
+
+    Answers with the new version's ETag and {"merged": true} if that version
+    also holds changes made since base.
+    """
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
+        return jsonify({"error": "Applet not found"}), 404
+
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    try:
+        changes = request.get_json()
+    except Exception as e:
+        logger.error(f"JSON decoding error: {e}")
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    if (not isinstance(changes, dict)
+            or not isinstance(changes.get('base') or '', str)
+            or not isinstance(changes.get('set', {}), dict)
+            or not all(isinstance(value, str) for value in changes.get('set', {}).values())  # As in localStorage
+            or not isinstance(changes.get('delete', []), list)
+            or not all(isinstance(key, str) for key in changes.get('delete', []))):
+        return jsonify({"error": "Invalid storage changes"}), 400
+
+    try:
+        storage, merged = patch_local_storage(
+            applet_uuid,
+            set_items=changes.get('set'),
+            delete_keys=changes.get('delete', []),
+            clear=bool(changes.get('clear')),
+            base_etag=unquote_etag(changes['base'])[0] if changes.get('base') else None,
+            source=request.headers.get('X-Client-Id'),
+            max_bytes=MAX_STORAGE_BYTES,
+        )
+    except StorageConflict as e:
+        response = jsonify({"error": "Storage changed since the base version"})
+        response.set_etag(e.etag)
+        return response, 409
+    except StorageTooLarge:
+        return jsonify({"error": "Storage data too large"}), 400
+    except Exception as e:
+        logger.error(f"Error patching storage: {e}")
+        return jsonify({"error": "Failed to update storage"}), 500
+
+    # merged: the new version holds changes the client has not loaded, so it must reload
+    # the storage rather than take this ETag as the version it has
+    response = jsonify({"message": "Storage updated successfully", "merged": merged})
+    response.set_etag(storage.etag)
+    return response, 200
+
 
-    if not os.path.exists(storage_file_path):
+@bp.route('/applet/<uuid:applet_uuid>/storage', methods=['DELETE'])
+def delete_applet_storage(applet_uuid):
+    applet_uuid = str(applet_uuid)
+    if read_applet_storage(applet_uuid) is None:
         return jsonify({"error": "Storage file not found"}), 404
 
     try:
-        with open(storage_file_path, 'w') as f:
-            f.write('{}')
+        save_local_storage(EMPTY_STORAGE_CONTENT, applet_uuid)
     except Exception as e:
         logger.error(f"Error deleting storage: {e}")
         return jsonify({"error": "Failed to empty storage"}), 500
 
     return jsonify({"message": "Storage emptied successfully"}), 200
 
+
+@bp.route('/applet/<uuid:applet_uuid>/versions', methods=['GET'])
+def get_applet_versions(applet_uuid):
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
+        return jsonify({"error": "Applet not found"}), 404
+
+    return jsonify({"versions": list_versions(applet_uuid)}), 200
+
+
+@bp.route('/applet/<uuid:applet_uuid>/versions/<int:version>', methods=['GET'])
+def get_applet_version(applet_uuid, version):
+    applet_uuid = str(applet_uuid)
+
+    try:
+        contents = read_version(applet_uuid, version)
+    except VersionError as e:
+        logger.error(f"Error reading version {version} of applet {applet_uuid}: {e}")
+        return jsonify({"error": "Failed to read version"}), 500
+    if contents is None:
+        return jsonify({"error": "Version not found"}), 404
+
+    try:
+        storage = json.loads(contents['storage'])
+    except ValueError:
+        storage = {}
+    return jsonify({
+        "version": version,
+        "html": contents['html'],
+        "storage": storage,
+        "prompt": contents['prompt'],
+    }), 200
+
+
+@bp.route('/applet/<uuid:applet_uuid>/versions/<int:version>/rollback', methods=['POST'])
+def rollback_applet(applet_uuid, version):
+    applet_uuid = str(applet_uuid)
+    if not applet_exists(applet_uuid):
+        return jsonify({"error": "Applet not found"}), 404
+
+    if get_version(applet_uuid, version) is None:
+        return jsonify({"error": "Version not found"}), 404
+
+    try:
+        entry = rollback_version(applet_uuid, version)
+    except Exception as e:
+        logger.error(f"Error rolling back applet {applet_uuid}: {e}")
+        return jsonify({"error": "Failed to roll back applet"}), 500
+
+    return jsonify({"message": "Applet rolled back successfully", "version": entry['version']}), 200
+
+
+def admin_error():
+    """Return an error response unless the request carries the admin token, otherwise None."""
+    token = current_app.config['ADMIN_TOKEN']
+    if not token:
+        return jsonify({"error": "Not found"}), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@bp.route('/applets', methods=['GET'])
+def list_applets():
+    """List indexed applets: ?order=<column>&asc=1&limit=&offset=&q=<prompt text>."""
+    error = admin_error()
+    if error:
+        return error
+
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        applets, total = applet_index.query(
+            order_by=request.args.get('order', 'updated_at'),
+            descending=request.args.get('asc') != '1',
+            limit=limit,
+            offset=offset,
+            search=request.args.get('q'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"applets": [to_json(applet) for applet in applets], "total": total}), 200
+
+
+@bp.route('/applets/<uuid:applet_uuid>', methods=['GET'])
+def get_applet_metadata(applet_uuid):
+    error = admin_error()
+    if error:
+        return error
+
+    applet = applet_index.get(str(applet_uuid), with_prompts=True)
+    if applet is None:
+        return jsonify({"error": "Applet not found"}), 404
+    return jsonify(to_json(applet)), 200
+
+
+@bp.route('/caches', methods=['GET'])
+def get_cache_stats():
+    """Report the size, hit rate and evictions of the on-disk caches that are enabled."""
+    error = admin_error()
+    if error:
+        return error
+
+    caches = {"prompts": get_prompt_cache(), "transcriptions": get_transcription_cache()}
+    return jsonify({name: cache.stats() for name, cache in caches.items() if cache}), 200
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the timing histograms, cache statistics and job queue."""
+    error = admin_error()
+    if error:
+        return error
+
+    caches = {"artifacts": artifact_cache.stats()}
+    for name, cache in (("prompts", get_prompt_cache()), ("transcriptions", get_transcription_cache())):
+        if cache:
+            caches[name] = cache.stats()
+
+    lines = SPAN_SECONDS.render() + JOB_STAGE_SECONDS.render() + HTTP_REQUEST_SECONDS.render()
+    for stat, kind, help_text in (
+        ('hits', 'counter', 'Cache lookups answered from the cache.'),
+        ('misses', 'counter', 'Cache lookups that were not.'),
+        ('evictions', 'counter', 'Entries evicted to stay within the size cap.'),
+        ('bytes', 'gauge', 'Size of the cached entries.'),
+    ):
+        suffix = '_total' if kind == 'counter' else ''
+        samples = [({"cache": name}, stats[stat]) for name, stats in caches.items() if stats[stat] is not None]
+        lines += render_family(f"applet_cache_{stat}{suffix}", kind, help_text, samples)
+    lines += render_family('applet_jobs_outstanding', 'gauge', 'Jobs queued or running.',
+                           [({}, get_job_queue().outstanding())])
+    lines += render_family('applet_maintenance_total', 'counter', 'Work done by the background maintenance.',
+                           [({"action": name}, count) for name, count in maintainer.stats.items()])
+    lines += render_family('applet_hot_bytes', 'gauge', 'Size of the hot applets, as of their last maintenance.',
+                           [({}, maintainer.hot_bytes())])
+    backend = storage_backend()
+    if hasattr(backend, 'cold_applets'):
+        lines += render_family('applet_cold_applets', 'gauge', 'Applets in the cold tier.',
+                               [({}, len(backend.cold_applets()))])
+        lines += render_family('applet_cold_restores_total', 'counter', 'Applets restored from the cold tier.',
+                               [({}, backend.restored)])
+
+    response = current_app.response_class("\n".join(lines) + "\n", mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@bp.cli.command('rebuild-index')
+def rebuild_index_command():
+    """Rebuild the applet metadata index from the applet directories."""
+    count = applet_index.rebuild(storage_backend())
+    print(f"Indexed {count} applets in {current_app.config['APPLET_INDEX_PATH']}")
+
+
+@bp.cli.command('maintain')
+def maintain_command():
+    """Run one maintenance cycle over every applet and print what it did."""
+    print(json.dumps(maintainer.run_cycle(), indent=2))
+
+
+_app_created = threading.Lock()
+
+
+def create_app(overrides=None):
+    """Build the application: read the configuration, set up storage and the AI clients, register the routes.
+
+    Nothing is done at import time, so importing this module is cheap. The
+    storage backend, applet index, artifact cache, AI clients and maintainer
+    are process-wide, so the app can only be created once per process; a
+    second call raises RuntimeError rather than redirecting the first app's
+    I/O. The AI SDK is imported on the first AI call (see app.ai_client).
+    """
+    if not _app_created.acquire(blocking=False):
+        raise RuntimeError("create_app() configures process-wide state and can only be called once per process")
+    logging.basicConfig(level=logging.INFO)
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    load_config(app.config)
+    app.config.update(overrides or {})
+    app.config['UPLOAD_DIR'] = os.path.abspath(app.config['UPLOAD_DIR'])
+    app.config['STORAGE_SQLITE_PATH'] = os.path.abspath(
+        app.config['STORAGE_SQLITE_PATH'] or os.path.join(app.config['UPLOAD_DIR'], 'applets.sqlite3')
+    )
+    app.config['APPLET_INDEX_PATH'] = os.path.abspath(
+        app.config['APPLET_INDEX_PATH'] or os.path.join(app.config['UPLOAD_DIR'], 'index.sqlite3')
+    )
+    app.config['COLD_STORAGE_DIR'] = os.path.abspath(
+        app.config['COLD_STORAGE_DIR'] or os.path.join(app.config['UPLOAD_DIR'], '.cold')
+    )
+
+    os.makedirs(app.config['UPLOAD_DIR'], exist_ok=True)
+    configure_artifact_cache(app.config['ARTIFACT_CACHE_MAX_BYTES'], app.config['ARTIFACT_CACHE_REVALIDATE'])
+    configure_storage(ColdTier(create_backend(
+        app.config['STORAGE_BACKEND'],
+        root=app.config['UPLOAD_DIR'],
+        sqlite_path=app.config['STORAGE_SQLITE_PATH'],
+        fsync=app.config['STORAGE_FSYNC'],
+    ), app.config['COLD_STORAGE_DIR']))
+    configure_versions(delta=app.config['VERSION_DELTA_COMPRESSION'])
+    applet_index.configure(app.config['APPLET_INDEX_PATH'])
+    configure_payload_logging(app.config['LOG_PAYLOAD_SAMPLE_RATE'])
+    ai_clients.configure(
+        app.config['AI_BACKEND'],
+        api_key=os.getenv('GROQ_API_KEY'),
+        timeout=app.config['AI_TIMEOUT_SECONDS'],
+        max_retries=app.config['AI_MAX_RETRIES'],
+        max_concurrency=app.config['AI_MAX_CONCURRENCY'],
+        pool_size=app.config['AI_POOL_SIZE'],
+        fake_options=app.config['AI_FAKE_OPTIONS'],
+    )
+
+    # Security
+    Talisman(app, force_https=False, content_security_policy={
+        'default-src': ["'self'"],
+        'script-src': ["'self'", "'unsafe-inline'"],  # Allow inline scripts
+        'style-src': ["'self'", 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/', "'unsafe-inline'"],  # Allow inline styles
+        'font-src': ["'self'", 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/']
+    })
+
+    app.extensions['job_queue'] = JobQueue(workers=app.config['JOB_WORKERS'], max_queued=app.config['JOB_QUEUE_MAX'])
+    # One prefetch per running job, overlapping its transcription
+    app.extensions['prefetch_executor'] = ThreadPoolExecutor(
+        max_workers=app.config['JOB_WORKERS'], thread_name_prefix='applet-prefetch'
+    )
+    maintainer.configure(
+        audio_action=app.config['AUDIO_RETENTION'],
+        audio_after_days=app.config['AUDIO_RETENTION_DAYS'],
+        ffmpeg=find_ffmpeg(app.config['FFMPEG_PATH']),
+        keep_versions=app.config['VERSIONS_KEEP_UNPACKED'],
+        applet_quota_bytes=app.config['APPLET_QUOTA_BYTES'],
+        hot_quota_bytes=app.config['HOT_STORAGE_QUOTA_BYTES'],
+        cold_after_days=app.config['COLD_AFTER_DAYS'],
+        io_bytes_per_second=app.config['MAINTENANCE_IO_BYTES_PER_SECOND'],
+        batch_size=app.config['MAINTENANCE_BATCH'],
+        busy_applets=app.extensions['job_queue'].busy_applets,
+    )
+    app.extensions['maintenance'] = maintainer
+    if app.config['MAINTENANCE_INTERVAL_SECONDS'] > 0:
+        maintainer.start(app.config['MAINTENANCE_INTERVAL_SECONDS'])
+    app.register_blueprint(bp)
+    return app
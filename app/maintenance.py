@@ -0,0 +1,304 @@
+import os
+import math
+import time
+import uuid
+import logging
+import threading
+
+from app.applet_index import applet_index
+from app.audio import TRANSCODE_SUFFIX, transcoded_audio
+from app.file_manager import applet_lock, audio_file_path, storage_backend
+from app.versions import archive_versions, prune_oldest_pack
+
+logger = logging.getLogger(__name__)
+
+AUDIO_ACTIONS = ('compress', 'drop', 'keep')
+UPLOAD_SUFFIX = '.webm'
+DAY_SECONDS = 24 * 3600
+
+STAT_NAMES = (
+    'applets_visited', 'audio_compressed', 'audio_dropped', 'versions_archived', 'version_packs_pruned',
+    'applets_frozen', 'bytes_freed',
+)
+
+
+def _is_applet(name):
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return True
+
+
+class RateLimiter:
+    """Token bucket over bytes, so maintenance I/O stays under bytes_per_second on average.
+
+    Work is paid for after it is done, so one large file is never split up;
+    the work after it waits until the debt is paid off.
+    """
+
+    def __init__(self, bytes_per_second, sleep=time.sleep, clock=time.monotonic):
+        self.bytes_per_second = bytes_per_second
+        self._sleep = sleep
+        self._clock = clock
+        self._available = 0.0
+        self._updated = clock()
+
+    def consume(self, nbytes):
+        if not self.bytes_per_second:
+            return
+        now = self._clock()
+        # Idle time earns at most one second of burst
+        self._available = min(
+            self.bytes_per_second, self._available + (now - self._updated) * self.bytes_per_second
+        ) - nbytes
+        self._updated = now
+        if self._available < 0:
+            self._sleep(-self._available / self.bytes_per_second)
+            self._available = 0.0
+            self._updated = self._clock()
+
+
+class Maintainer:
+    """Keeps applet storage bounded in long-running deployments.
+
+    Each pass visits the next batch of applets and, for each one:
+    - moves it to the cold tier once it has been idle for cold_after_days
+      (with a ColdTier backend; it is restored on its next access);
+    - compresses recordings to Opus (or drops them) audio_after_days after
+      they were transcribed;
+    - packs the version blobs that only versions older than the newest
+      keep_versions need (see app.versions.archive_versions);
+    - over applet_quota_bytes, drops its transcribed recordings, then its
+      oldest version packs, oldest first.
+    While the hot applets seen by the sweep take more than hot_quota_bytes,
+    the least recently used go cold early. Applets reported by busy_applets
+    (those with a queued or running job) never go cold. All I/O is paced by
+    a RateLimiter, so the sweep runs beside request traffic. Quotas and
+    limits of 0 are off.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sizes_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.configure()
+
+    def configure(self, audio_action='compress', audio_after_days=7, ffmpeg=None, keep_versions=20,
+                  applet_quota_bytes=0, hot_quota_bytes=0, cold_after_days=30, io_bytes_per_second=4 * 1024 * 1024,
+                  batch_size=100, busy_applets=set):
+        if audio_action not in AUDIO_ACTIONS:
+            raise ValueError(f"Unknown audio retention action {audio_action!r}")
+        if audio_action == 'compress' and not ffmpeg:
+            logger.info("ffmpeg not found, recordings are kept as they are")
+        with self._lock:
+            self.audio_action = audio_action
+            self.audio_after_days = audio_after_days
+            self.ffmpeg = ffmpeg
+            self.keep_versions = keep_versions
+            self.applet_quota_bytes = applet_quota_bytes
+            self.hot_quota_bytes = hot_quota_bytes
+            self.cold_after_days = cold_after_days
+            self.limiter = RateLimiter(io_bytes_per_second)
+            self.batch_size = batch_size
+            self.busy_applets = busy_applets
+            self.stats = dict.fromkeys(STAT_NAMES, 0)
+            self._cursor = ''
+            with self._sizes_lock:
+                self._sizes = {}  # Hot applet -> bytes, as of its last visit
+
+    def hot_bytes(self):
+        with self._sizes_lock:
+            return sum(self._sizes.values())
+
+    def run_pass(self, now=None):
+        """Maintain the next batch of applets; return the counts of what was done."""
+        now = now or time.time()
+        report = dict.fromkeys(STAT_NAMES, 0)
+        with self._lock:
+            names = [name for name in storage_backend().applets() if _is_applet(name)]
+            present = set(names)
+            with self._sizes_lock:
+                self._sizes = {name: size for name, size in self._sizes.items() if name in present}
+            batch = [name for name in names if name > self._cursor][:self.batch_size]
+            if not batch:
+                batch = names[:self.batch_size]  # Start the next sweep
+            for applet_uuid in batch:
+                try:
+                    self._maintain_applet(applet_uuid, now, report)
+                except Exception as e:
+                    logger.exception(f"Maintenance of applet {applet_uuid} failed: {e}")
+                report['applets_visited'] += 1
+            self._cursor = batch[-1] if batch else ''
+            self._enforce_hot_quota(report)
+            for name, count in report.items():
+                self.stats[name] += count
+        return report
+
+    def run_cycle(self, now=None):
+        """Visit every applet once, from the first; return the summed counts."""
+        with self._lock:
+            self._cursor = ''
+            passes = math.ceil(sum(1 for name in storage_backend().applets() if _is_applet(name)) / self.batch_size)
+        report = dict.fromkeys(STAT_NAMES, 0)
+        for _ in range(max(passes, 1)):
+            for name, count in self.run_pass(now).items():
+                report[name] += count
+        return report
+
+    def start(self, interval):
+        """Run a pass every interval seconds in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='applet-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.run_pass()
+            except Exception as e:
+                logger.exception(f"Maintenance pass failed: {e}")
+
+    def _last_activity(self, applet_uuid):
+        """Time of the applet's last write or page view, or None if it has no files.
+
+        Applets without an index row (created before the index, or whose
+        create job has not finished) fall back to their newest file.
+        """
+        applet = applet_index.get(applet_uuid) if applet_index.path else None
+        if applet is not None:
+            return max(applet['updated_at'], applet['last_access'] or 0)
+        backend = storage_backend()
+        stats = (backend.stat(applet_uuid, name) for name in backend.files(applet_uuid))
+        return max((stat.st_mtime for stat in stats if stat is not None), default=None)
+
+    def _maintain_applet(self, applet_uuid, now, report):
+        if self.cold_after_days and applet_uuid not in self.busy_applets():
+            last_activity = self._last_activity(applet_uuid)
+            if last_activity is not None and now - last_activity >= self.cold_after_days * DAY_SECONDS:
+                if self._freeze(applet_uuid, report):
+                    return
+
+        self._compact_audio(applet_uuid, now, report)
+        if self.keep_versions:
+            archived, packed = archive_versions(applet_uuid, self.keep_versions)
+            report['versions_archived'] += archived
+            self.limiter.consume(2 * packed)
+
+        size = self._size(applet_uuid)
+        if self.applet_quota_bytes and size > self.applet_quota_bytes:
+            size = self._enforce_applet_quota(applet_uuid, size, report)
+        with self._sizes_lock:
+            self._sizes[applet_uuid] = size
+
+    def _size(self, applet_uuid):
+        backend = storage_backend()
+        stats = (backend.stat(applet_uuid, name) for name in backend.files(applet_uuid))
+        return sum(stat.st_size for stat in stats if stat is not None)
+
+    def _freeze(self, applet_uuid, report):
+        backend = storage_backend()
+        if not hasattr(backend, 'freeze'):
+            return False
+        with applet_lock(applet_uuid):
+            # With the compressed sidecars, so a restored applet does not compress them again
+            read, written = backend.freeze(applet_uuid)
+        with self._sizes_lock:
+            size = self._sizes.pop(applet_uuid, read)
+        report['applets_frozen'] += 1
+        report['bytes_freed'] += max(0, size - written)
+        self.limiter.consume(read + written)
+        logger.info(f"Moved applet {applet_uuid} to the cold tier ({size} bytes, {written} archived)")
+        return True
+
+    def _transcribed_recordings(self, applet_uuid):
+        """Return [(stat, name)] of the applet's recordings that have a transcription, oldest first."""
+        backend = storage_backend()
+        names = backend.list(applet_uuid)
+        transcribed = {name[:-len('.prompt')] for name in names if name.endswith('.prompt')}
+        recordings = []
+        for name in names:
+            stem, suffix = os.path.splitext(name)
+            if suffix in (UPLOAD_SUFFIX, TRANSCODE_SUFFIX) and stem in transcribed:
+                stat = backend.stat(applet_uuid, name)
+                if stat is not None:
+                    recordings.append((stat, name))
+        return sorted(recordings, key=lambda recording: recording[0].st_mtime_ns)
+
+    def _compact_audio(self, applet_uuid, now, report):
+        if self.audio_action == 'keep' or (self.audio_action == 'compress' and not self.ffmpeg):
+            return
+        backend = storage_backend()
+        for stat, name in self._transcribed_recordings(applet_uuid):
+            stem, suffix = os.path.splitext(name)
+            if suffix != UPLOAD_SUFFIX or now - stat.st_mtime < self.audio_after_days * DAY_SECONDS:
+                continue
+            if self.audio_action == 'drop':
+                backend.delete(applet_uuid, name)
+                report['audio_dropped'] += 1
+                report['bytes_freed'] += stat.st_size
+                continue
+
+            with audio_file_path(applet_uuid, name) as path, transcoded_audio(path, self.ffmpeg) as out_path:
+                if out_path is None:
+                    continue
+                # Kept even if not smaller: it is short, bounded-bitrate speech, and is not visited again
+                with open(out_path, 'rb') as f:
+                    compressed = backend.write_stream(applet_uuid, stem + TRANSCODE_SUFFIX, f)
+            backend.delete(applet_uuid, name)
+            report['audio_compressed'] += 1
+            report['bytes_freed'] += stat.st_size - compressed.st_size
+            self.limiter.consume(stat.st_size + compressed.st_size)
+
+    def _enforce_applet_quota(self, applet_uuid, size, report):
+        backend = storage_backend()
+        for stat, name in self._transcribed_recordings(applet_uuid):
+            if size <= self.applet_quota_bytes:
+                break
+            backend.delete(applet_uuid, name)
+            size -= stat.st_size
+            report['audio_dropped'] += 1
+            report['bytes_freed'] += stat.st_size
+        while size > self.applet_quota_bytes:
+            freed = prune_oldest_pack(applet_uuid)
+            if not freed:
+                logger.warning(f"Applet {applet_uuid} uses {size} bytes, over its quota of {self.applet_quota_bytes}")
+                break
+            size -= freed
+            report['version_packs_pruned'] += 1
+            report['bytes_freed'] += freed
+        return size
+
+    def _enforce_hot_quota(self, report):
+        if not self.hot_quota_bytes or not hasattr(storage_backend(), 'freeze'):
+            return
+        with self._sizes_lock:
+            sizes = dict(self._sizes)
+        total = sum(sizes.values())
+        if total <= self.hot_quota_bytes:
+            return
+        busy = self.busy_applets()
+        # Least recently used first
+        for applet_uuid in sorted(sizes, key=lambda name: self._last_activity(name) or 0):
+            if total <= self.hot_quota_bytes:
+                break
+            if applet_uuid in busy:
+                continue
+            size = sizes[applet_uuid]
+            try:
+                if self._freeze(applet_uuid, report):
+                    total -= size
+            except Exception as e:
+                logger.exception(f"Moving applet {applet_uuid} to the cold tier failed: {e}")
+
+
+maintainer = Maintainer()
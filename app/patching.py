@@ -0,0 +1,156 @@
+import re
+import copy
+import json
+
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"^<{5,} SEARCH[ \t]*\n(.*?)^={5,}[ \t]*\n(.*?)^>{5,} REPLACE[ \t]*$",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_search_replace_blocks(text):
+    """Parse SEARCH/REPLACE blocks into a list of (search, replace) pairs."""
+    blocks = []
+    for match in SEARCH_REPLACE_PATTERN.finditer(text):
+        search, replace = match.group(1), match.group(2)
+        if not search.strip():
+            raise PatchError("Empty SEARCH block")
+        blocks.append((search, replace))
+    if text.strip() and not blocks:
+        raise PatchError("No SEARCH/REPLACE blocks found in HTML patch")
+    return blocks
+
+
+def apply_search_replace(html, blocks):
+    """Apply (search, replace) pairs in order; each search must match exactly once."""
+    for search, replace in blocks:
+        count = html.count(search)
+        if count != 1:
+            # Models often get trailing whitespace wrong; retry on stripped lines
+            search, count = _match_ignoring_trailing_whitespace(html, search)
+        if count == 0:
+            raise PatchError(f"SEARCH block not found: {search[:80]!r}")
+        if count > 1:
+            raise PatchError(f"SEARCH block is ambiguous ({count} matches): {search[:80]!r}")
+        html = html.replace(search, replace, 1)
+    return html
+
+
+def _match_ignoring_trailing_whitespace(html, search):
+    lines = [line.rstrip() for line in search.rstrip('\n').split('\n')]
+    pattern = r"\n".join(re.escape(line) + r"[ \t]*" for line in lines)
+    if search.endswith('\n'):
+        pattern += r"\n"
+    pattern = re.compile(pattern)
+    matches = pattern.findall(html)
+    return (matches[0] if matches else search), len(matches)
+
+
+def _parse_pointer(path):
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {path!r}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def _resolve_parent(document, parts):
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[_list_index(target, part)]
+        elif isinstance(target, dict) and part in target:
+            target = target[part]
+        else:
+            raise PatchError(f"Path segment {part!r} not found")
+    return target
+
+
+def _list_index(target, part, allow_end=False):
+    if allow_end and part == "-":
+        return len(target)
+    try:
+        index = int(part)
+    except ValueError:
+        raise PatchError(f"Invalid list index {part!r}")
+    if not 0 <= index < len(target) + (1 if allow_end else 0):
+        raise PatchError(f"List index {index} out of range")
+    return index
+
+
+def apply_json_patch(document, operations):
+    """Apply RFC 6902 add/remove/replace/test operations to a copy of document."""
+    if not isinstance(operations, list):
+        raise PatchError("JSON patch must be a list of operations")
+
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise PatchError(f"Invalid JSON patch operation: {operation!r}")
+        op, parts = operation["op"], _parse_pointer(operation["path"])
+        if not parts:
+            if op in ("add", "replace"):
+                document = copy.deepcopy(operation["value"])
+                continue
+            raise PatchError(f"Unsupported operation {op!r} on the document root")
+
+        parent, key = _resolve_parent(document, parts), parts[-1]
+        if not isinstance(parent, (dict, list)):
+            raise PatchError(f"Cannot patch inside a scalar at {operation['path']!r}")
+        if op == "add":
+            if isinstance(parent, list):
+                parent.insert(_list_index(parent, key, allow_end=True), operation["value"])
+            else:
+                parent[key] = operation["value"]
+        elif op == "replace":
+            if isinstance(parent, list):
+                parent[_list_index(parent, key)] = operation["value"]
+            elif key in parent:
+                parent[key] = operation["value"]
+            else:
+                raise PatchError(f"Cannot replace missing key {key!r}")
+        elif op == "remove":
+            if isinstance(parent, list):
+                del parent[_list_index(parent, key)]
+            elif key in parent:
+                del parent[key]
+            else:
+                raise PatchError(f"Cannot remove missing key {key!r}")
+        elif op == "test":
+            current = parent[_list_index(parent, key)] if isinstance(parent, list) else parent.get(key)
+            if current != operation.get("value"):
+                raise PatchError(f"Test failed for {operation['path']!r}")
+        else:
+            raise PatchError(f"Unsupported JSON patch operation {op!r}")
+    return document
+
+
+def apply_change_patch(current_html, current_local_storage, html_patch, storage_patch):
+    """Apply a model-generated change to an applet.
+
+    Returns (html_content, local_storage_content) like a full generation would,
+    with empty strings for the parts that did not change.
+    """
+    html_content = ""
+    blocks = parse_search_replace_blocks(html_patch)
+    if blocks:
+        html_content = apply_search_replace(current_html, blocks)
+        if '</html>' in current_html.lower() and '</html>' not in html_content.lower():
+            raise PatchError("Patched HTML is no longer a complete document")
+
+    local_storage_content = ""
+    if storage_patch.strip():
+        try:
+            operations = json.loads(storage_patch)
+        except ValueError as e:
+            raise PatchError(f"Invalid storage patch JSON: {e}")
+        storage = apply_json_patch(current_local_storage, operations)
+        if not isinstance(storage, dict):
+            raise PatchError("Patched storage is not a JSON object")
+        local_storage_content = json.dumps(storage)
+
+    return html_content, local_storage_content
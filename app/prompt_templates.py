@@ -0,0 +1,109 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+class PromptTemplate:
+    """A prompt template pre-split into literal and placeholder segments.
+
+    Rendering is a single join, so values are inserted once and never
+    rescanned for other placeholders.
+    """
+
+    def __init__(self, name, text):
+        self.name = name
+        self.digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]  # Changes with the text
+        self.segments = []  # (is_placeholder, literal text or placeholder name)
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            if match.start() > position:
+                self.segments.append((False, text[position:match.start()]))
+            self.segments.append((True, match.group(1)))
+            position = match.end()
+        if position < len(text):
+            self.segments.append((False, text[position:]))
+
+    @property
+    def placeholders(self):
+        return {value for is_placeholder, value in self.segments if is_placeholder}
+
+    def render(self, **values):
+        # Unknown placeholders are kept verbatim, like str.replace would
+        return "".join(
+            (values.get(value, f"{{{value}}}") if is_placeholder else value)
+            for is_placeholder, value in self.segments
+        )
+
+
+class TemplateRegistry:
+    """Loads <name>.prompt templates from a list of directories, later directories winning.
+
+    Templates are compiled once and reloaded only when their file's mtime
+    changes; the file is checked at most every check_interval seconds.
+    """
+
+    def __init__(self, directories, check_interval=1.0):
+        self.directories = list(directories)
+        self.check_interval = check_interval
+        self._paths = {}
+        self._templates = {}  # name -> (path, mtime_ns, checked_at, PromptTemplate)
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        """Register a template file under name, overriding the template directories."""
+        with self._lock:
+            self._paths[name] = path
+            self._templates.pop(name, None)
+
+    def names(self):
+        names = set(self._paths)
+        for directory in self.directories:
+            if os.path.isdir(directory):
+                names.update(file[:-len('.prompt')] for file in os.listdir(directory) if file.endswith('.prompt'))
+        return sorted(names)
+
+    def get(self, name):
+        with self._lock:
+            cached = self._templates.get(name)
+        now = time.monotonic()
+        if cached and now - cached[2] < self.check_interval:
+            return cached[3]
+
+        path = self._resolve(name)
+        mtime_ns = os.stat(path).st_mtime_ns
+        if cached and cached[0] == path and cached[1] == mtime_ns:
+            template = cached[3]
+        else:
+            with open(path, "r") as template_file:
+                template = PromptTemplate(name, template_file.read())
+            logger.info(f"Loaded prompt template {name} from {path}")
+
+        with self._lock:
+            self._templates[name] = (path, mtime_ns, now, template)
+        return template
+
+    def render(self, name, **values):
+        return self.get(name).render(**values)
+
+    def _resolve(self, name):
+        if name in self._paths:
+            return self._paths[name]
+        for directory in reversed(self.directories):
+            path = os.path.join(directory, f"{name}.prompt")
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"Prompt template {name} not found in {self.directories}")
+
+
+# Operators can add or override templates by listing extra directories in
+# PROMPT_TEMPLATE_PATH (separated like PATH); they take precedence over prompts/.
+template_registry = TemplateRegistry(
+    ["prompts"] + [path for path in os.getenv("PROMPT_TEMPLATE_PATH", "").split(os.pathsep) if path]
+)
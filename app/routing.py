@@ -0,0 +1,81 @@
+import re
+import json
+
+DATA_CHANGE = 'data'
+STRUCTURAL_CHANGE = 'structure'
+
+# Words that ask for new behaviour or a different look, which needs the HTML
+STRUCTURAL_WORDS = re.compile(
+    r"\b(button|buttons|colou?rs?|layout|style|styles|styling|font|fonts|theme|dark mode|light mode|design|"
+    r"page|pages|screen|view|tab|tabs|section|sections|column|columns|field|fields|input|form|menu|chart|graph|"
+    r"icon|icons|image|images|animation|feature|features|sort|sorting|filter|filtering|search|"
+    r"display|show|hide|bigger|smaller|larger|align|center|centre|background|title|header|footer|"
+    r"html|css|javascript|code|function|timer|sound|notification|checkbox|dropdown|slider|link|"
+    r"add a way|make it|allow|let me|should be able)\b",
+    re.IGNORECASE,
+)
+# Verbs of edits to the entries an applet already stores
+DATA_WORDS = re.compile(
+    r"\b(add|adds|added|put|insert|append|remove|delete|drop|clear|empty|mark|unmark|check|uncheck|tick|untick|"
+    r"complete|completed|done|set|change|update|rename|increase|decrease|increment|decrement|record|log|note|"
+    r"move|replace|edit|cross off|buy|bought)\b",
+    re.IGNORECASE,
+)
+
+
+class StorageChangeError(ValueError):
+    pass
+
+
+def classify_change(description, current_local_storage):
+    """Return DATA_CHANGE if a change request only edits the applet's stored data, else STRUCTURAL_CHANGE.
+
+    A keyword classifier: it runs in microseconds, and a misclassified data
+    change costs one fast-model call before the output check sends it to the
+    large model anyway.
+    """
+    if not isinstance(current_local_storage, dict) or not current_local_storage:
+        return STRUCTURAL_CHANGE  # Nothing to edit; the change must create the data model
+    if STRUCTURAL_WORDS.search(description) or not DATA_WORDS.search(description):
+        return STRUCTURAL_CHANGE
+    return DATA_CHANGE
+
+
+def _is_json(value):
+    try:
+        json.loads(value)
+    except ValueError:
+        return False
+    return True
+
+
+def validate_storage_change(content, current_local_storage):
+    """Parse the fast model's storage output and check that it only changed data.
+
+    The keys must stay the same, every value must still be a string, and a
+    value that held JSON must still hold JSON of the same type. Returns the
+    storage as JSON text; raises StorageChangeError otherwise.
+    """
+    try:
+        storage = json.loads(content)
+    except ValueError as e:
+        raise StorageChangeError(f"Storage is not valid JSON: {e}") from None
+    if not isinstance(storage, dict):
+        raise StorageChangeError("Storage is not a JSON object")
+    if set(storage) != set(current_local_storage):
+        raise StorageChangeError(f"Storage keys changed: {sorted(set(storage) ^ set(current_local_storage))}")
+    for key, value in storage.items():
+        current = current_local_storage[key]
+        if not isinstance(value, str):
+            raise StorageChangeError(f"Value of {key!r} is not a string")
+        if isinstance(current, str) and _is_json(current):
+            if not _is_json(value) or type(json.loads(value)) is not type(json.loads(current)):
+                raise StorageChangeError(f"Value of {key!r} no longer holds the same kind of JSON")
+    return json.dumps(storage)
+
+
+def storage_token_budget(current_local_storage, max_tokens):
+    """Return max_tokens for rewriting the storage (about 3 characters per token, plus room to grow),
+    or None if even max_tokens would not fit it."""
+    needed = len(json.dumps(current_local_storage)) // 3 + 256
+    return needed if needed <= max_tokens else None
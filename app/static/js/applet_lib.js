@@ -1,100 +1,90 @@
 function updateApplet(uuid, iframe) {
-    let lastModified = { storage: null, html: null };
-
-    // Helper function to create the proxy script
-    function createProxyScript(storageData) {
-      return `
-        (function() {
-          var localStorageData = ${JSON.stringify(storageData)};
-          function createLocalStorageWrapper(onStorageChanged) {
-            return {
-              setItem(key, value) {
-                if (typeof key !== 'string') {
-                  throw new TypeError("Keys must be strings");
-                }
-                localStorageData[key] = value.toString();
-                onStorageChanged(localStorageData);
-              },
-              getItem(key) {
-                return localStorageData[key] || null;
-              },
-              removeItem(key) {
-                delete localStorageData[key];
-                onStorageChanged(localStorageData);
-              },
-              clear() {
-                localStorageData = {};
-                onStorageChanged(localStorageData);
-              },
-              key(index) {
-                return Object.keys(localStorageData)[index] || null;
-              },
-              get length() {
-                return Object.keys(localStorageData).length;
-              }
-            };
-          }
-          var onStorageChanged = function(updatedData) {
-            window.parent.postMessage({ type: 'storageChanged', data: updatedData }, '*');
-          };
-          Object.defineProperty(window, 'localStorage', {
-            value: createLocalStorageWrapper(onStorageChanged),
-            writable: false,
-            configurable: false,
-            enumerable: true
-          });
-        })();
-      `;
-    }
-  
-    // Helper function to load the applet into the iframe
-    function loadApplet(storageData, htmlContent) {
-      // Ensure storageData is an object, initialize as empty if not
-      if (typeof storageData !== 'object' || storageData === null || Array.isArray(storageData)) {
-        storageData = {};
-      }
-    
-      const proxyScript = createProxyScript(storageData);
-      const modifiedHtmlContent = htmlContent.replace('<head>', `<head><script>${proxyScript}</script>`);
+    // Validators of the last versions we loaded; the document's is also its version
+    let etags = { storage: null, document: null };
+    let pollTimer = null;
+    let pollInterval = null;
+    let partialHtml = '';
+    let partialRenderTimer = null;
+    // Identifies this tab so it can ignore change events caused by its own writes
+    const clientId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    // Storage changes not yet sent, and whether a write is in flight
+    let pendingChange = null;
+    let writeInFlight = false;
+    const storageStats = { mutations: 0, batches: 0, writes: 0 };
+    window.appletStorageStats = () => Object.assign({ saved: storageStats.mutations - storageStats.writes }, storageStats);
+
+    // The scripts the server injects into applet documents (see app/applet_document.py)
+    const shimTags = ['/static/js/storage_changes.js', `/applet/${uuid}/storage.js`, '/static/js/applet_shim.js']
+      .map(src => `<script src="${src}"></script>`)
+      .join('');
 
-      // Save the scroll position
+    // Run fn to (re)load the iframe, keeping its scroll position
+    function keepScrollPosition(fn) {
       const scrollPosition = {
         x: iframe.contentWindow?.scrollX || 0,
         y: iframe.contentWindow?.scrollY || 0
       };
-
-      // Set the iframe's srcdoc to the modified HTML content
-      iframe.srcdoc = modifiedHtmlContent;
-
-      // Restore the scroll position after the iframe loads
       iframe.onload = function() {
         iframe.contentWindow.scrollTo(scrollPosition.x, scrollPosition.y);
       };
+      fn();
     }
-  
-    // Function to fetch storage data and HTML content
-    function fetchAppletData() {
-      return Promise.all([
-        fetch(`/applet/${uuid}/storage`, { cache: 'no-cache' }),
-        fetch(`/applet/${uuid}/html`, { cache: 'no-cache' })
-      ]);
+
+    // Show a version of the applet document; versioned URLs are cached by the browser
+    function loadDocument(etag) {
+      const version = etag.replace(/^W\//, '').replace(/"/g, '');
+      keepScrollPosition(() => {
+        iframe.removeAttribute('srcdoc');  // srcdoc would take precedence over src
+        iframe.src = `/applet/${uuid}/document/${version}`;
+      });
+    }
+
+    // HTML still being generated has no document yet; inject the shim here, read-only: the
+    // generation saves the storage when it finishes, and a preview's writes must not race it
+    const previewShimTags = '<script>window.appletPreview = true;</script>' + shimTags;
+    function loadPartial(htmlContent) {
+      const head = /<head\b[^>]*>/i;
+      const content = head.test(htmlContent)
+        ? htmlContent.replace(head, match => match + previewShimTags)
+        : previewShimTags + htmlContent;
+      keepScrollPosition(() => {
+        iframe.srcdoc = content;
+      });
+    }
+
+    // Conditionally check one part of the applet; resolves to true if it changed
+    function checkIfChanged(kind) {
+      const headers = etags[kind] ? { 'If-None-Match': etags[kind] } : {};
+      return fetch(`/applet/${uuid}/${kind}`, { method: 'HEAD', cache: 'no-store', headers })
+        .then(response => {
+          if (response.status === 304) {
+            return false;
+          }
+          if (!response.ok) {
+            throw new Error(`Failed to check ${kind}`);
+          }
+          etags[kind] = response.headers.get('ETag');
+          return true;
+        });
+    }
+
+    // Check the storage and the document, reloading only what changed
+    function refreshApplet() {
+      return Promise.all([checkIfChanged('storage'), checkIfChanged('document')])
+        .then(([storageChanged, documentChanged]) => {
+          if (documentChanged) {
+            loadDocument(etags.document);
+          } else if (storageChanged && iframe.getAttribute('srcdoc') === null) {
+            // Only the storage changed: navigating to the same version takes the document
+            // from the cache, and only its storage.js is fetched again
+            loadDocument(etags.document);
+          }
+        });
     }
   
     // Initial load of the applet
     function initialLoad() {
-      fetchAppletData()
-        .then(async ([storageResponse, htmlResponse]) => {
-          if (!storageResponse.ok || !htmlResponse.ok) {
-            throw new Error('Failed to fetch storage or HTML content');
-          }
-
-          lastModified.storage = storageResponse.headers.get('Last-Modified');
-          lastModified.html = htmlResponse.headers.get('Last-Modified');
-          const storageData = await storageResponse.json();
-          const htmlContent = await htmlResponse.text();
-
-          loadApplet(storageData, htmlContent);
-        })
+      refreshApplet()
         .catch(err => {
           console.error('Error during initial load:', err);
         });
@@ -102,78 +92,213 @@ function updateApplet(uuid, iframe) {
   
     // Function to reload the applet when updates are detected
     function reloadApplet() {
-      fetchAppletData()
-        .then(async ([storageResponse, htmlResponse]) => {
-          if (!storageResponse.ok || !htmlResponse.ok) {
-            throw new Error('Failed to fetch storage or HTML content');
-          }
-
-          lastModified.storage = storageResponse.headers.get('Last-Modified');
-          lastModified.html = htmlResponse.headers.get('Last-Modified');
-          const storageData = await storageResponse.json();
-          const htmlContent = await htmlResponse.text();
-
-          loadApplet(storageData, htmlContent);
-        })
+      refreshApplet()
         .catch(err => {
           console.error('Error during reload:', err);
         });
     }
   
-    // Periodically check for updates from the server
+    // Periodically check for updates from the server; unchanged parts answer 304
     function checkForUpdates() {
-      Promise.all([
-        fetch(`/applet/${uuid}/storage`, { method: 'HEAD', cache: 'no-cache' }),
-        fetch(`/applet/${uuid}/html`, { method: 'HEAD', cache: 'no-cache' })
-      ])
-        .then(([storageResponse, htmlResponse]) => {
-          if (storageResponse.ok && htmlResponse.ok) {
-            const serverStorageLastModified = storageResponse.headers.get('Last-Modified');
-            const serverHtmlLastModified = htmlResponse.headers.get('Last-Modified');
-            
-            if ((serverStorageLastModified && serverStorageLastModified !== lastModified.storage) ||
-                (serverHtmlLastModified && serverHtmlLastModified !== lastModified.html)) {
-              console.log('New version found. Reloading applet...');
-              lastModified.storage = serverStorageLastModified;
-              lastModified.html = serverHtmlLastModified;
+      refreshApplet()
+        .catch(err => {
+          console.error('Error checking for updates:', err);
+        });
+    }
+  
+    // Send only the changed keys; the server merges them into its current version
+    function sendStorageChange(change, base, keepalive = false) {
+      return fetch(`/applet/${uuid}/storage`, {
+        method: 'PATCH',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-Client-Id': clientId
+        },
+        body: JSON.stringify(Object.assign({ base: base }, change)),
+        keepalive: keepalive
+      });
+    }
+
+    // Write the pending changes, keeping at most one write in flight; changes made
+    // meanwhile are merged and sent when it completes
+    function flushStorageChanges() {
+      if (writeInFlight || pendingChange === null) {
+        return;
+      }
+      const change = pendingChange;
+      pendingChange = null;
+      writeInFlight = true;
+      storageStats.writes++;
+
+      sendStorageChange(change, etags.storage)
+        .then(async response => {
+          if (response.status === 409) {
+            // Someone else changed the same keys: ours win, then pick up the rest of theirs
+            console.warn('Storage changed on the server, merging');
+            response = await sendStorageChange(change, null);
+            if (response.ok) {
               reloadApplet();
+              return;
             }
           }
+          if (response.ok) {
+            const result = await response.json();
+            if (result.merged) {
+              // The server merged our write onto changes we have not loaded: its ETag
+              // is not the version the iframe has, so load that version
+              reloadApplet();
+              return;
+            }
+            // Our write is the new server version, no need to reload it
+            etags.storage = response.headers.get('ETag');
+            console.log('Storage data updated on server');
+          } else {
+            throw new Error('Failed to update storage data');
+          }
         })
         .catch(err => {
-          console.error('Error checking for updates:', err);
+          console.error('Error updating storage data:', err);
+        })
+        .finally(() => {
+          writeInFlight = false;
+          flushStorageChanges();
         });
     }
-  
+
     // Listen for storage changes from the iframe
     window.addEventListener('message', event => {
-      if (event.data?.type === 'storageChanged') {
-        const updatedData = event.data.data;
-  
-        // Send PUT request to update storage data on server
-        fetch(`/applet/${uuid}/storage`, {
-          method: 'PUT',
-          headers: {
-            'Content-Type': 'application/json'
-          },
-          body: JSON.stringify(updatedData)
-        })
-          .then(response => {
-            if (response.ok) {
-              console.log('Storage data updated on server');
-              console.log('Updated storage data:', JSON.stringify(updatedData)); // Log the updated storage data
-            } else {
-              throw new Error('Failed to update storage data');
-            }
-          })
-          .catch(err => {
-            console.error('Error updating storage data:', err);
-          });
+      if (event.data?.type === 'appletLoaded') {
+        // Writes are based on the storage the document runs on, unless ours are still under way
+        if (!writeInFlight && pendingChange === null && event.data.storageEtag) {
+          etags.storage = event.data.storageEtag;
+        }
+      } else if (event.data?.type === 'storageChanged') {
+        if (iframe.getAttribute('srcdoc') !== null) {
+          return;  // A partial preview; only the final document writes
+        }
+        const change = event.data.change;
+        storageStats.mutations += event.data.mutations || 1;
+        storageStats.batches++;
+        pendingChange = pendingChange ? mergeStorageChanges(pendingChange, change) : change;
+        flushStorageChanges();
+      }
+    });
+
+    // Don't lose changes still waiting for the in-flight write, or still buffered in the iframe
+    window.addEventListener('beforeunload', () => {
+      let buffered = null;
+      try {
+        buffered = iframe.contentWindow?.takeAppletStorageChanges?.();
+      } catch (err) {
+        console.error('Could not collect the applet\'s buffered changes:', err);
+      }
+      if (buffered) {
+        storageStats.mutations += buffered.mutations;
+        storageStats.batches++;
+        pendingChange = pendingChange ? mergeStorageChanges(pendingChange, buffered.change) : buffered.change;
+      }
+      if (pendingChange !== null) {
+        storageStats.writes++;
+        sendStorageChange(pendingChange, null, true);
+        pendingChange = null;
       }
     });
   
-    // Start the periodic update check
-    setInterval(checkForUpdates, 333);
+    // Events only reach pages connected to the server process that made the change, so a slow
+    // poll runs alongside the feed to pick up changes made through other processes
+    const FEED_POLL_MS = 5000;
+    const FALLBACK_POLL_MS = 333;
+
+    // Periodically check for updates from the server every ms milliseconds
+    function pollEvery(ms) {
+      if (pollInterval !== ms) {
+        clearInterval(pollTimer);
+        pollInterval = ms;
+        pollTimer = setInterval(checkForUpdates, ms);
+      }
+    }
+
+    // Fallback when the feed is gone for good: poll quickly instead
+    function startPolling() {
+      if (pollInterval !== FALLBACK_POLL_MS) {
+        console.warn('Change feed unavailable, falling back to polling');
+        pollEvery(FALLBACK_POLL_MS);
+      }
+    }
+
+    // Subscribe to the server-push change feed
+    function subscribeToChanges() {
+      if (typeof EventSource === 'undefined') {
+        startPolling();
+        return;
+      }
+
+      const source = new EventSource(`/applet/${uuid}/events`);
+      let connectedBefore = false;
+      pollEvery(FEED_POLL_MS);
+
+      const onChange = event => {
+        const change = JSON.parse(event.data);
+        if (change.source && change.source === clientId) {
+          return; // Our own write, the iframe already has this state
+        }
+        if (change.type === 'html') {
+          etags.document = null;  // Replace a partial render even if the document came out the same
+          partialHtml = '';
+          clearTimeout(partialRenderTimer);
+          partialRenderTimer = null;
+        }
+        console.log('New version found. Reloading applet...');
+        reloadApplet();
+      };
+
+      // HTML streamed while the applet is being generated
+      const onPartial = event => {
+        const partial = JSON.parse(event.data);
+        if (partial.offset === 0) {
+          partialHtml = '';
+        }
+        if (partial.offset > partialHtml.length) {
+          return; // Missed a piece; the final version will follow
+        }
+        partialHtml += partial.html.slice(partialHtml.length - partial.offset);
+        if (partialRenderTimer === null) {
+          partialRenderTimer = setTimeout(() => {
+            partialRenderTimer = null;
+            loadPartial(partialHtml);
+            document.dispatchEvent(new Event('appletpartial'));
+          }, 300);
+        }
+      };
+
+      // The generation failed after streaming: drop the partial render and show the current version
+      const onAborted = () => {
+        partialHtml = '';
+        clearTimeout(partialRenderTimer);
+        partialRenderTimer = null;
+        etags.document = null;
+        reloadApplet();
+      };
+
+      source.addEventListener('html', onChange);
+      source.addEventListener('storage', onChange);
+      source.addEventListener('partial', onPartial);
+      source.addEventListener('aborted', onAborted);
+      source.addEventListener('open', () => {
+        // Changes may have happened while we were reconnecting
+        if (connectedBefore) {
+          checkForUpdates();
+        }
+        connectedBefore = true;
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          startPolling();
+        }
+      };
+    }
+
+    subscribeToChanges();
   
     // Perform the initial load
     initialLoad();
@@ -196,6 +321,24 @@ function updateApplet(uuid, iframe) {
     }
 }
 
+// Poll a background job until it finishes; resolves to its result
+async function waitForJob(statusUrl, interval = 1000) {
+  while (true) {
+    const response = await fetch(statusUrl, { cache: 'no-store' });
+    if (!response.ok) {
+      throw new Error('Failed to fetch job status');
+    }
+    const job = await response.json();
+    if (job.status === 'succeeded') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Job failed');
+    }
+    await new Promise(resolve => setTimeout(resolve, interval));
+  }
+}
+
 async function changeApplet(uuid, audioBlob) {
   const formData = new FormData();
   formData.append('audio', audioBlob);
@@ -208,7 +351,8 @@ async function changeApplet(uuid, audioBlob) {
 
     if (response.ok) {
       const data = await response.json();
-      return data.uuid;
+      const result = await waitForJob(data.status_url);
+      return result.uuid;
     } else {
       throw new Error('Failed to change applet');
     }
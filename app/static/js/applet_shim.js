@@ -0,0 +1,95 @@
+// Injected into every applet document after storage_changes.js and the applet's
+// storage.js: replaces localStorage with a proxy over the server-side storage and
+// reports changes to the page, which sends them to the server. In a partial preview
+// (window.appletPreview) changes stay in the document and are not reported.
+(function() {
+  var preview = window.appletPreview === true;
+  delete window.appletPreview;
+  var loaded = window.appletStorage || { etag: null, data: {} };
+  delete window.appletStorage;
+  var localStorageData = loaded.data;
+  // Ensure the storage is an object, initialize as empty if not
+  if (typeof localStorageData !== 'object' || localStorageData === null || Array.isArray(localStorageData)) {
+    localStorageData = {};
+  }
+  var merge = mergeStorageChanges;
+  delete window.mergeStorageChanges;
+
+  function createLocalStorageWrapper(onStorageChanged) {
+    return {
+      setItem(key, value) {
+        if (typeof key !== 'string') {
+          throw new TypeError("Keys must be strings");
+        }
+        localStorageData[key] = value.toString();
+        onStorageChanged({ set: { [key]: localStorageData[key] } });
+      },
+      getItem(key) {
+        return localStorageData[key] || null;
+      },
+      removeItem(key) {
+        delete localStorageData[key];
+        onStorageChanged({ delete: [key] });
+      },
+      clear() {
+        localStorageData = {};
+        onStorageChanged({ clear: true });
+      },
+      key(index) {
+        return Object.keys(localStorageData)[index] || null;
+      },
+      get length() {
+        return Object.keys(localStorageData).length;
+      }
+    };
+  }
+
+  // Coalesce mutations made within a short window into one message
+  var pendingChange = null;
+  var pendingMutations = 0;
+  var flushTimer = null;
+  function flushStorageChanges() {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    if (pendingChange) {
+      window.parent.postMessage({ type: 'storageChanged', change: pendingChange, mutations: pendingMutations }, '*');
+      pendingChange = null;
+      pendingMutations = 0;
+    }
+  }
+  var onStorageChanged = function(change) {
+    if (preview) {
+      return;
+    }
+    pendingChange = pendingChange ? merge(pendingChange, change) : change;
+    pendingMutations++;
+    if (flushTimer === null) {
+      flushTimer = setTimeout(flushStorageChanges, 50);
+    }
+  };
+  window.addEventListener('pagehide', flushStorageChanges);
+  // The page's beforeunload runs before our pagehide, so it takes the buffered changes
+  // itself, synchronously, to send them with its final write (see applet_lib.js)
+  Object.defineProperty(window, 'takeAppletStorageChanges', {
+    value: function() {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+      var taken = pendingChange ? { change: pendingChange, mutations: pendingMutations } : null;
+      pendingChange = null;
+      pendingMutations = 0;
+      return taken;
+    },
+    writable: false,
+    configurable: false,
+    enumerable: false
+  });
+  Object.defineProperty(window, 'localStorage', {
+    value: createLocalStorageWrapper(onStorageChanged),
+    writable: false,
+    configurable: false,
+    enumerable: true
+  });
+
+  // Tell the page which storage version this document runs on; its writes are based on it
+  window.parent.postMessage({ type: 'appletLoaded', storageEtag: loaded.etag }, '*');
+})();
@@ -0,0 +1,21 @@
+// Merge two key-level storage changes ({ clear, set, delete }) so that applying the
+// result equals applying `first` and then `second`. Used by the page and, through
+// applet_shim.js, by the applet document.
+function mergeStorageChanges(first, second) {
+  const merged = {
+    clear: Boolean(first.clear || second.clear),
+    set: second.clear ? {} : Object.assign({}, first.set),
+    delete: second.clear ? [] : (first.delete || []).slice()
+  };
+  (second.delete || []).forEach(key => {
+    delete merged.set[key];
+    if (!merged.delete.includes(key)) {
+      merged.delete.push(key);
+    }
+  });
+  Object.keys(second.set || {}).forEach(key => {
+    merged.set[key] = second.set[key];
+    merged.delete = merged.delete.filter(deleted => deleted !== key);
+  });
+  return merged;
+}
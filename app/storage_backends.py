@@ -0,0 +1,595 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import zipfile
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows: applet locks only serialise threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class Stat(namedtuple('Stat', ['st_mtime_ns', 'st_size'])):
+    """The part of os.stat_result that the storage layer uses."""
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+
+class StorageBackend:
+    """Where applet files live.
+
+    Files are addressed by an applet id and a name relative to the applet,
+    with '/' separating nested names (e.g. 'versions/manifest.jsonl'). Writes
+    replace a file atomically: readers see the old or the new content, never a
+    mix. Stats only need st_mtime_ns and st_size, and a file written later
+    must not get an older mtime.
+    """
+
+    def read(self, applet, name):
+        """Return (data, stat), or None if the file does not exist."""
+        raise NotImplementedError
+
+    def stat(self, applet, name):
+        raise NotImplementedError
+
+    def write(self, applet, name, data):
+        """Replace the file with data and return its stat."""
+        raise NotImplementedError
+
+    def write_stream(self, applet, name, stream):
+        return self.write(applet, name, stream.read())
+
+    def append(self, applet, name, data):
+        raise NotImplementedError
+
+    def delete(self, applet, name):
+        """Delete the file; a missing file is not an error."""
+        raise NotImplementedError
+
+    def list(self, applet):
+        """Return the sorted names of the applet's top-level files."""
+        raise NotImplementedError
+
+    def files(self, applet):
+        """Return the sorted names of all of the applet's files, nested ones included."""
+        raise NotImplementedError
+
+    def exists(self, applet):
+        raise NotImplementedError
+
+    def create(self, applet):
+        raise NotImplementedError
+
+    def remove(self, applet):
+        """Delete the applet and all of its files."""
+        raise NotImplementedError
+
+    def applets(self):
+        """Return the sorted ids of all applets."""
+        raise NotImplementedError
+
+    def lock(self, applet):
+        """Context manager excluding writers of the applet in other processes.
+
+        Threads of one process are serialised by file_manager.applet_lock,
+        which takes this lock once per thread.
+        """
+        return nullcontext()
+
+    @contextmanager
+    def local_path(self, applet, name):
+        """Yield a local file path with the file's content, for tools that need one."""
+        found = self.read(applet, name)
+        if found is None:
+            raise FileNotFoundError(f"{applet}/{name}")
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(found[0])
+            yield path
+        finally:
+            os.unlink(path)
+
+
+class FilesystemBackend(StorageBackend):
+    """One directory per applet under root; the layout the server has always used."""
+
+    def __init__(self, root, fsync=False):
+        self.root = root
+        self.fsync = fsync  # fsync every write (and the directory rename) before returning
+
+    def _path(self, applet, name=''):
+        return os.path.join(self.root, applet, *name.split('/'))
+
+    def read(self, applet, name):
+        try:
+            with open(self._path(applet, name), 'rb') as f:
+                stat = os.fstat(f.fileno())
+                return f.read(), stat
+        except FileNotFoundError:
+            return None
+
+    def stat(self, applet, name):
+        try:
+            return os.stat(self._path(applet, name))
+        except FileNotFoundError:
+            return None
+
+    def _write_with(self, path, write):
+        """Write to a temporary file next to path with write(file) and rename it into place."""
+        directory = os.path.dirname(path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+        except FileNotFoundError:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(os, 'fchmod'):
+                    os.fchmod(f.fileno(), 0o644)
+                write(f)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                stat = os.fstat(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return stat
+
+    def write(self, applet, name, data):
+        return self._write_with(self._path(applet, name), lambda f: f.write(data))
+
+    def write_stream(self, applet, name, stream):
+        return self._write_with(self._path(applet, name), lambda f: shutil.copyfileobj(stream, f, STREAM_CHUNK_BYTES))
+
+    def append(self, applet, name, data):
+        path = self._path(applet, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def delete(self, applet, name):
+        try:
+            os.unlink(self._path(applet, name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, applet):
+        try:
+            entries = os.scandir(self._path(applet))
+        except FileNotFoundError:
+            return []
+        with entries:
+            # Dot files are locks and in-flight temporary files
+            return sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.'))
+
+    def files(self, applet):
+        root = self._path(applet)
+        names = []
+        for directory, _, files in os.walk(root):
+            prefix = os.path.relpath(directory, root).replace(os.sep, '/')
+            names.extend(
+                name if prefix == '.' else f'{prefix}/{name}' for name in files if not name.startswith('.')
+            )
+        return sorted(names)
+
+    def exists(self, applet):
+        return os.path.isdir(self._path(applet))
+
+    def create(self, applet):
+        os.makedirs(self._path(applet), exist_ok=True)
+
+    def remove(self, applet):
+        shutil.rmtree(self._path(applet), ignore_errors=True)
+
+    def applets(self):
+        try:
+            entries = os.scandir(self.root)
+        except FileNotFoundError:
+            return []
+        with entries:
+            # Dot directories are not applets (the cold tier keeps its archives in one)
+            return sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+
+    @contextmanager
+    def lock(self, applet):
+        if fcntl is None:
+            yield
+            return
+        lock_fd = os.open(self._path(applet, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    @contextmanager
+    def local_path(self, applet, name):
+        path = self._path(applet, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        yield path
+
+
+class SQLiteBackend(StorageBackend):
+    """All applets in one SQLite database, which the worker processes of one host can share.
+
+    The database runs in WAL mode, whose shared-memory index does not work
+    across hosts, so it must not be shared over a network filesystem.
+
+    An applet lock is a write transaction: the writes made while holding it
+    commit together, and other processes wait for it like for a file lock.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS applets (applet TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS files (
+        applet TEXT NOT NULL,
+        name TEXT NOT NULL,
+        data BLOB NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        PRIMARY KEY (applet, name)
+    );
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly in _transaction
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        if self._local.depth:  # Part of the transaction of a held lock
+            yield connection
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def _mtime_ns(self, connection, applet, name):
+        # Never go back in time, even if the clock does, so newer files never look older
+        row = connection.execute(
+            "SELECT mtime_ns FROM files WHERE applet = ? AND name = ?", (applet, name)
+        ).fetchone()
+        return max(time.time_ns(), row[0] + 1 if row else 0)
+
+    def read(self, applet, name):
+        row = self._connect().execute(
+            "SELECT data, mtime_ns FROM files WHERE applet = ? AND name = ?", (applet, name)
+        ).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), Stat(row[1], len(row[0]))
+
+    def stat(self, applet, name):
+        row = self._connect().execute(
+            "SELECT mtime_ns, length(data) FROM files WHERE applet = ? AND name = ?", (applet, name)
+        ).fetchone()
+        return Stat(row[0], row[1]) if row else None
+
+    def write(self, applet, name, data):
+        with self._transaction() as connection:
+            mtime_ns = self._mtime_ns(connection, applet, name)
+            connection.execute("INSERT OR IGNORE INTO applets (applet) VALUES (?)", (applet,))
+            connection.execute(
+                "INSERT OR REPLACE INTO files (applet, name, data, mtime_ns) VALUES (?, ?, ?, ?)",
+                (applet, name, data, mtime_ns),
+            )
+        return Stat(mtime_ns, len(data))
+
+    def append(self, applet, name, data):
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT data FROM files WHERE applet = ? AND name = ?", (applet, name)
+            ).fetchone()
+            self.write(applet, name, (bytes(row[0]) if row else b'') + data)
+
+    def delete(self, applet, name):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM files WHERE applet = ? AND name = ?", (applet, name))
+
+    def list(self, applet):
+        rows = self._connect().execute(
+            "SELECT name FROM files WHERE applet = ? AND instr(name, '/') = 0 ORDER BY name", (applet,)
+        )
+        return [row[0] for row in rows]
+
+    def files(self, applet):
+        rows = self._connect().execute("SELECT name FROM files WHERE applet = ? ORDER BY name", (applet,))
+        return [row[0] for row in rows]
+
+    def exists(self, applet):
+        return self._connect().execute("SELECT 1 FROM applets WHERE applet = ?", (applet,)).fetchone() is not None
+
+    def create(self, applet):
+        with self._transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO applets (applet) VALUES (?)", (applet,))
+
+    def remove(self, applet):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM files WHERE applet = ?", (applet,))
+            connection.execute("DELETE FROM applets WHERE applet = ?", (applet,))
+
+    def applets(self):
+        return [row[0] for row in self._connect().execute("SELECT applet FROM applets ORDER BY applet")]
+
+    def lock(self, applet):
+        return self._transaction()
+
+
+class MemoryBackend(StorageBackend):
+    """Applets in a dict; for tests and single-process experiments. Nothing survives a restart."""
+
+    def __init__(self):
+        self._applets = {}  # applet -> {name: (data, Stat)}
+        self._lock = threading.Lock()
+
+    def read(self, applet, name):
+        with self._lock:
+            return self._applets.get(applet, {}).get(name)
+
+    def stat(self, applet, name):
+        found = self.read(applet, name)
+        return found[1] if found else None
+
+    def write(self, applet, name, data):
+        data = bytes(data)
+        with self._lock:
+            files = self._applets.setdefault(applet, {})
+            previous = files.get(name)
+            stat = Stat(max(time.time_ns(), previous[1].st_mtime_ns + 1 if previous else 0), len(data))
+            files[name] = (data, stat)
+        return stat
+
+    def append(self, applet, name, data):
+        with self._lock:
+            previous = self._applets.get(applet, {}).get(name)
+        # Appends are made under the applet lock, so nobody writes in between
+        self.write(applet, name, (previous[0] if previous else b'') + data)
+
+    def delete(self, applet, name):
+        with self._lock:
+            self._applets.get(applet, {}).pop(name, None)
+
+    def list(self, applet):
+        with self._lock:
+            return sorted(name for name in self._applets.get(applet, {}) if '/' not in name)
+
+    def files(self, applet):
+        with self._lock:
+            return sorted(self._applets.get(applet, {}))
+
+    def exists(self, applet):
+        with self._lock:
+            return applet in self._applets
+
+    def create(self, applet):
+        with self._lock:
+            self._applets.setdefault(applet, {})
+
+    def remove(self, applet):
+        with self._lock:
+            self._applets.pop(applet, None)
+
+    def applets(self):
+        with self._lock:
+            return sorted(self._applets)
+
+
+class ColdTier(StorageBackend):
+    """Wraps the hot backend and moves idle applets to a cold tier of one zip archive per applet.
+
+    freeze() packs an applet into <cold root>/<applet>.zip and removes it
+    from the hot backend. Every access that misses in the hot backend checks
+    for an archive and restores the applet first, so a cold applet looks like
+    any other to its callers; hot applets only pay when a file is missing.
+    applets() lists the hot applets only, so a sweep over them does not
+    bring the whole cold tier back.
+    """
+
+    def __init__(self, hot, root):
+        self.hot = hot
+        self.root = root
+        self.restored = 0
+        self._restore_lock = threading.Lock()
+
+    def _archive_path(self, applet):
+        return os.path.join(self.root, f'{applet}.zip')
+
+    def is_cold(self, applet):
+        return os.path.exists(self._archive_path(applet))
+
+    def cold_applets(self):
+        try:
+            return sorted(name[:-len('.zip')] for name in os.listdir(self.root) if name.endswith('.zip'))
+        except FileNotFoundError:
+            return []
+
+    def freeze(self, applet, skip_suffixes=()):
+        """Pack the applet into its archive and remove it from the hot backend.
+
+        Files ending in skip_suffixes (e.g. compressed sidecars that are
+        rebuilt on demand) are left out. The caller holds the applet lock.
+        Returns (bytes read, archive bytes).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=f'.{applet}.', suffix='.tmp')
+        read = 0
+        with self._restore_lock:
+            try:
+                with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    for name in self.hot.files(applet):
+                        if skip_suffixes and name.endswith(tuple(skip_suffixes)):
+                            continue
+                        found = self.hot.read(applet, name)
+                        if found is not None:
+                            archive.writestr(name, found[0])
+                            read += len(found[0])
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            # The archive is in place before the hot copy goes, so readers always find one of them;
+            # a restore waits for _restore_lock, so it cannot run between the two
+            os.replace(tmp_path, self._archive_path(applet))
+            self.hot.remove(applet)
+        return read, os.path.getsize(self._archive_path(applet))
+
+    def _restore(self, applet):
+        """Bring a cold applet back into the hot backend; return whether it was cold."""
+        path = self._archive_path(applet)
+        if not os.path.exists(path):
+            return False
+        with self._restore_lock:
+            try:
+                archive = zipfile.ZipFile(path)
+            except FileNotFoundError:
+                return True  # Restored by another thread meanwhile
+            with archive:
+                self.hot.create(applet)
+                names = archive.namelist()
+                # Files derived from another (<name>.gz) last: a sidecar older than its file is ignored
+                derived = {name for name in names if any(name.startswith(other + '.') for other in names)}
+                for name in sorted(names, key=lambda name: name in derived):
+                    # Files written since the applet went cold (by another process) are newer
+                    if self.hot.stat(applet, name) is None:
+                        self.hot.write(applet, name, archive.read(name))
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.restored += 1
+        logger.info(f"Restored applet {applet} from the cold tier")
+        return True
+
+    def _ensure_hot(self, applet):
+        if not self.hot.exists(applet):
+            self._restore(applet)
+
+    def read(self, applet, name):
+        found = self.hot.read(applet, name)
+        if found is None and self._restore(applet):
+            found = self.hot.read(applet, name)
+        return found
+
+    def stat(self, applet, name):
+        stat = self.hot.stat(applet, name)
+        if stat is None and self._restore(applet):
+            stat = self.hot.stat(applet, name)
+        return stat
+
+    def write(self, applet, name, data):
+        self._ensure_hot(applet)
+        return self.hot.write(applet, name, data)
+
+    def write_stream(self, applet, name, stream):
+        self._ensure_hot(applet)
+        return self.hot.write_stream(applet, name, stream)
+
+    def append(self, applet, name, data):
+        self._ensure_hot(applet)
+        self.hot.append(applet, name, data)
+
+    def delete(self, applet, name):
+        self._ensure_hot(applet)
+        self.hot.delete(applet, name)
+
+    def list(self, applet):
+        names = self.hot.list(applet)
+        if not names and self._restore(applet):
+            names = self.hot.list(applet)
+        return names
+
+    def files(self, applet):
+        names = self.hot.files(applet)
+        if not names and self._restore(applet):
+            names = self.hot.files(applet)
+        return names
+
+    def exists(self, applet):
+        return self.hot.exists(applet) or self.is_cold(applet)
+
+    def create(self, applet):
+        self._ensure_hot(applet)
+        self.hot.create(applet)
+
+    def remove(self, applet):
+        self.hot.remove(applet)
+        try:
+            os.unlink(self._archive_path(applet))
+        except FileNotFoundError:
+            pass
+
+    def applets(self):
+        return self.hot.applets()
+
+    @contextmanager
+    def lock(self, applet):
+        self._ensure_hot(applet)
+        with self.hot.lock(applet):
+            yield
+
+    @contextmanager
+    def local_path(self, applet, name):
+        if self.hot.stat(applet, name) is None:
+            self._restore(applet)
+        with self.hot.local_path(applet, name) as path:
+            yield path
+
+
+def create_backend(kind, root=None, sqlite_path=None, fsync=False):
+    """Build the backend named by STORAGE_BACKEND."""
+    if kind == 'filesystem':
+        return FilesystemBackend(root, fsync=fsync)
+    if kind == 'sqlite':
+        return SQLiteBackend(sqlite_path)
+    if kind == 'memory':
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend {kind!r}")
@@ -0,0 +1,282 @@
+import io
+import json
+import zlib
+import zipfile
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from app.applet_index import applet_index
+from app.cache import artifact_cache
+from app.file_manager import (
+    EMPTY_STORAGE_CONTENT,
+    applet_lock,
+    read_applet_html,
+    read_applet_storage,
+    read_artifact,
+    save_html_files,
+    save_local_storage,
+    storage_backend,
+)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'versions/manifest.jsonl'
+PACKS_DIR = 'versions/packs'
+MAX_DELTA_CHAIN = 8  # Longest run of deltas before a blob is stored whole again
+
+# Compress a blob against the same artifact of the previous version; edits
+# usually change little, so this stores mostly the difference.
+_delta_compression = True
+
+
+class VersionError(Exception):
+    pass
+
+
+def configure_versions(delta=True):
+    global _delta_compression
+    _delta_compression = delta
+
+
+def _blob_name(digest):
+    return f'versions/blobs/{digest[:2]}/{digest}'
+
+
+# Blobs are named by the sha256 of their content and start with a header line:
+#   b"z\n" + zlib(content)
+#   b"d <base digest> <chain length>\n" + zlib(content, zdict=base content)
+# Blobs only needed by old versions are moved into zip packs by archive_versions;
+# manifest entries name their pack in "archived". Blobs are looked up loose first.
+
+def _read_packed(applet_uuid, digest, packs):
+    for pack_name in packs:
+        pack = read_artifact(applet_uuid, pack_name)
+        if pack is None:
+            continue
+        with zipfile.ZipFile(io.BytesIO(pack.data)) as pack_file:
+            try:
+                return pack_file.read(digest)
+            except KeyError:
+                continue
+    return None
+
+
+def _read_blob_with_depth(applet_uuid, digest, packs=()):
+    found = storage_backend().read(applet_uuid, _blob_name(digest))
+    blob = found[0] if found is not None else _read_packed(applet_uuid, digest, packs)
+    if blob is None:
+        raise VersionError(f"Blob {digest} not found")
+
+    header, _, body = blob.partition(b'\n')
+    fields = header.decode('ascii').split()
+    if fields[0] == 'z':
+        content, depth = zlib.decompress(body), 0
+    elif fields[0] == 'd':
+        base, depth = _read_blob(applet_uuid, fields[1], packs), int(fields[2])
+        decompressor = zlib.decompressobj(zdict=base)
+        content = decompressor.decompress(body) + decompressor.flush()
+    else:
+        raise VersionError(f"Blob {digest} has an unknown format")
+
+    if hashlib.sha256(content).hexdigest() != digest:
+        raise VersionError(f"Blob {digest} is corrupt")
+    return content, depth
+
+
+def _read_blob(applet_uuid, digest, packs=()):
+    return _read_blob_with_depth(applet_uuid, digest, packs)[0]
+
+
+def _write_blob(applet_uuid, content, base_digest=None):
+    """Store content once under its digest, as a delta against base_digest if that is smaller."""
+    digest = hashlib.sha256(content).hexdigest()
+    if storage_backend().stat(applet_uuid, _blob_name(digest)) is not None:
+        return digest
+
+    blob = b'z\n' + zlib.compress(content, 9)
+    if _delta_compression and base_digest and base_digest != digest:
+        try:
+            base, base_depth = _read_blob_with_depth(applet_uuid, base_digest)
+        except VersionError as e:
+            logger.warning(f"Storing blob {digest} without delta: {e}")
+        else:
+            if base_depth < MAX_DELTA_CHAIN:
+                compressor = zlib.compressobj(9, zdict=base)
+                delta = (f'd {base_digest} {base_depth + 1}\n'.encode('ascii')
+                         + compressor.compress(content) + compressor.flush())
+                if len(delta) < len(blob):
+                    blob = delta
+
+    storage_backend().write(applet_uuid, _blob_name(digest), blob)
+    return digest
+
+
+def _parse_manifest(raw):
+    entries = []
+    for line in raw.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Only an append cut short by a crash can leave a partial line
+            logger.warning(f"Skipping unreadable manifest line: {line[:80]!r}")
+    return raw, entries
+
+
+def list_versions(applet_uuid, revalidate=False):
+    """Return the manifest entries of an applet, oldest first; version n is at index n - 1."""
+    manifest = read_artifact(applet_uuid, MANIFEST_FILE, parse=_parse_manifest, revalidate=revalidate)
+    return manifest.value if manifest else []
+
+
+def get_version(applet_uuid, version):
+    versions = list_versions(applet_uuid)
+    if not 1 <= version <= len(versions) or versions[version - 1].get('pruned'):
+        return None
+    return versions[version - 1]
+
+
+def _packs(versions):
+    """Names of the version packs of an applet, newest first."""
+    return list(dict.fromkeys(entry['archived'] for entry in reversed(versions) if entry.get('archived')))
+
+
+def read_version(applet_uuid, version):
+    """Return the HTML, storage and prompt text of a version, or None if it does not exist (or was pruned)."""
+    versions = list_versions(applet_uuid)
+    if not 1 <= version <= len(versions) or versions[version - 1].get('pruned'):
+        return None
+    entry, packs = versions[version - 1], _packs(versions)
+    return {
+        "html": _read_blob(applet_uuid, entry['html'], packs).decode('utf-8'),
+        "storage": _read_blob(applet_uuid, entry['storage'], packs).decode('utf-8'),
+        "prompt": _read_blob(applet_uuid, entry['prompt'], packs).decode('utf-8') if entry.get('prompt') else None,
+    }
+
+
+def record_version(applet_uuid, source, prompt=None, restored_from=None):
+    """Append the applet's current HTML and storage (and the prompt that led to them) as a new version."""
+    with applet_lock(applet_uuid):
+        html = read_applet_html(applet_uuid)
+        if html is None:
+            raise VersionError("Current index.html not found")
+        storage = read_applet_storage(applet_uuid)
+        storage_data = storage.data if storage else EMPTY_STORAGE_CONTENT.encode('utf-8')
+
+        versions = list_versions(applet_uuid, revalidate=True)  # Other processes may have appended
+        previous = versions[-1] if versions else {}
+        entry = {
+            "version": len(versions) + 1,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "source": source,
+            "html": _write_blob(applet_uuid, html.data, previous.get('html')),
+            "storage": _write_blob(applet_uuid, storage_data, previous.get('storage')),
+            "prompt": _write_blob(applet_uuid, prompt.encode('utf-8')) if prompt else None,
+        }
+        if restored_from is not None:
+            entry["restored_from"] = restored_from
+
+        storage_backend().append(applet_uuid, MANIFEST_FILE, (json.dumps(entry) + '\n').encode('utf-8'))
+        artifact_cache.invalidate((applet_uuid, MANIFEST_FILE))
+    applet_index.record_version(applet_uuid, entry['version'])
+    return entry
+
+
+def rollback_version(applet_uuid, version):
+    """Make an earlier version current again, recorded as a new version."""
+    with applet_lock(applet_uuid):
+        contents = read_version(applet_uuid, version)
+        if contents is None:
+            raise VersionError(f"Version {version} not found")
+        save_html_files(contents['html'], applet_uuid)
+        save_local_storage(contents['storage'], applet_uuid)
+        return record_version(applet_uuid, 'rollback', prompt=contents['prompt'], restored_from=version)
+
+
+def _loose_chain(applet_uuid, digest):
+    """Return {digest: blob} for a loose blob and the loose blobs of its delta chain."""
+    chain = {}
+    while digest and digest not in chain:
+        found = storage_backend().read(applet_uuid, _blob_name(digest))
+        if found is None:
+            break
+        chain[digest] = found[0]
+        fields = found[0].partition(b'\n')[0].decode('ascii').split()
+        digest = fields[1] if fields[0] == 'd' else None
+    return chain
+
+
+def _entry_blobs(entry):
+    return [entry[kind] for kind in ('html', 'storage', 'prompt') if entry.get(kind)]
+
+
+def _rewrite_manifest(applet_uuid, versions):
+    storage_backend().write(
+        applet_uuid, MANIFEST_FILE, ''.join(json.dumps(entry) + '\n' for entry in versions).encode('utf-8')
+    )
+    artifact_cache.invalidate((applet_uuid, MANIFEST_FILE))
+
+
+def archive_versions(applet_uuid, keep):
+    """Move the blobs only needed by versions older than the newest keep into one zip pack.
+
+    The versions stay readable; their blobs are found in the pack, and each
+    pack replaces many small files with one. Returns (versions archived,
+    bytes packed).
+    """
+    keep = max(keep, 1)  # The newest version is the delta base of the next one
+    with applet_lock(applet_uuid):
+        versions = list_versions(applet_uuid, revalidate=True)
+        old = [entry for entry in versions[:-keep] if 'archived' not in entry and not entry.get('pruned')]
+        if not old:
+            return 0, 0
+
+        kept = set()
+        for entry in versions[-keep:]:
+            for digest in _entry_blobs(entry):
+                kept.update(_loose_chain(applet_uuid, digest))
+        packed = {}
+        for entry in old:
+            for digest in _entry_blobs(entry):
+                packed.update(
+                    (name, blob) for name, blob in _loose_chain(applet_uuid, digest).items() if name not in kept
+                )
+
+        pack_name = None
+        if packed:
+            pack_name = f"{PACKS_DIR}/{old[-1]['version']:08d}.zip"
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as pack_file:  # Blobs are compressed already
+                for digest, blob in sorted(packed.items()):
+                    pack_file.writestr(digest, blob)
+            storage_backend().write(applet_uuid, pack_name, buffer.getvalue())
+
+        old_versions = {entry['version'] for entry in old}
+        _rewrite_manifest(applet_uuid, [
+            dict(entry, archived=pack_name) if entry['version'] in old_versions else entry for entry in versions
+        ])
+        for digest in packed:
+            storage_backend().delete(applet_uuid, _blob_name(digest))
+    return len(old), sum(len(blob) for blob in packed.values())
+
+
+def prune_oldest_pack(applet_uuid):
+    """Delete the oldest version pack to free space; its versions, and older ones, stay listed as pruned.
+
+    Later packs never depend on earlier ones: blobs still needed by newer
+    versions are kept loose when a pack is made. Returns the bytes freed.
+    """
+    with applet_lock(applet_uuid):
+        versions = list_versions(applet_uuid, revalidate=True)
+        packs = _packs(versions)
+        if not packs:
+            return 0
+        oldest = packs[-1]
+        last = max(entry['version'] for entry in versions if entry.get('archived') == oldest)
+        stat = storage_backend().stat(applet_uuid, oldest)
+        _rewrite_manifest(applet_uuid, [
+            dict(entry, archived=None, pruned=True) if entry['version'] <= last else entry for entry in versions
+        ])
+        storage_backend().delete(applet_uuid, oldest)
+        artifact_cache.invalidate((applet_uuid, oldest))
+    return stat.st_size if stat else 0
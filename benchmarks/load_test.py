@@ -0,0 +1,440 @@
+"""Offline load test of the HTTP routes.
+
+Serves the app from a temporary directory with the fake AI backend (simulated
+transcription and streamed generation latency, no network) and drives it with
+concurrent clients sending a weighted mix of requests:
+
+    poll     HEAD /applet/<uuid>/document with If-None-Match, as open applets do
+    get      GET /applet/<uuid>/storage.js, as applet documents do on every load
+    patch    PATCH /applet/<uuid>/storage with a key-level change, as applets save
+    put      PUT /applet/<uuid>/storage (not in the default mix)
+    upload   POST /applet with a recording (a new applet)
+    change   POST /applet/<uuid> with a recording (a voice change)
+
+Like the page, a client whose last upload or change is still running polls
+GET /jobs/<id> (reported as 'job') instead of recording again, so each client
+has at most one job outstanding. Meanwhile --subscribers connections hold
+/applet/<uuid>/events open, as open applet pages do, and count the events
+they receive.
+
+Reports requests per second, latency percentiles per operation (503
+rejections are counted apart and left out of the percentiles), status codes,
+background job times, and the peak RSS and open file descriptors of the
+process. Results are JSON with stable keys; save one run with --output and
+compare a later run against it with --compare.
+
+    python -m benchmarks.load_test --clients 16 --seconds 20 --output baseline.json
+    python -m benchmarks.load_test --clients 16 --seconds 20 --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import http.client
+import uuid as uuid_module
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import WSGIRequestHandler, make_server  # noqa: E402
+
+from app.main import create_app  # noqa: E402
+from app.file_manager import create_applet, save_html_files, save_local_storage  # noqa: E402
+
+OPERATIONS = ('poll', 'get', 'patch', 'put', 'upload', 'change')
+AUDIO_OPERATIONS = ('upload', 'change')
+DEFAULT_MIX = 'poll=60,get=15,patch=15,upload=2,change=8'
+BOUNDARY = 'load-test-boundary'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+        mix[operation] = float(weight)
+    return mix
+
+
+def resource_usage():
+    """Return (RSS bytes, open file descriptors) of this process, or None where unavailable."""
+    rss = fds = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        pass
+    return rss, fds
+
+
+class ResourceMonitor(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(resource_usage())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append(resource_usage())
+
+    def report(self):
+        rss = [sample[0] for sample in self.samples if sample[0] is not None]
+        fds = [sample[1] for sample in self.samples if sample[1] is not None]
+        return {
+            "rss_peak_bytes": max(rss) if rss else None,
+            "rss_end_bytes": rss[-1] if rss else None,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # Linux reports KiB
+            "fds_peak": max(fds) if fds else None,
+            "fds_end": fds[-1] if fds else None,
+        }
+
+
+def multipart_audio(audio):
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="audio"; filename="recording.webm"\r\n'
+        "Content-Type: audio/webm\r\n\r\n"
+    ).encode('utf-8') + audio + f"\r\n--{BOUNDARY}--\r\n".encode('utf-8')
+    return body, {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass  # One line per request would cost more than some requests
+
+
+class Client(threading.Thread):
+    """Sends requests from the mix until the deadline and records (operation, status, seconds)."""
+
+    def __init__(self, port, applets, mix, deadline, audio_bytes, seed):
+        super().__init__(daemon=True)
+        self.port = port
+        self.applets = applets
+        self.operations, self.weights = zip(*mix.items())
+        self.deadline = deadline
+        self.audio_bytes = audio_bytes
+        self.random = random.Random(seed)
+        self.etags = {}
+        self.client_id = f"load-test-{seed}"
+        self.results = []
+        self.job_ids = []
+        self.job_id = None  # The last accepted job, until it finishes
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.getheader('ETag'), response.read()
+        finally:
+            connection.close()
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            operation = self.random.choices(self.operations, self.weights)[0]
+            if operation in AUDIO_OPERATIONS and self.job_id:
+                operation = 'job'  # Wait for the last job before recording again, as the page does
+            applet = self.random.choice(self.applets)
+            start = time.perf_counter()
+            try:
+                status = getattr(self, operation)(applet)
+            except OSError:
+                status = 'error'
+            self.results.append((operation, status, time.perf_counter() - start))
+
+    def poll(self, applet):
+        headers = {"If-None-Match": self.etags[applet]} if applet in self.etags else {}
+        status, etag, _ = self.request('HEAD', f'/applet/{applet}/document', headers=headers)
+        if etag:
+            self.etags[applet] = etag
+        return status
+
+    def get(self, applet):
+        return self.request('GET', f'/applet/{applet}/storage.js')[0]
+
+    def _items(self):
+        return json.dumps([f"item {i}" for i in range(self.random.randint(1, 50))])
+
+    def patch(self, applet):
+        # No base: the server merges the change into its current version, as after a 409
+        change = {"base": None, "set": {"items": self._items(), f"key {self.random.randint(1, 20)}": "value"}}
+        headers = {"Content-Type": "application/json", "X-Client-Id": self.client_id}
+        return self.request('PATCH', f'/applet/{applet}/storage', json.dumps(change).encode('utf-8'), headers)[0]
+
+    def put(self, applet):
+        body = json.dumps({"items": self._items()}).encode('utf-8')
+        return self.request('PUT', f'/applet/{applet}/storage', body, {"Content-Type": "application/json"})[0]
+
+    def job(self, applet):
+        status, _, data = self.request('GET', f'/jobs/{self.job_id}')
+        if status != 200 or json.loads(data)['status'] in ('succeeded', 'failed'):
+            self.job_id = None
+        return status
+
+    def _audio(self, path):
+        # Random bytes, so the transcription cache does not answer
+        body, headers = multipart_audio(self.random.randbytes(self.audio_bytes))
+        status, _, data = self.request('POST', path, body, headers)
+        if status == 202:
+            self.job_id = json.loads(data)['job_id']
+            self.job_ids.append(self.job_id)
+        return status
+
+    def upload(self, applet):
+        return self._audio('/applet')
+
+    def change(self, applet):
+        return self._audio(f'/applet/{applet}')
+
+
+class Subscriber(threading.Thread):
+    """Holds an applet's change feed open until stopped, reconnecting like EventSource, and counts its events."""
+
+    def __init__(self, port, applet, deadline):
+        super().__init__(daemon=True)
+        self.port = port
+        self.applet = applet
+        self.deadline = deadline
+        self.connect_seconds = []
+        self.events = {}
+        self._stopped = threading.Event()
+        self._socket = None
+
+    def run(self):
+        while not self._stopped.is_set() and time.monotonic() < self.deadline:
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            start = time.perf_counter()
+            try:
+                connection.request('GET', f'/applet/{self.applet}/events', headers={"Accept": "text/event-stream"})
+                # The response takes the socket over from the connection, so keep it for stop()
+                self._socket = connection.sock
+                if self._stopped.is_set():
+                    break
+                response = connection.getresponse()
+                self.connect_seconds.append(time.perf_counter() - start)
+                for line in response:
+                    if line.startswith(b'event: '):
+                        kind = line[len(b'event: '):].strip().decode('utf-8')
+                        self.events[kind] = self.events.get(kind, 0) + 1
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)  # Unblocks the read
+            except OSError:
+                pass
+        self.join()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args, root):
+    fake_options = {
+        "first_token_seconds": args.first_token_seconds,
+        "token_seconds": args.token_seconds,
+        "transcription_seconds": args.transcription_seconds,
+        "failure_rate": args.failure_rate,
+    }
+    app = create_app({
+        "UPLOAD_DIR": os.path.join(root, 'applets'),
+        "CACHE_DIR": os.path.join(root, 'cache'),
+        "STORAGE_BACKEND": args.backend,
+        "AI_BACKEND": 'fake',
+        "AI_FAKE_OPTIONS": fake_options,
+        "PROMPT_CACHE_ENABLED": False,  # Every job pays for its generation
+        "TRANSCRIPTION_CACHE_ENABLED": False,
+        "JOB_WORKERS": args.job_workers,
+    })
+    applets = [str(uuid_module.uuid4()) for _ in range(args.applets)]
+    html = "<html><body>" + "<p>applet</p>" * 500 + "</body></html>"
+    with app.app_context():
+        for applet in applets:
+            create_applet(applet)
+            save_html_files(html, applet)
+            save_local_storage(json.dumps({"items": "[]"}), applet)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monitor = ResourceMonitor(args.sample_interval)
+    monitor.start()
+
+    start = time.monotonic()
+    subscribers = [
+        Subscriber(server.server_port, applets[i % len(applets)], start + args.seconds)
+        for i in range(args.subscribers)
+    ]
+    for subscriber in subscribers:
+        subscriber.start()
+    clients = [
+        Client(server.server_port, applets, args.mix, start + args.seconds, args.audio_bytes, args.seed + i)
+        for i in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.monotonic() - start
+    for subscriber in subscribers:
+        subscriber.stop()
+
+    job_queue = app.extensions['job_queue']
+    job_queue.shutdown(wait=True)  # Let accepted jobs finish, so their times are complete
+    server.shutdown()
+    monitor.stop()
+
+    results = [result for client in clients for result in client.results]
+    report = {
+        "requests": len(results),
+        "requests_per_second": len(results) / elapsed,
+        "operations": {},
+    }
+    for operation in OPERATIONS + ('job',):
+        requests = [(status, seconds) for name, status, seconds in results if name == operation]
+        if not requests:
+            continue
+        statuses = {}
+        for status, _ in requests:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        # Rejections return at once; mixed in, they would make an overloaded server look fast
+        latencies = [seconds for status, seconds in requests if status != 503]
+        report["operations"][operation] = {
+            "requests": len(requests),
+            "requests_per_second": len(requests) / elapsed,
+            "rejected": statuses.get('503', 0),
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p90_ms": percentile(latencies, 0.90) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "statuses": statuses,
+        }
+
+    jobs = [job_queue.get(job_id) for client in clients for job_id in client.job_ids]
+    jobs = [job for job in jobs if job is not None and job.finished]
+    job_seconds = [job.finished_at - job.created_at for job in jobs]
+    report["jobs"] = {
+        "finished": len(jobs),
+        "failed": sum(1 for job in jobs if job.status == 'failed'),
+        "p50_ms": percentile(job_seconds, 0.50) * 1000,
+        "p99_ms": percentile(job_seconds, 0.99) * 1000,
+    }
+    # Median time of each job stage; prefetch runs beside transcription, so prefetch_wait stays near zero
+    stages = {}
+    for job in jobs:
+        for stage, ms in ((job.result or {}).get('timings') or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    report["jobs"]["stages_p50"] = {stage: percentile(values, 0.50) for stage, values in sorted(stages.items())}
+    received = {}
+    for subscriber in subscribers:
+        for kind, count in subscriber.events.items():
+            received[kind] = received.get(kind, 0) + count
+    connect_seconds = [seconds for subscriber in subscribers for seconds in subscriber.connect_seconds]
+    report["events"] = {
+        "subscribers": len(subscribers),
+        "connections": len(connect_seconds),
+        "connect_p50_ms": percentile(connect_seconds, 0.50) * 1000,
+        "received": received,
+    }
+    report["resources"] = monitor.report()
+    return report
+
+
+def compare(report, baseline, prefix=''):
+    """Return {metric: (baseline, current, change %)} for the numeric metrics of both reports."""
+    changes = {}
+    for key, value in report.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            changes.update(compare(value, old or {}, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            changes[f"{prefix}{key}"] = (old, value, (value - old) / old * 100)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--applets', type=int, default=50)
+    parser.add_argument('--subscribers', type=int, default=16, help="open change feed connections")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--backend', choices=('filesystem', 'sqlite', 'memory'), default='filesystem')
+    parser.add_argument('--job-workers', type=int, default=4)
+    parser.add_argument('--audio-bytes', type=int, default=64 * 1024)
+    parser.add_argument('--first-token-seconds', type=float, default=0.4)
+    parser.add_argument('--token-seconds', type=float, default=0.01)
+    parser.add_argument('--transcription-seconds', type=float, default=0.8)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of AI calls failing with a 503")
+    parser.add_argument('--sample-interval', type=float, default=0.25, help="seconds between RSS/fd samples")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the report to this file")
+    parser.add_argument('--compare', help="report changes against a report written with --output")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)  # Rejections under overload show up as 503s in the report
+
+    root = tempfile.mkdtemp(prefix='load-test-')
+    try:
+        report = run(args, root)
+    finally:
+        shutil.rmtree(root)
+
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(report, json.load(f))
+        report["comparison"] = {
+            metric: {"baseline": old, "current": new, "change_percent": change}
+            for metric, (old, new, change) in sorted(changes.items())
+        }
+    report["environment"] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "revision": git_revision(),
+        "arguments": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Worker start-up time.
+
+Starts fresh interpreters that import app.main, build the app with
+create_app() and, with --ai-client, build the AI client as the first AI call
+would. Reports the median wall time of each step and, from
+`python -X importtime`, the modules with the largest cumulative import time.
+
+    python -m benchmarks.startup --runs 5 --top 15
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEPS = """
+import json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+app.main.create_app()
+created = time.perf_counter()
+if {ai_client}:
+    from app.ai_client import ai_clients
+    ai_clients.client()
+finished = time.perf_counter()
+print(json.dumps({{"import": imported - start, "create_app": created - imported, "ai_client": finished - created}}))
+"""
+
+
+def parse_importtime(stderr):
+    """Return {module: cumulative microseconds} from `python -X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = max(modules.get(name.strip(), 0), int(cumulative))
+    return modules
+
+
+def run_once(ai_client, upload_dir):
+    env = dict(os.environ, UPLOAD_DIR=upload_dir, CACHE_DIR=os.path.join(upload_dir, 'cache'))
+    env.setdefault('GROQ_API_KEY', 'benchmark')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STEPS.format(ai_client=ai_client)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--ai-client', action='store_true', help="also build the AI client (imports the SDK)")
+    args = parser.parse_args()
+
+    timings, imports = [], []
+    with tempfile.TemporaryDirectory(prefix='startup-bench-') as upload_dir:
+        for _ in range(args.runs):
+            timing, modules = run_once(args.ai_client, upload_dir)
+            timings.append(timing)
+            imports.append(modules)
+
+    report = {step: statistics.median(timing[step] for timing in timings) * 1000 for step in timings[0]}
+    report = {f"{step}_ms": value for step, value in report.items()}
+    report["total_ms"] = sum(report.values())
+    medians = {
+        module: statistics.median(modules.get(module, 0) for modules in imports) / 1000
+        for module in imports[0]
+    }
+    report["slowest_imports_ms"] = dict(sorted(medians.items(), key=lambda item: -item[1])[:args.top])
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
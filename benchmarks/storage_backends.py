@@ -0,0 +1,93 @@
+"""Storage backend comparison.
+
+Runs the same applet workload against each backend in a temporary directory
+and reports throughput and latency percentiles per operation: HTML and
+storage writes, uncached reads, prompt listings and manifest appends.
+
+    python -m benchmarks.storage_backends --applets 20 --rounds 50
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.storage_backends import create_backend  # noqa: E402
+
+BACKENDS = ('filesystem', 'sqlite', 'memory')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(latencies, operation, *args):
+    start = time.perf_counter()
+    result = operation(*args)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+def run(backend, applets, rounds, html_bytes, storage_bytes):
+    latencies = {"write_html": [], "write_storage": [], "read": [], "list": [], "append": []}
+    html = b'<html>' + b'x' * html_bytes + b'</html>'
+    ids = [str(uuid.uuid4()) for _ in range(applets)]
+    for applet in ids:
+        backend.create(applet)
+        for i in range(3):
+            backend.write(applet, f'2024010{i}_prompt.prompt', b'Make a todo list')
+
+    start = time.perf_counter()
+    for n in range(rounds):
+        for applet in ids:
+            storage = json.dumps({"round": str(n), "blob": "y" * storage_bytes}).encode('utf-8')
+            timed(latencies["write_html"], backend.write, applet, 'index.html', html)
+            timed(latencies["write_storage"], backend.write, applet, 'storage.json', storage)
+            timed(latencies["read"], backend.read, applet, 'index.html')
+            timed(latencies["read"], backend.read, applet, 'storage.json')
+            timed(latencies["list"], backend.list, applet)
+            timed(latencies["append"], backend.append, applet, 'versions/manifest.jsonl', b'{"version": 1}\n')
+    elapsed = time.perf_counter() - start
+
+    report = {"seconds": elapsed}
+    for operation, values in latencies.items():
+        report[operation] = {
+            "ops": len(values),
+            "ops_per_second": len(values) / sum(values) if values else 0.0,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--applets', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--html-bytes', type=int, default=32 * 1024)
+    parser.add_argument('--storage-bytes', type=int, default=4 * 1024)
+    args = parser.parse_args()
+
+    report = {}
+    for kind in args.backends:
+        root = tempfile.mkdtemp(prefix='backend-bench-')
+        try:
+            backend = create_backend(kind, root=root, sqlite_path=os.path.join(root, 'applets.sqlite3'))
+            report[kind] = run(backend, args.applets, args.rounds, args.html_bytes, args.storage_bytes)
+        finally:
+            shutil.rmtree(root)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
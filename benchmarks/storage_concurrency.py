@@ -0,0 +1,120 @@
+"""Concurrent storage PUT/GET benchmark.
+
+Runs writer and reader processes against one applet directory and reports
+throughput, latency percentiles and the number of torn reads (a reader seeing
+a file that is not valid JSON). With atomic writes the torn count must be 0.
+
+    python -m benchmarks.storage_concurrency --writers 4 --readers 4 --seconds 5
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import uuid
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.file_manager import (  # noqa: E402
+    configure_artifact_cache,
+    configure_storage,
+    read_applet_storage,
+    save_local_storage,
+)
+from app.storage_backends import FilesystemBackend  # noqa: E402
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def writer(root, applet_uuid, seconds, payload_bytes, results):
+    configure_storage(FilesystemBackend(root))
+    latencies = []
+    deadline = time.monotonic() + seconds
+    counter = 0
+    while time.monotonic() < deadline:
+        counter += 1
+        content = json.dumps({"counter": str(counter), "blob": "x" * payload_bytes})
+        start = time.perf_counter()
+        save_local_storage(content, applet_uuid)
+        latencies.append(time.perf_counter() - start)
+    results.put(("write", latencies, 0))
+
+
+def reader(root, applet_uuid, seconds, results):
+    # Every read goes to disk so a torn write would be visible
+    configure_storage(FilesystemBackend(root))
+    configure_artifact_cache(0, revalidate=True)
+    latencies = []
+    torn = 0
+    storage_file_path = os.path.join(root, applet_uuid, 'storage.json')
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        with open(storage_file_path, 'rb') as f:
+            raw = f.read()
+        try:
+            json.loads(raw)
+        except ValueError:
+            torn += 1
+        read_applet_storage(applet_uuid)
+        latencies.append(time.perf_counter() - start)
+    results.put(("read", latencies, torn))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--payload-bytes', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='applet-bench-')
+    applet_uuid = str(uuid.uuid4())
+    configure_storage(FilesystemBackend(root))
+    os.makedirs(os.path.join(root, applet_uuid))
+    save_local_storage('{}', applet_uuid)
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=writer, args=(root, applet_uuid, args.seconds, args.payload_bytes, results))
+        for _ in range(args.writers)
+    ] + [
+        multiprocessing.Process(target=reader, args=(root, applet_uuid, args.seconds, results))
+        for _ in range(args.readers)
+    ]
+    for process in processes:
+        process.start()
+
+    collected = {"write": [], "read": []}
+    torn = 0
+    for _ in processes:
+        kind, latencies, process_torn = results.get()
+        collected[kind].extend(latencies)
+        torn += process_torn
+    for process in processes:
+        process.join()
+    shutil.rmtree(root)
+
+    report = {"torn_reads": torn}
+    for kind, latencies in collected.items():
+        report[kind] = {
+            "ops": len(latencies),
+            "ops_per_second": len(latencies) / args.seconds,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+    print(json.dumps(report, indent=2))
+    return 1 if torn else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
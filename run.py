@@ -1,4 +1,6 @@
-from app.main import app
+from app.main import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
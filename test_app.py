@@ -1,12 +1,66 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import asyncio
+import gzip
 import json
 import os
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
 from io import BytesIO
 import uuid
 
-from app.main import app
+from app.main import create_app, generate_storage_change, generate_streaming, get_transcription_cache
+from app.applet_index import applet_index
+from app.events import begin_partial, end_partial
+from app.cache import LRUCache, artifact_cache
+from app.compression import compress
+from app.disk_cache import DiskCache
+from app.prompt_templates import PromptTemplate, TemplateRegistry
+from app.instrumentation import Histogram, configure_payload_logging, log_payload
+from app.file_manager import (
+    applet_lock,
+    configure_storage,
+    create_applet,
+    patch_local_storage,
+    read_applet_storage,
+    save_html_files,
+    save_local_storage,
+    storage_backend,
+)
+from app.storage_backends import ColdTier, FilesystemBackend, MemoryBackend, SQLiteBackend
+from app.patching import PatchError, apply_change_patch, apply_json_patch
+from app.routing import (
+    DATA_CHANGE,
+    STRUCTURAL_CHANGE,
+    StorageChangeError,
+    classify_change,
+    validate_storage_change,
+)
+from app.versions import (
+    MAX_DELTA_CHAIN,
+    archive_versions,
+    list_versions,
+    prune_oldest_pack,
+    read_version,
+    record_version,
+)
+from app.ai_client import AIClientManager, AIDeadlineExceeded, FakeAPIError, ai_clients
+from app.ai_manager import (
+    SectionStreamParser,
+    agenerate_html_from_prompt,
+    atranscribe_audio,
+    generate_html_from_prompt,
+    transcribe_audio,
+)
+from app.audio import compact_audio
+from app.maintenance import RateLimiter, maintainer
+
+app = create_app()
+job_queue = app.extensions['job_queue']
+
 
 class AppletTestCase(unittest.TestCase):
     def setUp(self):
@@ -17,9 +71,30 @@ class AppletTestCase(unittest.TestCase):
         # Set up a temporary directory for UPLOAD_DIR
         self.test_dir = 'test_applets'
         app.config['UPLOAD_DIR'] = self.test_dir
+        app.config['CACHE_DIR'] = os.path.join(self.test_dir, 'cache')
         os.makedirs(self.test_dir, exist_ok=True)
+        applet_index.configure(os.path.join(self.test_dir, 'index.sqlite3'))
+        configure_storage(FilesystemBackend(self.test_dir))
 
 
+    def wait_for_job(self, response):
+        """
+        Wait for the job behind a 202 response to finish and return its status.
+        """
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        self.assertTrue(job_queue.get(job_id).wait(timeout=5))
+        return self.app.get(f'/jobs/{job_id}').get_json()
+
+    def get_metrics(self):
+        """
+        Return the /metrics text, fetched with the admin token.
+        """
+        with patch.dict(app.config, {'ADMIN_TOKEN': 'secret'}):
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
     def tearDown(self):
         # Remove the test directory and prompts after tests
         shutil.rmtree(self.test_dir)
@@ -32,6 +107,14 @@ class AppletTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'<!DOCTYPE html>', response.data)  # Check for HTML content
 
+    def test_create_app_only_once(self):
+        """
+        Test that a second app cannot reconfigure the process-wide storage and clients of the first.
+        """
+        with self.assertRaises(RuntimeError):
+            create_app({'UPLOAD_DIR': os.path.join(self.test_dir, 'other')})
+        self.assertEqual(os.path.abspath(storage_backend().root), os.path.abspath(self.test_dir))
+
     def test_show_applet_not_found(self):
         """
         Test that requesting a non-existent applet returns a 404 error.
@@ -62,12 +145,14 @@ class AppletTestCase(unittest.TestCase):
         # Send POST request to /applet to upload audio
         response = self.app.post('/applet', data=data, content_type='multipart/form-data')
 
-        # Assert that the response is successful and contains the expected data
-        self.assertEqual(response.status_code, 200)
-        response_data = response.get_json()
+        # Assert that the job was accepted and finished with the expected data
+        job = self.wait_for_job(response)
+        self.assertEqual(job['status'], 'succeeded')
+        response_data = job['result']
         self.assertIn('uuid', response_data)
         self.assertIn('message', response_data)
         self.assertEqual(response_data['message'], 'Audio file uploaded and processed successfully')
+        self.assertEqual(response.get_json()['uuid'], response_data['uuid'])
 
         # Check that the applet directory was created in the filesystem
         applet_uuid = response_data['uuid']
@@ -93,9 +178,8 @@ class AppletTestCase(unittest.TestCase):
 
         # Create the applet
         response = self.app.post('/applet', data=data, content_type='multipart/form-data')
-        self.assertEqual(response.status_code, 200)
-        response_data = response.get_json()
-        applet_uuid = response_data['uuid']
+        self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+        applet_uuid = response.get_json()['uuid']
 
         # Now, upload new audio to change the applet
         change_audio_content = b'test change audio content'
@@ -104,8 +188,9 @@ class AppletTestCase(unittest.TestCase):
         }
 
         response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
-        self.assertEqual(response.status_code, 200)
-        response_data = response.get_json()
+        job = self.wait_for_job(response)
+        self.assertEqual(job['status'], 'succeeded')
+        response_data = job['result']
         self.assertIn('message', response_data)
         self.assertEqual(response_data['message'], 'Applet changed successfully')
         self.assertEqual(response_data['uuid'], applet_uuid)
@@ -133,6 +218,60 @@ class AppletTestCase(unittest.TestCase):
             saved_storage_data = json.load(f)
         self.assertEqual(saved_storage_data, storage_data)
 
+    def test_patch_applet_storage(self):
+        """
+        Test key-level storage updates and their merge and conflict rules.
+        """
+        applet_uuid = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.test_dir, applet_uuid), exist_ok=True)
+        url = f'/applet/{applet_uuid}/storage'
+
+        response = self.app.put(url, json={'a': '1', 'b': '2', 'c': '3'})
+        base = response.headers['ETag']
+
+        response = self.app.patch(url, json={'base': base, 'set': {'a': '10'}, 'delete': ['c']})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['merged'])
+        self.assertEqual(self.app.get(url).get_json(), {'a': '10', 'b': '2'})
+        self.assertEqual(response.headers['ETag'], self.app.get(url).headers['ETag'])
+
+        # Based on the old version but touching another key: merged, and the client is told
+        # so, since the new ETag covers a change it has not loaded
+        response = self.app.patch(url, json={'base': base, 'set': {'b': '20'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['merged'])
+        self.assertEqual(self.app.get(url).get_json(), {'a': '10', 'b': '20'})
+
+        # Based on the old version and touching a key changed since: conflict
+        response = self.app.patch(url, json={'base': base, 'set': {'a': '100'}})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers['ETag'], self.app.get(url).headers['ETag'])
+
+        # Without a base the change is applied unconditionally
+        response = self.app.patch(url, json={'set': {'y': '1'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['merged'])
+        response = self.app.patch(url, json={'clear': True, 'set': {'z': '1'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['merged'])  # Nothing but the change is left
+        self.assertEqual(self.app.get(url).get_json(), {'z': '1'})
+
+    def test_patch_applet_storage_invalid(self):
+        """
+        Test that malformed storage changes and unknown applets are rejected.
+        """
+        response = self.app.patch(f'/applet/{uuid.uuid4()}/storage', json={'set': {}})
+        self.assertEqual(response.status_code, 404)
+
+        applet_uuid = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.test_dir, applet_uuid), exist_ok=True)
+        for changes in ([], {'set': []}, {'delete': 'a'}, {'base': 1},
+                        {'set': {'a': 1}}, {'set': {'a': None}}, {'set': {'a': {'b': 'c'}}}):
+            response = self.app.patch(f'/applet/{applet_uuid}/storage', json=changes)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['error'], 'Invalid storage changes')
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), {})  # Nothing was written
+
     def test_get_applet_storage(self):
         """
         Test retrieving the applet storage data.
@@ -324,6 +463,60 @@ class AppletTestCase(unittest.TestCase):
         response_data = response.get_json()
         self.assertEqual(response_data['error'], 'Applet not found')
 
+    @patch('app.main.transcribe_audio')
+    def test_change_applet_without_html(self, mock_transcribe_audio):
+        """
+        Test that changing an applet that has no index.html yet fails up front, without transcribing.
+        """
+        applet_uuid = str(uuid.uuid4())
+        create_applet(applet_uuid)
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'Current index.html not found')
+        mock_transcribe_audio.assert_not_called()
+        self.assertEqual([name for name in storage_backend().list(applet_uuid) if name.endswith('.webm')], [])
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_change_applet_prefetches_during_transcription(self, mock_generate_html_from_prompt,
+                                                           mock_transcribe_audio):
+        """
+        Test that the applet's HTML and storage are read while the recording is transcribed,
+        and that the job reports the time of each stage.
+        """
+        applet_uuid = str(uuid.uuid4())
+        create_applet(applet_uuid)
+        save_html_files('<html><body>Current</body></html>', applet_uuid)
+        save_local_storage('{"items": "[]"}', applet_uuid)
+        storage_read = threading.Event()
+
+        def read_storage(*args):
+            storage = read_applet_storage(*args)
+            storage_read.set()
+            return storage
+
+        def transcribe(file_path):
+            # The storage is read beside the transcription, not after it
+            self.assertTrue(storage_read.wait(timeout=5))
+            return 'Add milk to the list.'
+
+        mock_transcribe_audio.side_effect = transcribe
+        mock_generate_html_from_prompt.return_value = ('<html><body>Changed</body></html>', '{"items": "[]"}')
+        with patch('app.main.read_applet_storage', side_effect=read_storage):
+            data = {'audio': (BytesIO(b'test change audio content'), 'test_audio.webm', 'audio/webm')}
+            response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+            job = self.wait_for_job(response)
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertIn('Current', mock_generate_html_from_prompt.call_args[0][0])
+        timings = job['result']['timings']
+        for stage in ('transcription', 'prefetch', 'prefetch_wait', 'generation', 'save', 'total'):
+            self.assertIn(f'{stage}_ms', timings)
+        metrics = self.get_metrics()
+        self.assertIn('applet_job_stage_seconds_count{kind="change",stage="prefetch"}', metrics)
+
     def test_update_storage_too_large(self):
         """
         Test updating the applet storage with data that exceeds the size limit.
@@ -341,5 +534,1429 @@ class AppletTestCase(unittest.TestCase):
         response_data = response.get_json()
         self.assertEqual(response_data['error'], 'Storage data too large')
 
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_upload_audio_job_failure(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that a failing generation is reported through the job status.
+        """
+        mock_transcribe_audio.return_value = 'This is a test transcription.'
+        mock_generate_html_from_prompt.side_effect = RuntimeError('upstream error')
+
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+
+        job = self.wait_for_job(response)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'Failed to process audio')
+
+    def test_upload_audio_queue_full(self):
+        """
+        Test that uploads are rejected with 503 while the job queue is full.
+        """
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        with patch.object(job_queue, 'max_queued', -job_queue.workers):
+            response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        applet_dirs = [name for name in os.listdir(self.test_dir) if os.path.isdir(os.path.join(self.test_dir, name))]
+        self.assertEqual(applet_dirs, [])
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_upload_audio_prompt_cache(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that a repeated request is answered from the prompt cache without calling the model.
+        """
+        mock_transcribe_audio.return_value = 'Make a todo list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>Todo</body></html>', '{}')
+
+        for _ in range(2):
+            data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+            response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+
+            response = self.app.get(f"/applet/{response.get_json()['uuid']}/html")
+            self.assertIn(b'Todo', response.data)
+
+        self.assertEqual(mock_generate_html_from_prompt.call_count, 1)
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_prompt_cache_normalizes_transcription(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that re-recorded requests differing only in case, spacing and trailing
+        punctuation share a prompt cache entry.
+        """
+        mock_generate_html_from_prompt.return_value = ('<html><body>Timer</body></html>', '{}')
+
+        for transcription in ('Make a timer.', 'make a timer', '  Make   a TIMER!'):
+            mock_transcribe_audio.return_value = transcription
+            data = {'audio': (BytesIO(transcription.encode()), 'test_audio.webm', 'audio/webm')}
+            response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+        self.assertEqual(mock_generate_html_from_prompt.call_count, 1)
+
+        mock_transcribe_audio.return_value = 'Make a stopwatch.'
+        data = {'audio': (BytesIO(b'stopwatch'), 'test_audio.webm', 'audio/webm')}
+        response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+        self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+        self.assertEqual(mock_generate_html_from_prompt.call_count, 2)
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_upload_audio_transcription_cache(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that re-submitted audio is transcribed from the cache and still gets its .prompt.
+        """
+        mock_transcribe_audio.return_value = 'Make a todo list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>Todo</body></html>', '{}')
+
+        with app.app_context():
+            cache = get_transcription_cache()
+        hits, misses = cache.hits, cache.misses
+        applets = []
+        for audio in (b'test audio content', b'test audio content', b'other audio content'):
+            data = {'audio': (BytesIO(audio), 'test_audio.webm', 'audio/webm')}
+            response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+            applets.append(response.get_json()['uuid'])
+
+        self.assertEqual(mock_transcribe_audio.call_count, 2)
+        prompts = [name for name in storage_backend().list(applets[1]) if name.endswith('.prompt')]
+        self.assertEqual(storage_backend().read(applets[1], prompts[0])[0], b'Make a todo list.')
+
+        with patch.dict(app.config, {'ADMIN_TOKEN': 'secret'}):
+            response = self.app.get('/caches', headers={'Authorization': 'Bearer secret'})
+        stats = response.get_json()['transcriptions']
+        self.assertEqual((stats['hits'] - hits, stats['misses'] - misses), (1, 2))
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_metrics(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that /metrics exposes the step timings, request timings and cache statistics
+        to the admin token only.
+        """
+        mock_transcribe_audio.return_value = 'Make a todo list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>Todo</body></html>', '{}')
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+        self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+        with patch.dict(app.config, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(self.app.get('/metrics').status_code, 401)
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        metrics = response.get_data(as_text=True)
+        for span in ('upload_save', 'prompt_format', 'file_write'):
+            self.assertIn(f'applet_span_seconds_count{{span="{span}"}}', metrics)
+        self.assertIn('applet_http_request_seconds_bucket{endpoint="applets.upload_audio",method="POST",'
+                      'status="202",le="+Inf"}', metrics)
+        self.assertIn('applet_cache_hits_total{cache="artifacts"}', metrics)
+        self.assertIn('applet_jobs_outstanding 0', metrics)
+
+    def test_histogram_buckets(self):
+        """
+        Test that histogram buckets are cumulative and carry the sum and count.
+        """
+        histogram = Histogram('test_seconds', 'Test.', ('step',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, step='a')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{step="a",le="0.1"} 1',
+            'test_seconds_bucket{step="a",le="1.0"} 2',
+            'test_seconds_bucket{step="a",le="+Inf"} 3',
+            'test_seconds_sum{step="a"} 5.55',
+            'test_seconds_count{step="a"} 3',
+        ])
+
+    def test_payload_logging_is_sampled(self):
+        """
+        Test that payloads are only logged when payload logging is switched on.
+        """
+        logger = MagicMock()
+        try:
+            configure_payload_logging(0)
+            log_payload(logger, "Payload: %s", {'a': '1'})
+            logger.info.assert_not_called()
+            configure_payload_logging(1)
+            log_payload(logger, "Payload: %s", {'a': '1'})
+            logger.info.assert_called_once_with("Payload: %s", {'a': '1'})
+        finally:
+            configure_payload_logging(0)
+
+    def test_disk_cache_ttl_and_eviction(self):
+        """
+        Test that the disk cache expires entries after the TTL and evicts the least recently used
+        entries beyond its size cap.
+        """
+        root = os.path.join(self.test_dir, 'disk_cache')
+        cache = DiskCache(root, max_bytes=10 * 1024, ttl_seconds=60)
+        cache.set('a' * 64, ['x' * 4000])
+        cache.set('b' * 64, ['y' * 4000])
+        self.assertEqual(cache.get('a' * 64), ['x' * 4000])
+        cache.set('c' * 64, ['z' * 4000])
+
+        self.assertIsNone(cache.get('b' * 64))
+        self.assertEqual(cache.get('c' * 64), ['z' * 4000])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        # A new instance rebuilds its index from disk and honours the TTL
+        expired = DiskCache(root, max_bytes=10 * 1024, ttl_seconds=-1)
+        self.assertIsNone(expired.get('a' * 64))
+        self.assertEqual(expired.stats()['misses'], 1)
+
+    def test_prompt_template_render(self):
+        """
+        Test that templates substitute placeholders in one pass and leave other braces alone.
+        """
+        template = PromptTemplate('test', 'A {description} B {current_html} {"entry": 1} {unknown}')
+        self.assertEqual(template.placeholders, {'description', 'current_html', 'unknown'})
+        rendered = template.render(description='uses {current_html}', current_html='<html>')
+        self.assertEqual(rendered, 'A uses {current_html} B <html> {"entry": 1} {unknown}')
+
+    def test_template_registry_reloads_on_change(self):
+        """
+        Test that registered templates are cached and reloaded when their file changes.
+        """
+        path = os.path.join(self.test_dir, 'extra.prompt')
+        with open(path, 'w') as f:
+            f.write('Hello {description}')
+
+        registry = TemplateRegistry([self.test_dir], check_interval=0)
+        self.assertIn('extra', registry.names())
+        template = registry.get('extra')
+        self.assertIs(registry.get('extra'), template)
+
+        with open(path, 'w') as f:
+            f.write('Bye {description}')
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+        self.assertEqual(registry.render('extra', description='you'), 'Bye you')
+
+    def test_apply_change_patch(self):
+        """
+        Test applying SEARCH/REPLACE blocks to the HTML and a JSON patch to the storage.
+        """
+        current_html = '<html>\n  <h1>Todo</h1>  \n  <ul></ul>\n</html>'
+        html_patch = '<<<<<<< SEARCH\n  <h1>Todo</h1>\n=======\n  <h1>Groceries</h1>\n>>>>>>> REPLACE'
+        storage_patch = '[{"op": "add", "path": "/items", "value": "[\\"milk\\"]"}, {"op": "remove", "path": "/old"}]'
+
+        html_content, local_storage_content = apply_change_patch(
+            current_html, {'old': '1'}, html_patch, storage_patch
+        )
+        self.assertEqual(html_content, '<html>\n  <h1>Groceries</h1>\n  <ul></ul>\n</html>')
+        self.assertEqual(json.loads(local_storage_content), {'items': '["milk"]'})
+
+        # Nothing to change yields empty sections, like a storage-only full generation
+        self.assertEqual(apply_change_patch(current_html, {}, '', ''), ('', ''))
+
+    def test_apply_change_patch_errors(self):
+        """
+        Test that patches which do not apply cleanly are rejected.
+        """
+        html = '<html><p>a</p><p>a</p></html>'
+        with self.assertRaises(PatchError):
+            apply_change_patch(html, {}, '<<<<<<< SEARCH\n<p>a</p>\n=======\nb\n>>>>>>> REPLACE', '')
+        with self.assertRaises(PatchError):
+            apply_change_patch(html, {}, 'not a patch', '')
+        with self.assertRaises(PatchError):
+            apply_change_patch(html, {}, '', '{"op": "add"}')
+        with self.assertRaises(PatchError):
+            apply_json_patch({'a': [1]}, [{'op': 'replace', 'path': '/a/3', 'value': 2}])
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    @patch('app.main.generate_patch_from_prompt')
+    def test_change_applet_patch_mode(self, mock_generate_patch_from_prompt, mock_generate_html_from_prompt,
+                                      mock_transcribe_audio):
+        """
+        Test that patch mode applies the model's edits and falls back to a full regeneration
+        when the patch does not apply.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write('<html>\n<h1>Todo</h1>\n</html>')
+
+        mock_transcribe_audio.return_value = 'Rename it to groceries.'
+        mock_generate_patch_from_prompt.return_value = (
+            '<<<<<<< SEARCH\n<h1>Todo</h1>\n=======\n<h1>Groceries</h1>\n>>>>>>> REPLACE', ''
+        )
+        mock_generate_html_from_prompt.return_value = ('<html><h1>Regenerated</h1></html>', '')
+
+        with patch.dict(app.config, {'CHANGE_MODE': 'patch'}):
+            data = {'audio': (BytesIO(b'change audio'), 'change.webm', 'audio/webm')}
+            response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+            self.assertIn(b'<h1>Groceries</h1>', self.app.get(f'/applet/{applet_uuid}/html').data)
+            mock_generate_html_from_prompt.assert_not_called()
+
+            mock_transcribe_audio.return_value = 'Rename it again.'
+            mock_generate_patch_from_prompt.return_value = ('<<<<<<< SEARCH\n<h2>Missing</h2>\n=======\nx\n>>>>>>> REPLACE', '')
+            data = {'audio': (BytesIO(b'change audio'), 'change.webm', 'audio/webm')}
+            response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+            self.assertIn(b'Regenerated', self.app.get(f'/applet/{applet_uuid}/html').data)
+
+    def test_classify_change(self):
+        """
+        Test that edits of stored entries are routed to the fast path and everything else is not.
+        """
+        storage = {'items': '["eggs"]'}
+        self.assertEqual(classify_change('Add milk to the list.', storage), DATA_CHANGE)
+        self.assertEqual(classify_change('Remove the eggs', storage), DATA_CHANGE)
+        self.assertEqual(classify_change('Add a button to clear the list.', storage), STRUCTURAL_CHANGE)
+        self.assertEqual(classify_change('Make the background blue.', storage), STRUCTURAL_CHANGE)
+        self.assertEqual(classify_change('Add milk to the list.', {}), STRUCTURAL_CHANGE)
+
+    def test_validate_storage_change(self):
+        """
+        Test that fast-path output must keep the keys and the kind of JSON each value holds.
+        """
+        current = {'items': '["eggs"]', 'owner': 'Ann'}
+        self.assertEqual(json.loads(validate_storage_change('{"items": "[\\"eggs\\", \\"milk\\"]", "owner": "Ann"}',
+                                                            current)),
+                         {'items': '["eggs", "milk"]', 'owner': 'Ann'})
+        for content in ('not json', '[]', '{"items": "[]"}', '{"items": ["eggs"], "owner": "Ann"}',
+                        '{"items": "{}", "owner": "Ann"}', '{"items": "eggs", "owner": "Ann"}'):
+            with self.assertRaises(StorageChangeError):
+                validate_storage_change(content, current)
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    @patch('app.main.generate_storage_from_prompt')
+    def test_change_applet_fast_routing(self, mock_generate_storage_from_prompt, mock_generate_html_from_prompt,
+                                        mock_transcribe_audio):
+        """
+        Test that data-only changes use the fast model and keep the HTML, and fall back when its output is invalid.
+        """
+        mock_transcribe_audio.return_value = 'Make a shopping list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>List</body></html>', '{"items": "[]"}')
+        response = self.app.post('/applet', data={'audio': (BytesIO(b'create'), 'a.webm', 'audio/webm')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+        applet_uuid = response.get_json()['uuid']
+
+        mock_transcribe_audio.return_value = 'Add milk to the list.'
+        mock_generate_storage_from_prompt.return_value = '{"items": "[\\"milk\\"]"}'
+        with patch.dict(app.config, {'FAST_CHANGE_ROUTING': True}):
+            data = {'audio': (BytesIO(b'milk'), 'b.webm', 'audio/webm')}
+            response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+            self.assertEqual(mock_generate_html_from_prompt.call_count, 1)
+            self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), {'items': '["milk"]'})
+            self.assertIn(b'List', self.app.get(f'/applet/{applet_uuid}/html').data)
+
+            mock_transcribe_audio.return_value = 'Add eggs to the list.'
+            mock_generate_storage_from_prompt.return_value = '{"groceries": "[]"}'
+            mock_generate_html_from_prompt.return_value = (
+                '<html><body>List</body></html>', '{"items": "[\\"eggs\\"]"}'
+            )
+            data = {'audio': (BytesIO(b'eggs'), 'c.webm', 'audio/webm')}
+            response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+            self.assertEqual(self.wait_for_job(response)['status'], 'succeeded')
+            self.assertEqual(mock_generate_html_from_prompt.call_count, 2)
+            self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), {'items': '["eggs"]'})
+
+    @patch('app.main.generate_storage_from_prompt')
+    def test_fast_change_caches_valid_output_only(self, mock_generate_storage_from_prompt):
+        """
+        Test that a fast-path answer failing validation is not cached, so a retry asks the model again.
+        """
+        current = {'items': '[]'}
+        mock_generate_storage_from_prompt.return_value = '{"groceries": "[]"}'
+        with app.app_context():
+            self.assertIsNone(generate_storage_change(str(uuid.uuid4()), 'Add tea to the list.', current))
+            mock_generate_storage_from_prompt.return_value = '{"items": "[\\"tea\\"]"}'
+            for _ in range(2):
+                storage = generate_storage_change(str(uuid.uuid4()), 'Add tea to the list.', current)
+                self.assertEqual(json.loads(storage), {'items': '["tea"]'})
+        self.assertEqual(mock_generate_storage_from_prompt.call_count, 2)  # The valid answer was cached
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_applet_versions(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that creating and changing an applet records versions that can be listed,
+        fetched and rolled back to.
+        """
+        mock_transcribe_audio.return_value = 'A todo list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>Version 1</body></html>', '{"todos": "[]"}')
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+        job = self.wait_for_job(response)
+        self.assertEqual(job['result']['version'], 1)
+        applet_uuid = job['result']['uuid']
+
+        mock_transcribe_audio.return_value = 'Make it blue.'
+        mock_generate_html_from_prompt.return_value = ('<html><body style="color: blue">Version 2</body></html>', '')
+        data = {'audio': (BytesIO(b'test change audio'), 'change.webm', 'audio/webm')}
+        response = self.app.post(f'/applet/{applet_uuid}', data=data, content_type='multipart/form-data')
+        self.assertEqual(self.wait_for_job(response)['result']['version'], 2)
+
+        versions = self.app.get(f'/applet/{applet_uuid}/versions').get_json()['versions']
+        self.assertEqual([version['source'] for version in versions], ['create', 'change'])
+        self.assertEqual(versions[0]['storage'], versions[1]['storage'])  # Unchanged storage is stored once
+
+        response = self.app.get(f'/applet/{applet_uuid}/versions/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            'version': 1,
+            'html': '<html><body>Version 1</body></html>',
+            'storage': {'todos': '[]'},
+            'prompt': 'A todo list.',
+        })
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/versions/3').status_code, 404)
+
+        response = self.app.post(f'/applet/{applet_uuid}/versions/1/rollback')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['version'], 3)
+        self.assertIn(b'Version 1', self.app.get(f'/applet/{applet_uuid}/html').data)
+        versions = self.app.get(f'/applet/{applet_uuid}/versions').get_json()['versions']
+        self.assertEqual(versions[2]['restored_from'], 1)
+        self.assertEqual(versions[2]['html'], versions[0]['html'])
+        self.assertFalse([file for file in os.listdir(os.path.join(self.test_dir, applet_uuid))
+                          if file.startswith('index-')])
+
+        self.assertEqual(self.app.post(f'/applet/{applet_uuid}/versions/9/rollback').status_code, 404)
+
+    @patch('app.main.transcribe_audio')
+    @patch('app.main.generate_html_from_prompt')
+    def test_applet_index(self, mock_generate_html_from_prompt, mock_transcribe_audio):
+        """
+        Test that the write paths keep the applet index current, that the applet page is
+        rendered from it and that listing applets requires the admin token.
+        """
+        mock_transcribe_audio.return_value = 'A shopping list.'
+        mock_generate_html_from_prompt.return_value = ('<html><body>List</body></html>', '{"items": "[]"}')
+        data = {'audio': (BytesIO(b'test audio content'), 'test_audio.webm', 'audio/webm')}
+        applet_uuid = self.wait_for_job(self.app.post('/applet', data=data, content_type='multipart/form-data'))['result']['uuid']
+
+        applet = applet_index.get(applet_uuid, with_prompts=True)
+        self.assertEqual(applet['prompts'], ['A shopping list.'])
+        self.assertEqual(applet['current_version'], 1)
+        self.assertEqual(applet['storage_size'], len('{"items": "[]"}'))
+
+        with patch('app.main.read_prompts') as mock_read_prompts:
+            response = self.app.get(f'/applet/{applet_uuid}')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'A shopping list.', response.data)
+            mock_read_prompts.assert_not_called()
+        self.assertIsNotNone(applet_index.get(applet_uuid)['last_access'])
+
+        self.assertEqual(self.app.get('/applets').status_code, 404)
+        with patch.dict(app.config, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(self.app.get('/applets', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            headers = {'Authorization': 'Bearer secret'}
+            response = self.app.get('/applets?q=shopping', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([applet['uuid'] for applet in response.get_json()['applets']], [applet_uuid])
+            self.assertEqual(self.app.get('/applets?q=nothing', headers=headers).get_json()['total'], 0)
+            self.assertEqual(self.app.get('/applets?order=uuid;', headers=headers).status_code, 400)
+            response = self.app.get(f'/applets/{applet_uuid}', headers=headers)
+            self.assertEqual(response.get_json()['prompts'], ['A shopping list.'])
+
+    def test_rebuild_applet_index(self):
+        """
+        Test that the rebuild command indexes existing applet directories and drops missing ones.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write('<html></html>')
+        for name, text in (('20240101_000000_000000_initial_prompt.prompt', 'First'),
+                           ('20240102_000000_000000_change_prompt.prompt', 'Second')):
+            with open(os.path.join(applet_dir, name), 'w') as f:
+                f.write(text)
+        applet_index.record_html(str(uuid.uuid4()), 10)  # An applet whose directory is gone
+
+        result = app.test_cli_runner().invoke(args=['rebuild-index'])
+        self.assertIn('Indexed 1 applets', result.output)
+        applets, total = applet_index.query()
+        self.assertEqual(total, 1)
+        self.assertEqual(applets[0]['html_size'], len('<html></html>'))
+        self.assertEqual(applet_index.get(applet_uuid, with_prompts=True)['prompts'], ['First', 'Second'])
+
+    def test_version_blobs_are_delta_compressed(self):
+        """
+        Test that consecutive versions are stored as deltas and read back intact.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        body = ''.join(f'<li>Item {i}: {uuid.uuid4()}</li>\n' for i in range(200))
+        for i in range(MAX_DELTA_CHAIN + 2):
+            save_html_files(f'<html><h1>Edit {i}</h1>\n{body}</html>', applet_uuid)
+            record_version(applet_uuid, 'change')
+
+        versions = list_versions(applet_uuid)
+        headers = []
+        for entry in versions:
+            with open(os.path.join(applet_dir, 'versions', 'blobs', entry['html'][:2], entry['html']), 'rb') as f:
+                blob = f.read()
+            headers.append(blob.split(b'\n', 1)[0])
+            self.assertLess(len(blob), len(body) // 2)
+        self.assertEqual(headers[0], b'z')
+        self.assertTrue(headers[1].startswith(b'd '))
+        self.assertEqual(headers[MAX_DELTA_CHAIN + 1], b'z')  # The chain length is capped
+        self.assertEqual(read_version(applet_uuid, MAX_DELTA_CHAIN)['html'],
+                         f'<html><h1>Edit {MAX_DELTA_CHAIN - 1}</h1>\n{body}</html>')
+
+    def transcribed_recording(self, applet_uuid, stem, age_days, transcribed=True):
+        """
+        Write a recording (and its transcription) last modified age_days ago.
+        """
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        mtime = time.time() - age_days * 24 * 3600
+        names = [f'{stem}.webm', f'{stem}.prompt'] if transcribed else [f'{stem}.webm']
+        for name in names:
+            with open(os.path.join(applet_dir, name), 'wb') as f:
+                f.write(b'a' * 1000 if name.endswith('.webm') else b'A prompt.')
+            os.utime(os.path.join(applet_dir, name), (mtime, mtime))
+
+    def test_maintenance_audio_retention(self):
+        """
+        Test that transcribed recordings are compressed, or dropped, once they are old enough,
+        and that recordings still waiting for their transcription are left alone.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        save_html_files('<html></html>', applet_uuid)
+        self.transcribed_recording(applet_uuid, 'old', 10)
+        self.transcribed_recording(applet_uuid, 'recent', 1)
+        self.transcribed_recording(applet_uuid, 'pending', 10, transcribed=False)
+
+        def transcode(command, **kwargs):
+            with open(command[-1], 'wb') as f:
+                f.write(b'o' * 100)
+
+        maintainer.configure(audio_action='compress', audio_after_days=7, ffmpeg='ffmpeg', keep_versions=0,
+                             cold_after_days=0, io_bytes_per_second=0)
+        with patch('app.audio.subprocess.run', side_effect=transcode):
+            report = maintainer.run_cycle()
+        self.assertEqual(report['audio_compressed'], 1)
+        self.assertEqual(report['bytes_freed'], 900)
+        files = os.listdir(applet_dir)
+        self.assertIn('old.ogg', files)
+        self.assertNotIn('old.webm', files)
+        self.assertIn('recent.webm', files)
+        self.assertIn('pending.webm', files)
+
+        maintainer.configure(audio_action='drop', audio_after_days=0, keep_versions=0, cold_after_days=0,
+                             io_bytes_per_second=0)
+        self.assertEqual(maintainer.run_cycle()['audio_dropped'], 1)
+        files = os.listdir(applet_dir)
+        self.assertNotIn('recent.webm', files)
+        self.assertIn('old.ogg', files)  # Already compact
+        self.assertIn('pending.webm', files)
+        self.assertIn('recent.prompt', files)
+
+    def test_archive_old_versions(self):
+        """
+        Test that old version blobs are packed, stay readable and can be rolled back to,
+        and that pruning the oldest pack removes only the versions it held.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        body = ''.join(f'<li>Item {i}</li>\n' for i in range(100))
+        count = MAX_DELTA_CHAIN + 3  # The last two start a new delta chain
+        for i in range(1, count + 1):
+            save_html_files(f'<html><h1>Version {i}</h1>{body}</html>', applet_uuid)
+            record_version(applet_uuid, 'change')
+
+        loose_before = sum(len(files) for _, _, files in os.walk(os.path.join(applet_dir, 'versions', 'blobs')))
+        archived, packed = archive_versions(applet_uuid, keep=2)
+        self.assertEqual(archived, count - 2)
+        self.assertGreater(packed, 0)
+        self.assertEqual(archive_versions(applet_uuid, keep=2), (0, 0))
+        loose_after = sum(len(files) for _, _, files in os.walk(os.path.join(applet_dir, 'versions', 'blobs')))
+        self.assertLess(loose_after, loose_before)
+        self.assertEqual(len(os.listdir(os.path.join(applet_dir, 'versions', 'packs'))), 1)
+
+        artifact_cache.clear()
+        for i in range(1, count + 1):
+            self.assertEqual(read_version(applet_uuid, i)['html'], f'<html><h1>Version {i}</h1>{body}</html>')
+        response = self.app.post(f'/applet/{applet_uuid}/versions/1/rollback')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Version 1<', self.app.get(f'/applet/{applet_uuid}/html').data)
+
+        self.assertGreater(prune_oldest_pack(applet_uuid), 0)
+        self.assertEqual(prune_oldest_pack(applet_uuid), 0)
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/versions/1').status_code, 404)
+        self.assertEqual(self.app.post(f'/applet/{applet_uuid}/versions/2/rollback').status_code, 404)
+        versions = self.app.get(f'/applet/{applet_uuid}/versions').get_json()['versions']
+        self.assertEqual([bool(version.get('pruned')) for version in versions], [True] * (count - 2) + [False] * 3)
+        self.assertIn('Version 1<', read_version(applet_uuid, count + 1)['html'])
+        self.assertIn(f'Version {count - 1}<', read_version(applet_uuid, count - 1)['html'])
+
+    def test_maintenance_applet_quota(self):
+        """
+        Test that an applet over its quota loses its transcribed recordings, then its oldest versions,
+        but never its current HTML or storage.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        for i in range(1, 5):
+            save_html_files(f'<html><h1>Version {i}</h1>{uuid.uuid4()}</html>', applet_uuid)
+            save_local_storage(json.dumps({'count': str(i)}), applet_uuid)
+            record_version(applet_uuid, 'change')
+        self.transcribed_recording(applet_uuid, 'recording', 0)
+
+        maintainer.configure(audio_action='keep', keep_versions=1, applet_quota_bytes=1, cold_after_days=0,
+                             io_bytes_per_second=0)
+        report = maintainer.run_cycle()
+        self.assertEqual(report['versions_archived'], 3)
+        self.assertEqual(report['audio_dropped'], 1)
+        self.assertEqual(report['version_packs_pruned'], 1)
+        self.assertNotIn('recording.webm', os.listdir(applet_dir))
+        self.assertIsNone(read_version(applet_uuid, 3))
+        self.assertIn('Version 4', read_version(applet_uuid, 4)['html'])
+        self.assertIn(b'Version 4', self.app.get(f'/applet/{applet_uuid}/html').data)
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), {'count': '4'})
+
+    def test_cold_tier(self):
+        """
+        Test that idle applets move to the cold tier, come back transparently on their next
+        access and keep their index rows, and that the hot quota sends applets cold early.
+        """
+        backend = ColdTier(FilesystemBackend(self.test_dir), os.path.join(self.test_dir, '.cold'))
+        configure_storage(backend)
+        applet_uuid = str(uuid.uuid4())
+        create_applet(applet_uuid)
+        save_html_files('<html><body>Cold</body></html>', applet_uuid)
+        save_local_storage(json.dumps({'key': 'value'}), applet_uuid)
+        record_version(applet_uuid, 'create')
+
+        maintainer.configure(cold_after_days=30, io_bytes_per_second=0)
+        self.assertEqual(maintainer.run_cycle()['applets_frozen'], 0)
+        report = maintainer.run_cycle(now=time.time() + 31 * 24 * 3600)
+        self.assertEqual(report['applets_frozen'], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, applet_uuid)))
+        self.assertEqual(backend.cold_applets(), [applet_uuid])
+
+        result = app.test_cli_runner().invoke(args=['rebuild-index'])
+        self.assertIn('Indexed 0 applets', result.output)
+        self.assertIsNotNone(applet_index.get(applet_uuid))
+
+        artifact_cache.clear()
+        response = self.app.get(f'/applet/{applet_uuid}/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Cold', response.data)
+        self.assertEqual(backend.restored, 1)
+        self.assertEqual(backend.cold_applets(), [])
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), {'key': 'value'})
+        self.assertIn('Cold', read_version(applet_uuid, 1)['html'])
+
+        maintainer.configure(cold_after_days=0, hot_quota_bytes=1, io_bytes_per_second=0)
+        self.assertEqual(maintainer.run_cycle()['applets_frozen'], 1)
+        self.assertEqual(backend.cold_applets(), [applet_uuid])
+        self.assertIn('applet_cold_applets 1', self.get_metrics())
+
+    def test_cold_tier_spares_unindexed_and_busy_applets(self):
+        """
+        Test that an applet without an index row is judged by its newest file, and that
+        an applet with a queued or running job never goes cold.
+        """
+        backend = ColdTier(FilesystemBackend(self.test_dir), os.path.join(self.test_dir, '.cold'))
+        configure_storage(backend)
+        unindexed, busy = str(uuid.uuid4()), str(uuid.uuid4())
+        for applet_uuid in (unindexed, busy):
+            create_applet(applet_uuid)
+            backend.write(applet_uuid, 'index.html', b'<html></html>')
+
+        maintainer.configure(cold_after_days=30, hot_quota_bytes=1, io_bytes_per_second=0,
+                             busy_applets=lambda: {busy})
+        with patch('app.maintenance.applet_index.get', return_value=None):
+            self.assertEqual(maintainer.run_cycle()['applets_frozen'], 1)  # Over the hot quota
+            self.assertEqual(backend.cold_applets(), [unindexed])
+            backend.read(unindexed, 'index.html')
+
+            maintainer.configure(cold_after_days=30, io_bytes_per_second=0, busy_applets=lambda: {busy})
+            self.assertEqual(maintainer.run_cycle()['applets_frozen'], 0)
+            report = maintainer.run_cycle(now=time.time() + 31 * 24 * 3600)
+        self.assertEqual(report['applets_frozen'], 1)
+        self.assertEqual(backend.cold_applets(), [unindexed])
+
+    def test_rate_limiter(self):
+        """
+        Test that the maintenance rate limiter sleeps off the bytes beyond its rate and its one-second burst.
+        """
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(1000, sleep=sleep, clock=lambda: now[0])
+        now[0] = 10.0
+        limiter.consume(1000)  # The burst
+        self.assertEqual(sleeps, [])
+        limiter.consume(500)
+        self.assertEqual(sleeps, [0.5])
+        now[0] += 0.25
+        limiter.consume(500)
+        self.assertEqual(sleeps, [0.5, 0.25])
+        RateLimiter(0, sleep=sleep).consume(10 ** 9)
+        self.assertEqual(len(sleeps), 2)
+
+    def test_storage_writes_are_atomic(self):
+        """
+        Test that readers never see a partially written storage file while writers replace it.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        save_local_storage(json.dumps({'blob': ''}), applet_uuid)
+
+        def write(n):
+            for i in range(20):
+                save_local_storage(json.dumps({'blob': str(n) * (64 * 1024 + i)}), applet_uuid)
+
+        writers = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in writers:
+            thread.start()
+        storage_file_path = os.path.join(applet_dir, 'storage.json')
+        while any(thread.is_alive() for thread in writers):
+            with open(storage_file_path, 'rb') as f:
+                self.assertIn('blob', json.loads(f.read()))
+        for thread in writers:
+            thread.join()
+
+        self.assertEqual([f for f in os.listdir(applet_dir) if f.endswith('.tmp')], [])
+        with open(storage_file_path, 'rb') as f:
+            self.assertEqual(self.app.get(f'/applet/{applet_uuid}/storage').get_json(), json.loads(f.read()))
+
+    def test_applet_lock_is_reentrant(self):
+        """
+        Test that a thread holding an applet lock can call the save functions, which lock again.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with applet_lock(applet_uuid):
+            save_local_storage('{"key": "value"}', applet_uuid)
+        with open(os.path.join(applet_dir, 'storage.json')) as f:
+            self.assertEqual(json.load(f), {'key': 'value'})
+
+    def test_get_job_not_found(self):
+        """
+        Test requesting the status of an unknown job.
+        """
+        response = self.app.get('/jobs/unknown')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'Job not found')
+
+    def test_show_applet_html_conditional(self):
+        """
+        Test that the applet HTML carries a strong ETag and answers 304 for GET and HEAD
+        when the client's copy is current.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write('<html><body>Applet HTML</body></html>')
+
+        response = self.app.get(f'/applet/{applet_uuid}/html')
+        self.assertEqual(response.status_code, 200)
+        etag, weak = response.get_etag()
+        self.assertTrue(etag)
+        self.assertFalse(weak)
+
+        for method in (self.app.get, self.app.head):
+            response = method(f'/applet/{applet_uuid}/html', headers={'If-None-Match': f'"{etag}"'})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+        response = self.app.get(f'/applet/{applet_uuid}/html', headers={'If-None-Match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Applet HTML', response.data)
+
+    def test_get_applet_storage_conditional(self):
+        """
+        Test that storage writes change the ETag and that an unchanged storage answers 304.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+
+        empty_etag, _ = self.app.get(f'/applet/{applet_uuid}/storage').get_etag()
+
+        response = self.app.put(f'/applet/{applet_uuid}/storage', json={'key': 'value'})
+        put_etag, _ = response.get_etag()
+        self.assertNotEqual(put_etag, empty_etag)
+
+        response = self.app.get(f'/applet/{applet_uuid}/storage', headers={'If-None-Match': f'"{put_etag}"'})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.get(f'/applet/{applet_uuid}/storage', headers={'If-None-Match': f'"{empty_etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'key': 'value'})
+        self.assertEqual(response.get_etag()[0], put_etag)
+
+    def test_applet_document(self):
+        """
+        Test that the applet document carries the storage shim, is cacheable under its content hash
+        and only changes with the HTML, while storage.js follows the storage.
+        """
+        applet_uuid = str(uuid.uuid4())
+        create_applet(applet_uuid)
+        save_html_files('<html><head><title>Todo</title></head><body>Todo</body></html>', applet_uuid)
+
+        response = self.app.get(f'/applet/{applet_uuid}/document')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        document = response.get_data(as_text=True)
+        self.assertTrue(document.startswith(
+            f'<html><head><script src="/static/js/storage_changes.js"></script>'
+            f'<script src="/applet/{applet_uuid}/storage.js"></script>'
+            f'<script src="/static/js/applet_shim.js"></script><title>Todo</title>'
+        ))
+        version, _ = response.get_etag()
+
+        response = self.app.get(f'/applet/{applet_uuid}/document/{version}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response.get_data(as_text=True), document)
+
+        # Storage changes leave the document alone and show up in storage.js
+        self.app.put(f'/applet/{applet_uuid}/storage', json={'items': '["milk"]'})
+        self.assertEqual(self.app.get(f'/applet/{applet_uuid}/document').get_etag()[0], version)
+        response = self.app.get(f'/applet/{applet_uuid}/storage.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/javascript')
+        storage_etag, _ = self.app.get(f'/applet/{applet_uuid}/storage').get_etag()
+        self.assertEqual(response.get_etag()[0], storage_etag)
+        self.assertEqual(
+            response.get_data(as_text=True),
+            f'window.appletStorage = {{"etag": "\\"{storage_etag}\\"", "data": {{"items": "[\\"milk\\"]"}}}};\n'
+        )
+        response = self.app.get(f'/applet/{applet_uuid}/storage.js', headers={'If-None-Match': f'"{storage_etag}"'})
+        self.assertEqual(response.status_code, 304)
+
+        # A new HTML is a new version; the old URL redirects to it
+        save_html_files('<html><head></head><body>Shopping</body></html>', applet_uuid)
+        new_version, _ = self.app.get(f'/applet/{applet_uuid}/document').get_etag()
+        self.assertNotEqual(new_version, version)
+        response = self.app.get(f'/applet/{applet_uuid}/document/{version}')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith(f'/applet/{applet_uuid}/document/{new_version}'))
+
+    def test_applet_document_built_for_older_applets(self):
+        """
+        Test that applets whose HTML was saved without a document get one on first read.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write('<body>No head</body>')
+
+        response = self.app.get(f'/applet/{applet_uuid}/document')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_data(as_text=True).startswith('<script src="/static/js/storage_changes.js">'))
+        self.assertTrue(os.path.exists(os.path.join(applet_dir, 'document.html')))
+
+        response = self.app.get(f'/applet/{uuid.uuid4()}/document')
+        self.assertEqual(response.status_code, 404)
+        response = self.app.get(f'/applet/{uuid.uuid4()}/storage.js')
+        self.assertEqual(response.status_code, 404)
+
+    def test_show_applet_html_gzip(self):
+        """
+        Test that the applet HTML is sent gzip-compressed when the client accepts it,
+        with a weak ETag that still answers 304, and uncompressed otherwise.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        html = '<html><body>' + '<p>Applet HTML</p>' * 200 + '</body></html>'
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write(html)
+
+        response = self.app.get(f'/applet/{applet_uuid}/html', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data).decode('utf-8'), html)
+        etag, weak = response.get_etag()
+        self.assertTrue(weak)
+        # Compressed once and saved, so later cache fills read the sidecar
+        with open(os.path.join(applet_dir, 'index.html.gz'), 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()).decode('utf-8'), html)
+
+        response = self.app.get(f'/applet/{applet_uuid}/html',
+                                headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'W/"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.get(f'/applet/{applet_uuid}/html', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data.decode('utf-8'), html)
+        self.assertEqual(response.get_etag(), (etag, False))
+
+    def test_storage_gzip_written_with_storage(self):
+        """
+        Test that storage writes store the gzip form next to storage.json, that it is
+        served as is, and that small storage drops the stale compressed copy.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        storage = {f'key{i}': 'value' * 20 for i in range(20)}
+
+        response = self.app.put(f'/applet/{applet_uuid}/storage', json=storage)
+        put_etag, _ = response.get_etag()
+        gzip_path = os.path.join(applet_dir, 'storage.json.gz')
+        with open(gzip_path, 'rb') as f:
+            compressed = f.read()
+        self.assertEqual(json.loads(gzip.decompress(compressed)), storage)
+        self.assertEqual(compressed[8], 0)  # Extra flags: neither the slowest (2) nor the fastest (4) level
+        with open(os.path.join(applet_dir, 'storage.json'), 'rb') as f:
+            self.assertEqual(compress(f.read())['gzip'][8], 2)  # Files written rarely get the slowest
+
+        artifact_cache.clear()  # The sidecar is read back from disk
+        response = self.app.get(f'/applet/{applet_uuid}/storage', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data)), storage)
+
+        # A weak ETag from a compressed response is accepted as a patch base
+        response = self.app.patch(f'/applet/{applet_uuid}/storage',
+                                  json={'base': f'W/"{put_etag}"', 'set': {'key0': 'new'}})
+        self.assertEqual(response.status_code, 200)
+
+        self.app.delete(f'/applet/{applet_uuid}/storage')
+        self.assertFalse(os.path.exists(gzip_path))
+
+    def test_artifact_cache_serves_hot_applet(self):
+        """
+        Test that repeated reads of an applet hit the artifact cache and that writes
+        go through it.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        with open(os.path.join(applet_dir, 'index.html'), 'w') as f:
+            f.write('<html><body>Applet HTML</body></html>')
+
+        self.app.get(f'/applet/{applet_uuid}/html')
+        hits = artifact_cache.stats()['hits']
+        response = self.app.get(f'/applet/{applet_uuid}/html')
+        self.assertIn(b'Applet HTML', response.data)
+        self.assertEqual(artifact_cache.stats()['hits'], hits + 1)
+
+        self.app.put(f'/applet/{applet_uuid}/storage', json={'key': 'value'})
+        hits = artifact_cache.stats()['hits']
+        response = self.app.get(f'/applet/{applet_uuid}/storage')
+        self.assertEqual(response.get_json(), {'key': 'value'})
+        self.assertEqual(artifact_cache.stats()['hits'], hits + 1)
+
+    def test_artifact_cache_sees_writes_by_other_processes(self):
+        """
+        Test that by default a cached file is checked against the storage, so a write
+        that bypassed this process's cache is served.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+        html_path = os.path.join(applet_dir, 'index.html')
+        with open(html_path, 'w') as f:
+            f.write('<html><body>Old HTML</body></html>')
+        self.app.get(f'/applet/{applet_uuid}/html')
+
+        with open(html_path, 'w') as f:
+            f.write('<html><body>New HTML from another worker</body></html>')
+        response = self.app.get(f'/applet/{applet_uuid}/html')
+        self.assertIn(b'New HTML from another worker', response.data)
+
+    def test_lru_cache_evicts_by_size(self):
+        """
+        Test that the LRU cache stays within its byte budget, evicting least recently used entries.
+        """
+        cache = LRUCache(max_bytes=100, max_entry_fraction=0.5)
+        cache.put('a', 'A', 40)
+        cache.put('b', 'B', 40)
+        self.assertEqual(cache.get('a'), 'A')  # 'b' is now least recently used
+        cache.put('c', 'C', 40)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'C')
+        cache.put('huge', 'H', 60)  # Larger than the per-entry limit
+        self.assertIsNone(cache.get('huge'))
+
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['bytes'], 80)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_section_stream_parser(self):
+        """
+        Test that sections are extracted incrementally even when markers are split across chunks.
+        """
+        output = '##BEGIN_HTML##<html>hello</html>##END_HTML##\n##BEGIN_LOCAL_STORAGE##{"a": "1"}##END_LOCAL_STORAGE##'
+        for size in (1, 3, 7, len(output)):
+            parser = SectionStreamParser()
+            sections = {}
+            for start in range(0, len(output), size):
+                for marker, delta in parser.feed(output[start:start + size]):
+                    sections[marker] = sections.get(marker, '') + delta
+            self.assertEqual(sections, {'HTML': '<html>hello</html>', 'LOCAL_STORAGE': '{"a": "1"}'})
+
+    @patch.object(ai_clients, 'client')
+    def test_generate_html_streams_html_deltas(self, mock_client):
+        """
+        Test that generation forwards the HTML section while it streams and returns both sections.
+        """
+        pieces = ['##BEGIN_HT', 'ML##<html>', '<body>Hi</body>', '</html>##END_', 'HTML##',
+                  '##BEGIN_LOCAL_STORAGE##{}##END_LOCAL_STORAGE##']
+        mock_client.return_value.chat.completions.create.return_value = [
+            MagicMock(choices=[MagicMock(delta=MagicMock(content=piece))]) for piece in pieces
+        ]
+
+        deltas = []
+        html_content, local_storage_content = generate_html_from_prompt('prompt', on_html_delta=deltas.append)
+
+        self.assertEqual(html_content, '<html><body>Hi</body></html>')
+        self.assertEqual(local_storage_content, '{}')
+        self.assertEqual(''.join(deltas), html_content)
+        self.assertGreater(len(deltas), 1)
+
+    def test_upload_audio_is_spooled(self):
+        """
+        Test that uploads beyond the spool limit reach the storage from a temporary file, unchanged.
+        """
+        audio = os.urandom(64 * 1024)
+        streams = []
+
+        def save_audio(applet_uuid, file_name, stream):
+            streams.append(stream)
+            storage_backend().write_stream(applet_uuid, file_name, stream)
+
+        data = {'audio': (BytesIO(audio), 'test_audio.webm', 'audio/webm')}
+        with patch.dict(app.config, {'AUDIO_SPOOL_MAX_BYTES': 1024}), \
+                patch('app.main.save_audio', side_effect=save_audio), \
+                patch.object(job_queue, 'max_queued', -job_queue.workers), \
+                patch('app.main.delete_applet'):
+            response = self.app.post('/applet', data=data, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(streams[0].stream._rolled)
+        applet_uuid = storage_backend().applets()[0]
+        file_name = storage_backend().list(applet_uuid)[0]
+        self.assertEqual(storage_backend().read(applet_uuid, file_name)[0], audio)
+
+    @patch.object(ai_clients, 'client')
+    def test_transcribe_audio_sends_file_handle(self, mock_client):
+        """
+        Test that the recording is handed to the client as an open file rather than read into memory first.
+        """
+        path = os.path.join(self.test_dir, 'recording.webm')
+        with open(path, 'wb') as f:
+            f.write(b'test audio content')
+        mock_client.return_value.audio.transcriptions.create.return_value = MagicMock(text='Make a todo list')
+
+        self.assertEqual(transcribe_audio(path), 'Make a todo list')
+        name, file = mock_client.return_value.audio.transcriptions.create.call_args.kwargs['file']
+        self.assertEqual(name, 'recording.webm')
+        self.assertTrue(hasattr(file, 'read'))
+
+    def test_ai_client_retries_with_backoff(self):
+        """
+        Test that retryable errors are retried with bounded backoff and others are raised at once.
+        """
+        manager = AIClientManager(backend='fake', max_retries=3, backoff_seconds=0.01, max_backoff_seconds=0.02)
+        attempts = []
+
+        def flaky(client, timeout):
+            attempts.append(timeout)
+            if len(attempts) < 3:
+                raise FakeAPIError(429)
+            return 'ok'
+
+        self.assertEqual(manager.call(flaky), 'ok')
+        self.assertEqual(len(attempts), 3)
+        self.assertTrue(all(0 < timeout <= manager.timeout for timeout in attempts))
+
+        def unauthorized(client, timeout):
+            attempts.append(timeout)
+            raise FakeAPIError(401)
+
+        del attempts[:]
+        with self.assertRaises(FakeAPIError):
+            manager.call(unauthorized)
+        self.assertEqual(len(attempts), 1)
+
+        def unavailable(client, timeout):
+            raise FakeAPIError(503)
+
+        with self.assertRaises(FakeAPIError):
+            manager.call(unavailable)
+
+    def test_ai_client_concurrency_limit(self):
+        """
+        Test that calls wait for a free slot and give up at their deadline.
+        """
+        manager = AIClientManager(backend='fake', timeout=0.05, max_concurrency=1)
+        with manager.slot():
+            with self.assertRaises(AIDeadlineExceeded):
+                with manager.slot():
+                    pass
+        with manager.slot():
+            pass
+
+    def test_ai_stream_deadline(self):
+        """
+        Test that a stream still running at the call deadline is closed and fails, in sync and async callers.
+        """
+        fake_options = {'first_token_seconds': 0, 'token_seconds': 0.05, 'transcription_seconds': 0}
+        previous = ai_clients.backend
+        ai_clients.configure('fake', timeout=0.2, fake_options=fake_options)
+        try:
+            start = time.monotonic()
+            with self.assertRaises(AIDeadlineExceeded):
+                generate_html_from_prompt('prompt')
+            with self.assertRaises(AIDeadlineExceeded):
+                asyncio.run(agenerate_html_from_prompt('prompt'))
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            ai_clients.configure(previous)
+
+    def test_ai_client_backoff_frees_its_slot(self):
+        """
+        Test that a call waiting to retry hands its concurrency slot to other calls meanwhile.
+        """
+        manager = AIClientManager(backend='fake', max_concurrency=1, backoff_seconds=0.2, max_backoff_seconds=0.2)
+        attempts = []
+        other_ran = threading.Event()
+
+        def other():
+            with manager.slot():
+                other_ran.set()
+
+        def flaky_then_other(client, timeout):
+            attempts.append(timeout)
+            if len(attempts) == 1:
+                threading.Thread(target=other).start()
+                raise FakeAPIError(503)
+            return 'ok'
+
+        with patch('app.ai_client.random.uniform', return_value=0.2):
+            with manager.slot() as slot:
+                self.assertEqual(manager.call(flaky_then_other, slot=slot), 'ok')
+                self.assertTrue(other_ran.is_set())  # It ran during the backoff
+                self.assertTrue(slot.held)
+
+    def test_fake_ai_backend(self):
+        """
+        Test that the fake backend answers the sync and async generation and transcription calls.
+        """
+        path = os.path.join(self.test_dir, 'recording.webm')
+        with open(path, 'wb') as f:
+            f.write(b'test audio content')
+        fake_options = {'first_token_seconds': 0, 'token_seconds': 0, 'transcription_seconds': 0}
+        previous = ai_clients.backend
+        ai_clients.configure('fake', fake_options=fake_options)
+        try:
+            html_content, local_storage_content = generate_html_from_prompt('prompt')
+            self.assertIn('<h1>Applet</h1>', html_content)
+            self.assertEqual(json.loads(local_storage_content), {'items': '[]'})
+            self.assertEqual(asyncio.run(agenerate_html_from_prompt('prompt')), (html_content, local_storage_content))
+            self.assertEqual(asyncio.run(atranscribe_audio(path)), transcribe_audio(path))
+        finally:
+            ai_clients.configure(previous)
+
+    def test_compact_audio(self):
+        """
+        Test that transcoding is used only when it yields a smaller file, and the original is sent otherwise.
+        """
+        path = os.path.join(self.test_dir, 'recording.webm')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 1000)
+
+        with compact_audio(path, None) as upload_path:
+            self.assertEqual(upload_path, path)
+
+        def transcode(command, **kwargs):
+            with open(command[-1], 'wb') as f:
+                f.write(b'y' * 100)
+
+        with patch('app.audio.subprocess.run', side_effect=transcode) as mock_run:
+            with compact_audio(path, 'ffmpeg') as upload_path:
+                self.assertNotEqual(upload_path, path)
+                with open(upload_path, 'rb') as f:
+                    self.assertEqual(f.read(), b'y' * 100)
+            self.assertIn('16000', mock_run.call_args.args[0])
+        self.assertFalse(os.path.exists(upload_path))
+
+        with patch('app.audio.subprocess.run', side_effect=subprocess.CalledProcessError(1, 'ffmpeg')):
+            with compact_audio(path, 'ffmpeg') as upload_path:
+                self.assertEqual(upload_path, path)
+
+    def test_applet_events_not_found(self):
+        """
+        Test subscribing to the change feed of an applet that does not exist.
+        Should return a 404 error.
+        """
+        applet_uuid = str(uuid.uuid4())
+        response = self.app.get(f'/applet/{applet_uuid}/events')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'Applet not found')
+
+    def test_applet_events_storage_change(self):
+        """
+        Test that a storage update is pushed to change feed subscribers.
+        """
+        applet_uuid = str(uuid.uuid4())
+        applet_dir = os.path.join(self.test_dir, applet_uuid)
+        os.makedirs(applet_dir, exist_ok=True)
+
+        response = self.app.get(f'/applet/{applet_uuid}/events')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        stream = (chunk.decode() for chunk in response.iter_encoded())
+        self.assertIn('retry:', next(stream))
+
+        self.app.put(f'/applet/{applet_uuid}/storage', json={'key': 'value'}, headers={'X-Client-Id': 'tab-1'})
+
+        message = next(stream)
+        self.assertIn('event: storage', message)
+        self.assertIn('"source": "tab-1"', message)
+        response.close()
+
+    def test_applet_events_partial_snapshot(self):
+        """
+        Test that a subscriber joining during a generation first receives the HTML streamed so far.
+        """
+        applet_uuid = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.test_dir, applet_uuid), exist_ok=True)
+
+        partial = begin_partial(applet_uuid)
+        try:
+            partial.append('<html><body>Par')
+            response = self.app.get(f'/applet/{applet_uuid}/events')
+            stream = (chunk.decode() for chunk in response.iter_encoded())
+            next(stream)  # retry directive
+            message = next(stream)
+            self.assertIn('event: partial', message)
+            self.assertIn('"offset": 0', message)
+            self.assertIn('<html><body>Par', message)
+            response.close()
+        finally:
+            end_partial(applet_uuid, partial)
+
+
+    def test_applet_events_failed_generation(self):
+        """
+        Test that a generation failing after it streamed HTML tells subscribers to drop the partial render.
+        """
+        applet_uuid = str(uuid.uuid4())
+        os.makedirs(os.path.join(self.test_dir, applet_uuid), exist_ok=True)
+        response = self.app.get(f'/applet/{applet_uuid}/events')
+        stream = (chunk.decode() for chunk in response.iter_encoded())
+        next(stream)  # retry directive
+
+        def fail(prompt, on_html_delta):
+            on_html_delta('<html><body>Trunc')
+            raise RuntimeError('stream broke')
+
+        with patch('app.main.generate_html_from_prompt', side_effect=fail), app.app_context(), \
+                patch.dict(app.config, {'PROMPT_CACHE_ENABLED': False}):
+            with self.assertRaises(RuntimeError):
+                generate_streaming(applet_uuid, 'prompt', ('prompt',))
+        self.assertIn('event: partial', next(stream))
+        self.assertIn('event: aborted', next(stream))
+        response.close()
+
+
+class StorageBackendConformance:
+    """
+    Behaviour every storage backend must provide; subclasses implement make_backend().
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='backend-test-')
+        self.backend = self.make_backend()
+        self.applet = str(uuid.uuid4())
+        self.previous_backend = storage_backend()
+
+    def tearDown(self):
+        configure_storage(self.previous_backend)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_file(self):
+        self.assertIsNone(self.backend.read(self.applet, 'index.html'))
+        self.assertIsNone(self.backend.stat(self.applet, 'index.html'))
+        self.assertFalse(self.backend.exists(self.applet))
+        self.assertEqual(self.backend.list(self.applet), [])
+        self.backend.delete(self.applet, 'index.html')  # Not an error
+
+    def test_write_and_read(self):
+        self.backend.create(self.applet)
+        stat = self.backend.write(self.applet, 'index.html', b'<html></html>')
+        self.assertEqual(stat.st_size, len(b'<html></html>'))
+        data, read_stat = self.backend.read(self.applet, 'index.html')
+        self.assertEqual(data, b'<html></html>')
+        self.assertEqual((read_stat.st_mtime_ns, read_stat.st_size), (stat.st_mtime_ns, stat.st_size))
+        self.assertEqual(self.backend.stat(self.applet, 'index.html').st_size, stat.st_size)
+
+    def test_rewrite_never_goes_back_in_time(self):
+        self.backend.create(self.applet)
+        first = self.backend.write(self.applet, 'storage.json', b'{}')
+        second = self.backend.write(self.applet, 'storage.json', b'{"a": "1"}')
+        self.assertGreaterEqual(second.st_mtime_ns, first.st_mtime_ns)
+        self.assertEqual(self.backend.read(self.applet, 'storage.json')[0], b'{"a": "1"}')
+
+    def test_nested_names_are_not_listed(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'versions/blobs/ab/abc', b'blob')
+        self.backend.write(self.applet, 'b.prompt', b'second')
+        self.backend.write(self.applet, 'a.prompt', b'first')
+        self.assertEqual(self.backend.list(self.applet), ['a.prompt', 'b.prompt'])
+        self.assertEqual(self.backend.read(self.applet, 'versions/blobs/ab/abc')[0], b'blob')
+
+    def test_append(self):
+        self.backend.create(self.applet)
+        self.backend.append(self.applet, 'versions/manifest.jsonl', b'one\n')
+        self.backend.append(self.applet, 'versions/manifest.jsonl', b'two\n')
+        self.assertEqual(self.backend.read(self.applet, 'versions/manifest.jsonl')[0], b'one\ntwo\n')
+
+    def test_delete_and_remove(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'index.html', b'x')
+        self.backend.write(self.applet, 'storage.json', b'{}')
+        self.backend.delete(self.applet, 'index.html')
+        self.assertEqual(self.backend.list(self.applet), ['storage.json'])
+        self.assertIn(self.applet, self.backend.applets())
+
+        self.backend.remove(self.applet)
+        self.assertFalse(self.backend.exists(self.applet))
+        self.assertNotIn(self.applet, self.backend.applets())
+        self.assertIsNone(self.backend.read(self.applet, 'storage.json'))
+
+    def test_files_lists_nested_names(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'versions/blobs/ab/abc', b'blob')
+        self.backend.write(self.applet, 'index.html', b'x')
+        self.assertEqual(sorted(self.backend.files(self.applet)), ['index.html', 'versions/blobs/ab/abc'])
+
+    def test_write_stream_and_local_path(self):
+        self.backend.create(self.applet)
+        self.backend.write_stream(self.applet, 'audio.webm', BytesIO(b'audio bytes'))
+        with self.backend.local_path(self.applet, 'audio.webm') as path:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'audio bytes')
+        with self.assertRaises(FileNotFoundError):
+            with self.backend.local_path(self.applet, 'missing.webm'):
+                pass
+
+    def test_concurrent_patches_are_serialised(self):
+        configure_storage(self.backend)
+        self.backend.create(self.applet)
+
+        def patch_keys(n):
+            for i in range(10):
+                patch_local_storage(self.applet, set_items={f'{n}-{i}': str(i)})
+
+        threads = [threading.Thread(target=patch_keys, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        artifact_cache.clear()
+        self.assertEqual(len(json.loads(self.backend.read(self.applet, 'storage.json')[0])), 40)
+
+    def test_applet_routes(self):
+        configure_storage(self.backend)
+        client = app.test_client()
+        self.assertEqual(client.put(f'/applet/{self.applet}/storage', json={'key': 'value'}).status_code, 404)
+
+        self.backend.create(self.applet)
+        save_html_files('<html><body>Hello</body></html>', self.applet)
+        self.assertEqual(client.put(f'/applet/{self.applet}/storage', json={'key': 'value'}).status_code, 200)
+        artifact_cache.clear()  # Read back from the backend
+        self.assertEqual(client.get(f'/applet/{self.applet}/storage').get_json(), {'key': 'value'})
+        self.assertIn(b'Hello', client.get(f'/applet/{self.applet}/html').data)
+        record_version(self.applet, 'change')
+        self.assertEqual(read_version(self.applet, 1)['html'], '<html><body>Hello</body></html>')
+
+
+class FilesystemBackendTestCase(StorageBackendConformance, unittest.TestCase):
+    def make_backend(self):
+        return FilesystemBackend(self.tmp_dir)
+
+
+class SQLiteBackendTestCase(StorageBackendConformance, unittest.TestCase):
+    def make_backend(self):
+        return SQLiteBackend(os.path.join(self.tmp_dir, 'applets.sqlite3'))
+
+
+class MemoryBackendTestCase(StorageBackendConformance, unittest.TestCase):
+    def make_backend(self):
+        return MemoryBackend()
+
+
+class ColdTierTestCase(StorageBackendConformance, unittest.TestCase):
+    def make_backend(self):
+        return ColdTier(MemoryBackend(), os.path.join(self.tmp_dir, 'cold'))
+
+    def test_freeze_and_restore(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'index.html', b'<html></html>')
+        self.backend.write(self.applet, 'versions/blobs/ab/abc', b'blob')
+        self.backend.write(self.applet, 'index.html.gz', b'sidecar')
+        read, archived = self.backend.freeze(self.applet, skip_suffixes=['.gz'])
+        self.assertEqual(read, len(b'<html></html>') + len(b'blob'))
+        self.assertGreater(archived, 0)
+        self.assertFalse(self.backend.hot.exists(self.applet))
+        self.assertTrue(self.backend.exists(self.applet))
+        self.assertNotIn(self.applet, self.backend.applets())
+
+        self.assertEqual(self.backend.read(self.applet, 'versions/blobs/ab/abc')[0], b'blob')
+        self.assertEqual(self.backend.restored, 1)
+        self.assertEqual(sorted(self.backend.files(self.applet)), ['index.html', 'versions/blobs/ab/abc'])
+        self.assertEqual(self.backend.cold_applets(), [])
+
+        self.backend.freeze(self.applet)
+        self.backend.write(self.applet, 'storage.json', b'{}')  # Writes restore first
+        self.assertEqual(self.backend.read(self.applet, 'index.html')[0], b'<html></html>')
+        self.backend.freeze(self.applet)
+        self.backend.remove(self.applet)
+        self.assertFalse(self.backend.exists(self.applet))
+
+    def test_freeze_keeps_sidecars(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'index.html', b'<html></html>')
+        self.backend.write(self.applet, 'index.html.gz', b'sidecar')
+        self.backend.freeze(self.applet)
+
+        self.assertEqual(self.backend.read(self.applet, 'index.html.gz')[0], b'sidecar')
+        # Restored after its file, so it is not taken for a sidecar of an older version
+        self.assertGreaterEqual(self.backend.stat(self.applet, 'index.html.gz').st_mtime_ns,
+                                self.backend.stat(self.applet, 'index.html').st_mtime_ns)
+
+    def test_freeze_removes_hot_copy_after_archive(self):
+        self.backend.create(self.applet)
+        self.backend.write(self.applet, 'index.html', b'<html></html>')
+        remove = self.backend.hot.remove
+
+        def check_archive_then_remove(applet):
+            self.assertTrue(self.backend.is_cold(applet))
+            remove(applet)
+
+        with patch.object(self.backend.hot, 'remove', side_effect=check_archive_then_remove):
+            self.backend.freeze(self.applet)
+        self.assertFalse(self.backend.hot.exists(self.applet))
+
+
 if __name__ == '__main__':
     unittest.main()